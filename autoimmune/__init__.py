@@ -0,0 +1,12 @@
+"""Single entry point for the project: python -m autoimmune fetch|transform|analyze|plot|all.
+
+The project's modules live under src/ as top-level packages (utils, fetch,
+transform, analyze, visualization); importing this package puts src/ on
+sys.path so they resolve without PYTHONPATH=src.
+"""
+import sys
+from pathlib import Path
+
+SRC = Path(__file__).resolve().parents[1] / "src"
+if str(SRC) not in sys.path:
+    sys.path.insert(0, str(SRC))
@@ -0,0 +1,145 @@
+"""Command line for the whole project.
+
+    python -m autoimmune --help
+    python -m autoimmune fetch [pubmed|trends|cdc] [step options]
+    python -m autoimmune transform [options]
+    python -m autoimmune analyze [correlations|significance|granger|ccf|gender-ratios|attention] [step options]
+    python -m autoimmune plot [correlations|followups|disparity|attention] [step options]
+    python -m autoimmune all [--fetch]          # transform, analyze and plot in one process
+    python -m autoimmune pipeline [options]     # incremental runner (src/pipeline.py)
+    python -m autoimmune serve [--port N]       # local JSON query service (src/service/query_service.py)
+
+A command without a step runs all of the command's default steps in
+order with their default options, sharing one utils.context.DataContext
+so each dataset is parsed once (`all` shares one across commands). Options after a step go to that
+step's own parser (`python -m autoimmune analyze granger --help`).
+
+Steps are named by "module:function" strings and imported only when they
+run, so `--help` and light steps do not pay for matplotlib, seaborn,
+scipy, statsmodels or the fetch clients. autoimmune/importtime.py keeps
+that in check.
+"""
+import argparse
+import importlib
+import inspect
+import sys
+import time
+
+# command -> [(step, "module:function", run by default, help)]
+COMMANDS = {
+    "fetch": [
+        ("pubmed", "fetch.pubmed_counts_by_gender:main", True, "PubMed counts by disease, gender and year"),
+        ("trends", "fetch.google_trends:main", True, "Google Trends interest"),
+        ("cdc", "fetch.cdc_wonder_by_gender:main", True, "CDC WONDER deaths by year and sex"),
+    ],
+    "transform": [
+        ("merge", "transform.clean_merge_gendered:main", True, "clean and merge signals, build the signal cube"),
+    ],
+    "analyze": [
+        ("correlations", "analyze.correlations:main", True, "lagged Pearson/Spearman correlations"),
+        ("significance", "analyze.significance:main", True, "bootstrap CIs and permutation p-values"),
+        ("granger", "analyze.granger:main", True, "Granger causality tests"),
+        ("gender-ratios", "analyze.gender_ratios:main", True, "female:male ratio table"),
+        ("attention", "analyze.ratios_time_series:main", True, "normalized attention scores"),
+        ("ccf", "analyze.ccf:main", False, "FFT cross-correlations over signal-cube series"),
+    ],
+    "plot": [
+        ("correlations", "visualization.plot_correlations:main", True, "correlation heatmaps and lag plots"),
+        ("followups", "visualization.corr_followups:main", True, "z-score overlays, CCF plots, Granger summaries"),
+        ("disparity", "visualization.gender_disparity_plots:main", True, "scatter and time-series plots by gender"),
+        ("attention", "visualization.plots:main", True, "attention score line plots"),
+    ],
+    "serve": [
+        ("api", "service.query_service:main", True, "local JSON query service over the processed signals"),
+    ],
+}
+ALL_ORDER = ["transform", "analyze", "plot"]
+
+
+def load(target: str):
+    module, func = target.split(":")
+    return getattr(importlib.import_module(module), func)
+
+
+def run_step(command: str, step: str, target: str, argv, ctx=None) -> None:
+    start = time.perf_counter()
+    func = load(target)
+    # step parsers take their usage line from argv[0]
+    sys.argv = [f"python -m autoimmune {command} {step}", *argv]
+    print(f"== {command} {step}", flush=True)
+    if ctx is not None and "ctx" in inspect.signature(func).parameters:
+        func(list(argv), ctx=ctx)
+    else:
+        func(list(argv))
+    print(f"== {command} {step}: done in {time.perf_counter() - start:.1f}s", flush=True)
+
+
+def command_help(command: str) -> str:
+    lines = [f"usage: python -m autoimmune {command} [step] [step options]", "", "steps:"]
+    for step, _, default, text in COMMANDS[command]:
+        lines.append(f"  {step:<14} {text}{'' if default else ' (only when named)'}")
+    lines += ["", "Without a step every step not marked otherwise runs with default options.",
+              f"`python -m autoimmune {command} STEP --help` shows a step's options."]
+    return "\n".join(lines)
+
+
+def new_context():
+    from utils.context import DataContext
+    return DataContext()
+
+
+def run_command(command: str, args, ctx=None) -> None:
+    """Run one named step, or every default step sharing one DataContext (created here unless given)."""
+    steps = COMMANDS[command]
+    if len(steps) == 1:  # e.g. `transform --chunked`
+        step, target, _, _ = steps[0]
+        run_step(command, step, target, args, ctx)
+        return
+    if args and args[0] in ("-h", "--help"):
+        print(command_help(command))
+        return
+    if args and not args[0].startswith("-"):
+        named = {step: target for step, target, _, _ in steps}
+        if args[0] not in named:
+            sys.exit(f"unknown {command} step {args[0]!r}; choose from {', '.join(named)}")
+        run_step(command, args[0], named[args[0]], args[1:])
+        return
+    if args:
+        sys.exit(f"options go after a step name: python -m autoimmune {command} STEP {' '.join(args)}")
+    owned = ctx is None
+    ctx = ctx or new_context()
+    for step, target, default, _ in steps:
+        if default:
+            run_step(command, step, target, [], ctx)
+    if owned:
+        print(f"== data parsed: {ctx.summary()}", flush=True)
+
+
+def main(argv=None):
+    epilog = "\n".join(f"  {cmd:<10} {', '.join(s for s, *_ in steps)}" for cmd, steps in COMMANDS.items())
+    ap = argparse.ArgumentParser(
+        prog="python -m autoimmune",
+        description="Autoimmune disease gender-disparity pipeline.",
+        epilog=f"commands and their steps:\n{epilog}\n  all        transform, analyze and plot (--fetch to fetch first)\n"
+               "  pipeline   incremental runner; only re-runs stale stages",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    ap.add_argument("command", choices=[*COMMANDS, "all", "pipeline"])
+    ap.add_argument("args", nargs=argparse.REMAINDER, help="step name and its options")
+    ns = ap.parse_args(argv)
+    if ns.command == "pipeline":
+        load("pipeline:main")(ns.args)
+    elif ns.command == "all":
+        if ns.args and ns.args[0] in ("-h", "--help"):
+            print("usage: python -m autoimmune all [--fetch]\n\nRuns " + ", ".join(ALL_ORDER)
+                  + " with default options, in one process.")
+            return
+        unknown = [a for a in ns.args if a != "--fetch"]
+        if unknown:
+            sys.exit(f"all takes only --fetch; got {' '.join(unknown)}")
+        ctx = new_context()
+        for command in (["fetch"] if "--fetch" in ns.args else []) + ALL_ORDER:
+            run_command(command, [], ctx)
+        print(f"== data parsed: {ctx.summary()}", flush=True)
+    else:
+        run_command(ns.command, ns.args)
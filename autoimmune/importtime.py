@@ -0,0 +1,75 @@
+"""Import-time budget check for the CLI.
+
+Runs each command below under `python -X importtime -m autoimmune ...`,
+sums the cumulative import time of the top-level imports (best of --repeat
+runs) and fails if a command goes over its budget or imports a module it
+should not need.
+
+    python -m autoimmune.importtime
+    python -m autoimmune.importtime --repeat 5 --scale 2   # slower machine: double every budget
+"""
+import argparse
+import re
+import subprocess
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+PLOTTING = ["matplotlib", "seaborn", "scipy", "statsmodels"]
+FETCHING = ["pytrends", "requests", "yaml", "dotenv"]
+# (argv, budget in seconds, top-level modules that must not be imported)
+CHECKS = [
+    (["--help"], 0.15, ["pandas", "numpy", *PLOTTING, *FETCHING]),
+    (["analyze", "--help"], 0.15, ["pandas", "numpy", *PLOTTING, *FETCHING]),
+    (["analyze", "attention", "--help"], 0.9, [*PLOTTING, *FETCHING, "pyarrow"]),
+    (["analyze", "correlations", "--help"], 0.9, [*PLOTTING, *FETCHING, "pyarrow"]),
+    (["transform", "--help"], 0.9, [*PLOTTING, *FETCHING, "pyarrow"]),
+]
+LINE = re.compile(r"import time:\s+(\d+)\s+\|\s+(\d+)\s+\|( *)(\S+)")
+
+
+def import_profile(argv) -> dict:
+    """{top-level module: cumulative seconds} for one run of the CLI."""
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-m", "autoimmune", *argv],
+                          cwd=ROOT, capture_output=True, text=True)
+    out = {}
+    for m in LINE.finditer(proc.stderr):
+        _, cumulative, indent, name = m.groups()
+        if len(indent) == 1:  # one space: imported directly by the interpreter or __main__
+            out[name] = out.get(name, 0) + int(cumulative) / 1e6
+    return out
+
+
+def check(argv, budget: float, forbidden, repeat: int = 3):
+    """(seconds, slowest imports, forbidden modules imported) for the best of `repeat` runs."""
+    best = None
+    for _ in range(repeat):
+        prof = import_profile(argv)
+        if best is None or sum(prof.values()) < sum(best.values()):
+            best = prof
+    total = sum(best.values())
+    slowest = sorted(best.items(), key=lambda kv: -kv[1])[:3]
+    loaded = [m for m in forbidden if any(name == m or name.startswith(m + ".") for name in best)]
+    return total, slowest, loaded
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Check CLI import time against per-command budgets")
+    ap.add_argument("--repeat", type=int, default=3, help="runs per command; the fastest counts")
+    ap.add_argument("--scale", type=float, default=1.0, help="multiply every budget")
+    args = ap.parse_args(argv)
+    failed = 0
+    for cmd, budget, forbidden in CHECKS:
+        budget *= args.scale
+        total, slowest, loaded = check(cmd, budget, forbidden, args.repeat)
+        ok = total <= budget and not loaded
+        failed += not ok
+        top = ", ".join(f"{name} {secs * 1000:.0f}ms" for name, secs in slowest)
+        print(f"{'ok  ' if ok else 'FAIL'} {' '.join(cmd):<30} {total * 1000:6.0f}ms / {budget * 1000:.0f}ms  ({top})")
+        if loaded:
+            print(f"     imports {', '.join(loaded)}")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
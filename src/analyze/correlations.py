@@ -0,0 +1,140 @@
+"""Lagged Pearson/Spearman correlations between the merged signals.
+
+Writes reports/correlation_summary.csv with one row per
+disease_id x gender x pair x lag (plus disease_id = gender = 'ALL' rows that
+pool every disease x gender), columns:
+disease_id, gender, pair, lag, pearson_r, spearman_r, n
+
+For pair "a-b" at lag L, a in year t is paired with b in year t + L, so a
+positive lag means a leads b. Series are aligned on calendar years; a year
+missing in either series drops that pair of points, and n counts the points
+used. Correlations with fewer than MIN_N points are NaN.
+
+All series x lags are computed at once: each signal is a (series x year)
+array, the lagged copies of b are stacked into a (lag x series x year)
+array, and the statistics are masked sums over the last axis.
+
+    PYTHONPATH=src python src/analyze/correlations.py --max-lag 5
+"""
+import argparse
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from utils.io import REPORTS, read_signals, memory_report, write_csv
+from utils.logging import get_logger
+
+logger = get_logger("correlations")
+
+PAIRS = [("interest", "count"), ("interest", "deaths"), ("count", "deaths")]
+KEYS = ["disease_id", "gender"]
+MIN_N = 3
+OUT_PATH = REPORTS / "correlation_summary.csv"
+
+
+def year_matrix(df: pd.DataFrame, signal: str, index: pd.MultiIndex, years) -> np.ndarray:
+    """(series x year) float array of `signal`; NaN where a year is missing."""
+    wide = df.pivot_table(index=KEYS, columns="year", values=signal, aggfunc="mean", observed=True)
+    return wide.reindex(index=index, columns=years).to_numpy(dtype="float64")
+
+
+def lagged(b: np.ndarray, lags) -> np.ndarray:
+    """(lag x series x year) stack where [i, :, t] is b[:, t + lags[i]] (NaN outside the range)."""
+    n_t = b.shape[-1]
+    out = np.full((len(lags),) + b.shape, np.nan)
+    for i, lag in enumerate(lags):
+        if lag >= 0:
+            out[i, ..., :n_t - lag] = b[..., lag:]
+        else:
+            out[i, ..., -lag:] = b[..., :n_t + lag]
+    return out
+
+
+def masked_pearson(a: np.ndarray, b: np.ndarray):
+    """Pearson r and n over the last axis, using only positions where both are finite."""
+    mask = ~(np.isnan(a) | np.isnan(b))
+    n = mask.sum(axis=-1)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        ma = np.where(mask, a, 0).sum(axis=-1) / n
+        mb = np.where(mask, b, 0).sum(axis=-1) / n
+        da = np.where(mask, a - ma[..., None], 0)
+        db = np.where(mask, b - mb[..., None], 0)
+        r = (da * db).sum(axis=-1) / np.sqrt((da * da).sum(axis=-1) * (db * db).sum(axis=-1))
+    return np.where(n >= MIN_N, r, np.nan), n
+
+
+def masked_ranks(x: np.ndarray, mask: np.ndarray) -> np.ndarray:
+    """Average ranks along the last axis among the `mask`ed positions; NaN elsewhere."""
+    flat = np.where(mask, x, np.nan).reshape(-1, x.shape[-1])
+    return pd.DataFrame(flat).rank(axis=1).to_numpy().reshape(x.shape)
+
+
+def masked_spearman(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    mask = ~(np.isnan(a) | np.isnan(b))
+    return masked_pearson(masked_ranks(a, mask), masked_ranks(b, mask))[0]
+
+
+def lagged_correlations(a: np.ndarray, b: np.ndarray, lags):
+    """Per-series and pooled (all series together) Pearson, Spearman and n for every lag.
+
+    `a` and `b` are (series x year); per-series results are (lag x series),
+    pooled results are (lag,).
+    """
+    a3 = np.broadcast_to(a, (len(lags),) + a.shape)
+    b3 = lagged(b, lags)
+    pearson, n = masked_pearson(a3, b3)
+    spearman = masked_spearman(a3, b3)
+    flat = (len(lags), -1)
+    pooled_a, pooled_b = a3.reshape(flat), b3.reshape(flat)
+    pooled_pearson, pooled_n = masked_pearson(pooled_a, pooled_b)
+    pooled_spearman = masked_spearman(pooled_a, pooled_b)
+    return (pearson, spearman, n), (pooled_pearson, pooled_spearman, pooled_n)
+
+
+def correlation_summary(df: pd.DataFrame, pairs=PAIRS, max_lag: int = 5) -> pd.DataFrame:
+    df = df.astype({k: str for k in KEYS})
+    index = pd.MultiIndex.from_frame(df[KEYS].drop_duplicates().sort_values(KEYS))
+    years = np.arange(df["year"].min(), df["year"].max() + 1)
+    lags = np.arange(-max_lag, max_lag + 1)
+    signals = {s for pair in pairs for s in pair}
+    mats = {s: year_matrix(df, s, index, years) for s in signals}
+
+    per_series, pooled = [], []
+    for a, b in pairs:
+        (pearson, spearman, n), (p_pearson, p_spearman, p_n) = lagged_correlations(mats[a], mats[b], lags)
+        # (lag x series) arrays flattened series-major, so each series' lags are contiguous
+        per_series.append(pd.DataFrame({
+            "disease_id": np.repeat(index.get_level_values(0), len(lags)),
+            "gender": np.repeat(index.get_level_values(1), len(lags)),
+            "pair": f"{a}-{b}",
+            "lag": np.tile(lags, len(index)),
+            "pearson_r": pearson.T.ravel(),
+            "spearman_r": spearman.T.ravel(),
+            "n": n.T.ravel(),
+        }))
+        pooled.append(pd.DataFrame({"disease_id": "ALL", "gender": "ALL", "pair": f"{a}-{b}", "lag": lags,
+                                    "pearson_r": p_pearson, "spearman_r": p_spearman, "n": p_n}))
+    out = pd.concat(per_series, ignore_index=True).sort_values(KEYS, kind="stable")
+    return pd.concat([out, *pooled], ignore_index=True)
+
+
+def main(argv=None, ctx=None):
+    ap = argparse.ArgumentParser(description="Lagged correlations between PubMed, Trends and CDC signals")
+    ap.add_argument("--max-lag", type=int, default=5, help="lags -N..N years")
+    ap.add_argument("--out", type=Path, default=OUT_PATH)
+    args = ap.parse_args(argv)
+    signals = sorted({s for pair in PAIRS for s in pair})
+    cols = ["year", *KEYS, *signals]
+    df = ctx.signals(cols) if ctx else read_signals(columns=cols)
+    memory_report(df, logger, "merged signals")
+    df = df.astype({s: "float64" for s in signals})
+    out = correlation_summary(df, max_lag=args.max_lag)
+    write_csv(out, args.out)
+    n_series = out.loc[out["disease_id"] != "ALL", KEYS].drop_duplicates().shape[0]
+    logger.info(f"Wrote {len(out)} rows ({n_series} series x {len(PAIRS)} pairs x "
+                f"{2 * args.max_lag + 1} lags, plus pooled ALL) to {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+"""Female:male ratio table: one row per disease x year with every signal side by side.
+
+The merged signals are pivoted once into data/processed/gender_ratios.{csv,parquet}
+with, for each signal in SIGNALS, the columns
+{signal}_women, {signal}_men, {signal}_ratio (women / men)
+and, for the count-based signals, a 95% CI of the ratio from the
+Poisson counts behind it: {signal}_ratio_lo, {signal}_ratio_hi.
+The log ratio has standard error sqrt(1/women + 1/men) of the underlying
+counts (PubMed articles for count, CDC deaths for deaths and crude_rate,
+treating population as fixed). Trends interest is an index, not a count,
+so it has no CI. Ratios with a zero or missing denominator are NaN.
+
+Consumers index into the table instead of masking the long frame:
+
+    from analyze.gender_ratios import RatioTable
+    ratios = RatioTable.load()
+    ratios.lookup("ms", years=(2010, 2020), columns=["count_ratio", "count_ratio_lo", "count_ratio_hi"])
+
+    PYTHONPATH=src python src/analyze/gender_ratios.py
+"""
+import argparse
+
+import numpy as np
+import pandas as pd
+
+from utils.io import PROCESSED, read_signals, read_table, memory_report, write_table
+from utils.logging import get_logger
+
+logger = get_logger("gender_ratios")
+
+SIGNALS = ["count", "interest", "deaths", "crude_rate"]
+# signal -> signal whose counts give the ratio's CI
+CI_COUNTS = {"count": "count", "deaths": "deaths", "crude_rate": "deaths"}
+KEYS = ["disease_id", "year"]
+GENDERS = ["women", "men"]
+Z = 1.959963984540054  # two-sided 95%
+TABLE = "gender_ratios"
+
+
+def ratio_ci(women: pd.Series, men: pd.Series, ratio: pd.Series, z: float = Z):
+    """Lower and upper bounds of `ratio` from Poisson counts women, men (NaN when either is zero)."""
+    with np.errstate(divide="ignore", invalid="ignore"):
+        se = np.sqrt(1 / women.where(women > 0) + 1 / men.where(men > 0))
+    return ratio * np.exp(-z * se), ratio * np.exp(z * se)
+
+
+def ratio_table(df: pd.DataFrame, signals=SIGNALS) -> pd.DataFrame:
+    """Wide women/men/ratio table from the long merged signals, sorted by disease_id, year."""
+    df = df.astype({"disease_id": str, "gender": str})
+    df = df[df["gender"].isin(GENDERS)]
+    wide = df.pivot_table(index=KEYS, columns="gender", values=signals, aggfunc="mean", dropna=False)
+    wide = wide.astype("float64")
+    out = pd.DataFrame(index=wide.index)
+    for s in signals:
+        women, men = wide[(s, "women")], wide[(s, "men")]
+        out[f"{s}_women"] = women
+        out[f"{s}_men"] = men
+        out[f"{s}_ratio"] = women / men.where(men != 0)
+        if s in CI_COUNTS:
+            c = CI_COUNTS[s]
+            out[f"{s}_ratio_lo"], out[f"{s}_ratio_hi"] = ratio_ci(wide[(c, "women")], wide[(c, "men")],
+                                                                  out[f"{s}_ratio"])
+    return out.sort_index().reset_index()
+
+
+class RatioTable:
+    """The ratio table indexed by a sorted (disease_id, year) MultiIndex.
+
+    lookup() slices the index, which pandas resolves by binary search on the
+    sorted levels rather than comparing every row.
+    """
+
+    def __init__(self, df: pd.DataFrame):
+        self.df = df.astype({"disease_id": str, "year": "int64"}).set_index(KEYS).sort_index()
+
+    @classmethod
+    def load(cls, columns=None, base=PROCESSED):
+        cols = None if columns is None else list(dict.fromkeys(KEYS + list(columns)))
+        return cls(read_table(TABLE, columns=cols, base=base))
+
+    @property
+    def diseases(self) -> list:
+        return list(self.df.index.get_level_values(0).unique())
+
+    def lookup(self, disease_id=None, years=None, columns=None) -> pd.DataFrame:
+        """Rows for one disease (or all) and an inclusive (first, last) year range (either end may be None)."""
+        first, last = years if years is not None else (None, None)
+        if disease_id is not None and disease_id not in self.df.index.levels[0]:
+            rows = self.df.iloc[:0]
+        else:
+            rows = self.df.loc[(slice(None) if disease_id is None else disease_id, slice(first, last)), :]
+        return rows if columns is None else rows[list(columns)]
+
+
+def main(argv=None, ctx=None):
+    ap = argparse.ArgumentParser(description="Female:male ratio table for every disease x year")
+    ap.parse_args(argv)
+    cols = ["year", "disease_id", "gender", *SIGNALS]
+    df = ctx.signals(cols) if ctx else read_signals(columns=cols)
+    memory_report(df, logger, "merged signals")
+    out = ratio_table(df)
+    write_table(out, TABLE, partition_cols=["disease_id"])
+    logger.info(f"Wrote {len(out)} disease x year rows with {len(SIGNALS)} signal ratios to {TABLE}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,165 @@
+"""Granger causality tests over every disease x gender x directed pair.
+
+For each series and each direction (cause -> effect) this runs statsmodels'
+grangercausalitytests up to --max-lag and keeps, per lag, the SSR F test,
+the SSR chi-square test and the likelihood-ratio test. Results go to
+reports/granger_results.csv with columns:
+disease_id, gender, cause, effect, lag, n, f_stat, f_pvalue, df_num,
+df_denom, chi2_stat, chi2_pvalue, lr_stat, lr_pvalue, error
+
+Series are aligned on year, trimmed to the years where both are present at
+the ends, and interior gaps are forward-filled. Fits run in a process pool
+and are cached in data/cache/granger/ keyed by a hash of the two input
+series and the max lag, so a rerun only fits series whose data changed.
+
+    PYTHONPATH=src python src/analyze/granger.py --max-lag 3 --jobs 4
+"""
+import argparse
+import contextlib
+import hashlib
+import io
+import json
+import os
+import warnings
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from utils.io import CACHE, REPORTS, read_signals, write_csv
+from utils.logging import get_logger
+
+logger = get_logger("granger")
+
+PAIRS = [("interest", "count"), ("interest", "deaths"), ("count", "deaths")]
+DIRECTIONS = PAIRS + [(b, a) for a, b in PAIRS]
+KEYS = ["disease_id", "gender"]
+CACHE_DIR = CACHE / "granger"
+OUT_PATH = REPORTS / "granger_results.csv"
+COLUMNS = KEYS + ["cause", "effect", "lag", "n", "f_stat", "f_pvalue", "df_num", "df_denom",
+                  "chi2_stat", "chi2_pvalue", "lr_stat", "lr_pvalue", "error"]
+
+
+def aligned_pair(sub: pd.DataFrame, cause: str, effect: str) -> np.ndarray:
+    """(n x 2) array of [effect, cause] by year, as grangercausalitytests expects."""
+    df = sub.set_index("year")[[effect, cause]].sort_index().astype("float64")
+    df = df.reindex(range(df.index.min(), df.index.max() + 1))
+    both = df.notna().all(axis=1)
+    if not both.any():
+        return np.empty((0, 2))
+    df = df.loc[both[both].index[0]:both[both].index[-1]].ffill()
+    return df.to_numpy()
+
+
+def cache_key(data: np.ndarray, max_lag: int) -> str:
+    import statsmodels
+
+    h = hashlib.sha256(np.ascontiguousarray(data).tobytes())
+    h.update(json.dumps([list(data.shape), max_lag, statsmodels.__version__]).encode())
+    return h.hexdigest()
+
+
+def fit(data: np.ndarray, max_lag: int) -> list:
+    """Per-lag test statistics for one [effect, cause] array; one row with `error` when it cannot be fitted."""
+    from statsmodels.tools.sm_exceptions import InfeasibleTestError
+    from statsmodels.tsa.stattools import grangercausalitytests
+
+    n = len(data)
+    # each lag needs enough observations for the unrestricted regression's residual dof
+    if n < 3 * max_lag + 2:
+        return [{"lag": None, "n": n, "error": f"need at least {3 * max_lag + 2} aligned years, have {n}"}]
+    try:
+        # statsmodels < 0.15 prints every test unless told not to; newer versions dropped `verbose`
+        with contextlib.redirect_stdout(io.StringIO()), warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            res = grangercausalitytests(data, maxlag=max_lag)
+    except (ValueError, np.linalg.LinAlgError, InfeasibleTestError) as e:  # properties of the data, e.g. a perfect fit
+        return [{"lag": None, "n": n, "error": str(e)}]
+    except Exception as e:  # anything else may be transient; report it but do not cache it
+        return [{"lag": None, "n": n, "error": str(e), "failed": True}]
+    rows = []
+    for lag, (tests, _) in sorted(res.items()):
+        f_stat, f_p, df_denom, df_num = tests["ssr_ftest"]
+        chi2, chi2_p, _ = tests["ssr_chi2test"]
+        lr, lr_p, _ = tests["lrtest"]
+        rows.append({"lag": int(lag), "n": n, "f_stat": float(f_stat), "f_pvalue": float(f_p),
+                     "df_num": int(df_num), "df_denom": float(df_denom), "chi2_stat": float(chi2),
+                     "chi2_pvalue": float(chi2_p), "lr_stat": float(lr), "lr_pvalue": float(lr_p), "error": ""})
+    return rows
+
+
+def cached_fit(data: np.ndarray, max_lag: int, use_cache: bool = True) -> list:
+    path = CACHE_DIR / f"{cache_key(data, max_lag)}.json"
+    if use_cache and path.exists():
+        return json.loads(path.read_text())
+    rows = fit(data, max_lag)
+    if use_cache and not any(row.pop("failed", False) for row in rows):
+        CACHE_DIR.mkdir(parents=True, exist_ok=True)
+        path.write_text(json.dumps(rows))
+    return rows
+
+
+def _fit_task(task):
+    data, max_lag, use_cache = task
+    return cached_fit(data, max_lag, use_cache)
+
+
+def granger_tasks(df: pd.DataFrame, directions=DIRECTIONS, combos=None) -> list:
+    """(disease_id, gender, cause, effect, data) for every series and direction with both signals present."""
+    df = df.astype({k: str for k in KEYS})
+    tasks = []
+    for (disease, gender), sub in df.groupby(KEYS, sort=True):
+        if combos is not None and (disease, gender) not in combos:
+            continue
+        for cause, effect in directions:
+            tasks.append((disease, gender, cause, effect, aligned_pair(sub, cause, effect)))
+    return tasks
+
+
+def run_granger(df: pd.DataFrame, max_lag: int = 3, directions=DIRECTIONS, combos=None,
+                jobs: int = None, use_cache: bool = True) -> pd.DataFrame:
+    tasks = granger_tasks(df, directions, combos)
+    results = [None] * len(tasks)
+    todo = []
+    for i, (*_, data) in enumerate(tasks):
+        path = CACHE_DIR / f"{cache_key(data, max_lag)}.json"
+        if use_cache and path.exists():
+            results[i] = json.loads(path.read_text())
+        else:
+            todo.append(i)
+    logger.info(f"{len(tasks)} Granger tests: {len(tasks) - len(todo)} cached, {len(todo)} to fit")
+    jobs = jobs or os.cpu_count() or 1
+    if todo:
+        args = [(tasks[i][4], max_lag, use_cache) for i in todo]
+        if jobs > 1 and len(todo) > 1:
+            with ProcessPoolExecutor(max_workers=jobs) as pool:
+                fitted = list(pool.map(_fit_task, args, chunksize=max(1, len(todo) // (jobs * 4))))
+        else:
+            fitted = [_fit_task(a) for a in args]
+        for i, rows in zip(todo, fitted):
+            results[i] = rows
+    out = [{"disease_id": d, "gender": g, "cause": c, "effect": e, **row}
+           for (d, g, c, e, _), rows in zip(tasks, results) for row in rows]
+    return pd.DataFrame(out, columns=COLUMNS).astype({"lag": "Int64", "df_num": "Int64"})
+
+
+def main(argv=None, ctx=None):
+    ap = argparse.ArgumentParser(description="Granger causality tests for every disease x gender x pair")
+    ap.add_argument("--max-lag", type=int, default=3)
+    ap.add_argument("--jobs", type=int, default=None, help="worker processes (default: CPU count)")
+    ap.add_argument("--no-cache", action="store_true", help="refit everything and do not store fits")
+    ap.add_argument("--out", type=Path, default=OUT_PATH)
+    args = ap.parse_args(argv)
+    signals = sorted({s for pair in PAIRS for s in pair})
+    cols = ["year", *KEYS, *signals]
+    df = ctx.signals(cols) if ctx else read_signals(columns=cols)
+    out = run_granger(df, max_lag=args.max_lag, jobs=args.jobs, use_cache=not args.no_cache)
+    write_csv(out, args.out)
+    ok = out[out["error"] == ""]
+    logger.info(f"Wrote {len(out)} rows to {args.out}; "
+                f"{(ok['f_pvalue'] < 0.05).sum()} of {len(ok)} lag tests have F-test p < 0.05")
+
+
+if __name__ == "__main__":
+    main()
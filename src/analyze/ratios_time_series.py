@@ -1,24 +1,145 @@
+"""Attention scores: per-disease min-max normalized PubMed counts and Trends interest.
+
+attention_gap = pubmed_norm - trends_norm (positive means research > public attention).
+
+Scores are maintained incrementally. data/interim/attention_state.json keeps
+how far into merged_attention_signals.csv the last run read, a SHA-256 of
+every byte up to that offset, and the running per-disease min/max of each
+signal. A run reads only the rows appended since,
+folds them into the min/max state, and
+- appends their scores to attention_scores.csv when no disease's min/max moved;
+- otherwise rescales the rows of the diseases whose extremes moved and
+  rewrites the file.
+Anything else (no state, an edited source - any byte before the offset -
+a missing output) or --full
+recomputes everything. Both paths give the same file.
+"""
+import argparse
+import hashlib
+import json
+
 import pandas as pd
-from src.utils.io import PROCESSED, write_csv
-from src.utils.logging import get_logger
+from utils.io import PROCESSED, INTERIM, write_csv, memory_report
+from utils.logging import get_logger
 
 logger = get_logger("analyze")
 
+SOURCE = PROCESSED / "merged_attention_signals.csv"
+OUT_PATH = PROCESSED / "attention_scores.csv"
+STATE_PATH = INTERIM / "attention_state.json"
+# normalized column -> raw column
+NORMS = {"pubmed_norm": "pubmed_count", "trends_norm": "interest"}
+CHUNK_BYTES = 1 << 20
+
 def normalize(col: pd.Series) -> pd.Series:
     # Min-max within each disease to show trends comparably
     return (col - col.min()) / (col.max() - col.min() + 1e-9)
 
-def main():
-    p = PROCESSED / "merged_attention_signals.csv"
-    if not p.exists():
-        logger.warning("No merged_attention_signals.csv; run `make build` after fetching data.")
-        return
-    df = pd.read_csv(p)
-    df["pubmed_norm"] = df.groupby("disease_id")["pubmed_count"].transform(normalize)
-    df["trends_norm"] = df.groupby("disease_id")["interest"].transform(normalize)
+def extremes(df: pd.DataFrame) -> pd.DataFrame:
+    """Per-disease min/max of each raw signal, columns like pubmed_count_min."""
+    ext = df.groupby("disease_id")[list(NORMS.values())].agg(["min", "max"])
+    ext.columns = [f"{col}_{stat}" for col, stat in ext.columns]
+    return ext
+
+def merge_extremes(old: pd.DataFrame, new: pd.DataFrame) -> pd.DataFrame:
+    """Fold the extremes of newly read rows into the running ones."""
+    both = pd.concat([old, new])
+    mins = both.filter(like="_min").groupby(level=0).min()
+    maxs = both.filter(like="_max").groupby(level=0).max()
+    return pd.concat([mins, maxs], axis=1)[new.columns]
+
+def score(df: pd.DataFrame, ext: pd.DataFrame) -> pd.DataFrame:
+    """Add the normalized columns and attention_gap, using per-disease extremes from `ext`."""
+    df = df.copy()
+    for norm, col in NORMS.items():
+        lo = df["disease_id"].map(ext[f"{col}_min"])
+        hi = df["disease_id"].map(ext[f"{col}_max"])
+        # same arithmetic as normalize(), with the group min/max looked up instead of recomputed
+        df[norm] = (df[col] - lo) / (hi - lo + 1e-9)
     df["attention_gap"] = df["pubmed_norm"] - df["trends_norm"] # positive means research > public attention
-    write_csv(df, PROCESSED / "attention_scores.csv")
+    return df
+
+def prefix_digest(path, offset: int) -> str:
+    """SHA-256 of the first `offset` bytes of path, read in chunks."""
+    h = hashlib.sha256()
+    with open(path, "rb") as fh:
+        while offset > 0:
+            chunk = fh.read(min(CHUNK_BYTES, offset))
+            if not chunk:
+                break
+            h.update(chunk)
+            offset -= len(chunk)
+    return h.hexdigest()
+
+def save_state(offset: int, columns, ext: pd.DataFrame) -> None:
+    STATE_PATH.write_text(json.dumps({
+        "offset": offset,
+        "prefix": prefix_digest(SOURCE, offset),
+        "columns": list(columns),
+        "extremes": ext.to_dict(orient="index"),
+    }, indent=2))
+
+def load_state():
+    """The saved state if the source still starts with the bytes it was computed from, else None."""
+    if not STATE_PATH.exists() or not OUT_PATH.exists():
+        return None
+    state = json.loads(STATE_PATH.read_text())
+    offset = state["offset"]
+    if SOURCE.stat().st_size < offset or prefix_digest(SOURCE, offset) != state.get("prefix"):
+        return None
+    with open(SOURCE, "rb") as fh:
+        fh.seek(offset - 1)
+        if fh.read(1) != b"\n":  # the last row read was later extended
+            return None
+    state["extremes"] = pd.DataFrame.from_dict(state["extremes"], orient="index")
+    return state
+
+def full_run(ctx=None) -> None:
+    offset = SOURCE.stat().st_size
+    df = ctx.csv(SOURCE) if ctx else pd.read_csv(SOURCE)
+    memory_report(df, logger, "merged_attention_signals")
+    ext = extremes(df)
+    write_csv(score(df, ext), OUT_PATH)
+    save_state(offset, df.columns, ext)
     logger.info(f"Analyzed {len(df)} rows into attention_scores.csv")
 
+def incremental_run(state) -> None:
+    offset = SOURCE.stat().st_size
+    with open(SOURCE, "rb") as fh:
+        fh.seek(state["offset"])
+        delta = pd.read_csv(fh, header=None, names=state["columns"]) if offset > state["offset"] else None
+    if delta is None or delta.empty:
+        logger.info("attention_scores.csv is up to date")
+        return
+    memory_report(delta, logger, "new merged_attention_signals rows")
+    old_ext = state["extremes"]
+    ext = merge_extremes(old_ext, extremes(delta))
+    known = ext.index.intersection(old_ext.index)
+    moved = known[(ext.loc[known] != old_ext.loc[known, ext.columns]).any(axis=1)]
+    new_scores = score(delta, ext)
+    if len(moved):
+        scores = pd.read_csv(OUT_PATH, float_precision="round_trip")  # untouched rows must re-serialize identically
+        rows = scores["disease_id"].isin(moved)
+        scores.loc[rows] = score(scores.loc[rows, state["columns"]], ext)
+        write_csv(pd.concat([scores, new_scores], ignore_index=True), OUT_PATH)
+        logger.info(f"Extremes moved for {list(moved)}; rescaled {rows.sum()} rows and added {len(delta)}")
+    else:
+        new_scores.to_csv(OUT_PATH, mode="a", header=False, index=False)
+        logger.info(f"Appended {len(delta)} rows to attention_scores.csv")
+    save_state(offset, state["columns"], ext)
+
+def main(argv=None, ctx=None):
+    ap = argparse.ArgumentParser(description="Per-disease normalized attention scores")
+    ap.add_argument("--full", action="store_true", help="ignore saved state and recompute everything")
+    args = ap.parse_args(argv)
+    if not SOURCE.exists():
+        logger.warning("No merged_attention_signals.csv; run `make build` after fetching data.")
+        return
+    state = None if args.full else load_state()
+    if state is None:
+        full_run(ctx)
+    else:
+        incremental_run(state)
+
 if __name__ == "__main__":
     main()
@@ -0,0 +1,162 @@
+"""Block-bootstrap confidence intervals and block-permutation p-values for the lagged correlations.
+
+For every disease x gender x pair x lag of analyze/correlations.py (pooled
+ALL rows excluded) this writes reports/correlation_significance.csv with
+columns: disease_id, gender, pair, lag, pearson_r, ci_low, ci_high, p_perm, n
+
+Yearly series of ~20 points are autocorrelated, so resampling single years
+overstates significance. Both procedures work on blocks of --block
+consecutive overlapping years:
+- the CI is the percentile interval of r over moving-block bootstrap
+  resamples of the (a, b) pairs;
+- the p-value permutes the order of a's blocks against b and counts
+  resamples with |r| at least the observed |r|: (1 + k) / (1 + resamples).
+
+Every row's overlap is compacted to the front of a padded (row x year)
+array, so one shard of resamples for the whole grid is a (row x resample x
+year) index matrix evaluated with masked NumPy sums. Shards are seeded from
+one SeedSequence and spread over worker processes; the result only depends
+on --seed and --resamples, not on --jobs.
+
+    PYTHONPATH=src python src/analyze/significance.py --resamples 10000 --jobs 4
+"""
+import argparse
+import os
+import warnings
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from analyze.correlations import PAIRS, KEYS, MIN_N, year_matrix, lagged, masked_pearson
+from utils.io import REPORTS, read_signals, write_csv
+from utils.logging import get_logger
+
+logger = get_logger("significance")
+
+OUT_PATH = REPORTS / "correlation_significance.csv"
+SHARD_SIZE = 500
+
+
+def compact(a: np.ndarray, b: np.ndarray):
+    """Move each row's jointly observed points to the front; returns a, b (NaN-padded) and n per row."""
+    valid = ~(np.isnan(a) | np.isnan(b))
+    order = np.argsort(~valid, axis=-1, kind="stable")
+    return (np.take_along_axis(a, order, axis=-1), np.take_along_axis(b, order, axis=-1),
+            valid.sum(axis=-1))
+
+
+def bootstrap_index(rng, n: np.ndarray, size: int, n_t: int, block: int) -> np.ndarray:
+    """(row x size x n_t) moving-block bootstrap indices; positions at or past a row's n are -1."""
+    n_blocks = -(-n_t // block)
+    span = np.maximum(n - block + 1, 1)[:, None, None]
+    starts = np.floor(rng.random((len(n), size, n_blocks)) * span).astype(np.int64)
+    idx = (starts[..., None] + np.arange(block)).reshape(len(n), size, -1)[..., :n_t]
+    keep = (np.arange(n_t) < n[:, None, None]) & (idx < n[:, None, None])
+    return np.where(keep, idx, -1)
+
+
+def permutation_index(rng, n: np.ndarray, size: int, n_t: int, block: int) -> np.ndarray:
+    """(row x size x n_t) indices that shuffle each row's blocks of `block` points; -1 past n."""
+    n_blocks = -(-n_t // block)
+    used = -(-n // block)
+    keys = rng.random((len(n), size, n_blocks))
+    # unused blocks sort last
+    keys = np.where(np.arange(n_blocks)[None, None, :] >= used[:, None, None], np.inf, keys)
+    idx = (np.argsort(keys, axis=-1)[..., None] * block + np.arange(block)).reshape(len(n), size, -1)
+    # a shorter final block leaves holes; squeeze them out, keeping the shuffled order
+    past = idx >= n[:, None, None]
+    idx = np.take_along_axis(idx, np.argsort(past, axis=-1, kind="stable"), axis=-1)[..., :n_t]
+    return np.where(np.arange(n_t) < n[:, None, None], idx, -1)
+
+
+def gather(x: np.ndarray, idx: np.ndarray) -> np.ndarray:
+    """x[row, idx] for a (row x time) array and (row x size x time) indices; NaN where idx is -1."""
+    rows = np.arange(x.shape[0])[:, None, None]
+    return np.where(idx >= 0, x[rows, np.maximum(idx, 0)], np.nan)
+
+
+def run_shard(task):
+    """Bootstrap r values and permutation exceedance counts for one shard of resamples."""
+    a, b, n, r_obs, size, block, seed = task
+    rng = np.random.default_rng(seed)
+    n_t = a.shape[-1]
+    boot = bootstrap_index(rng, n, size, n_t, block)
+    r_boot, _ = masked_pearson(gather(a, boot), gather(b, boot))
+    perm = permutation_index(rng, n, size, n_t, block)
+    r_perm, _ = masked_pearson(gather(a, perm), np.broadcast_to(b[:, None, :], perm.shape))
+    with np.errstate(invalid="ignore"):
+        exceed = (np.abs(r_perm) >= np.abs(r_obs)[:, None] - 1e-12).sum(axis=1)
+    return r_boot, exceed
+
+
+def significance(a: np.ndarray, b: np.ndarray, resamples: int = 10_000, block: int = 3,
+                 seed: int = 0, jobs: int = None, alpha: float = 0.05):
+    """Observed r, CI bounds, permutation p and n for each row of (row x time) arrays a, b."""
+    a, b, n = compact(a, b)
+    r_obs, _ = masked_pearson(a, b)
+    sizes = [min(SHARD_SIZE, resamples - i) for i in range(0, resamples, SHARD_SIZE)]
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+    tasks = [(a, b, n, r_obs, size, block, s) for size, s in zip(sizes, seeds)]
+    jobs = jobs or os.cpu_count() or 1
+    if jobs > 1 and len(tasks) > 1:
+        with ProcessPoolExecutor(max_workers=jobs) as pool:
+            shards = list(pool.map(run_shard, tasks))
+    else:
+        shards = [run_shard(t) for t in tasks]
+    r_boot = np.concatenate([r for r, _ in shards], axis=1)
+    exceed = sum(e for _, e in shards)
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)  # all-NaN rows (n < MIN_N)
+        lo, hi = np.nanpercentile(r_boot, [100 * alpha / 2, 100 * (1 - alpha / 2)], axis=1)
+    p = (1 + exceed) / (1 + resamples)
+    ok = (n >= MIN_N) & ~np.isnan(r_obs)
+    return r_obs, np.where(ok, lo, np.nan), np.where(ok, hi, np.nan), np.where(ok, p, np.nan), n
+
+
+def significance_table(df: pd.DataFrame, pairs=PAIRS, max_lag: int = 5, **kwargs) -> pd.DataFrame:
+    """Significance for every disease x gender x pair x lag, all rows in one batch."""
+    df = df.astype({k: str for k in KEYS})
+    index = pd.MultiIndex.from_frame(df[KEYS].drop_duplicates().sort_values(KEYS))
+    years = np.arange(df["year"].min(), df["year"].max() + 1)
+    lags = np.arange(-max_lag, max_lag + 1)
+    mats = {s: year_matrix(df, s, index, years) for s in {s for p in pairs for s in p}}
+    # rows ordered pair, series, lag
+    a_rows = np.concatenate([np.repeat(mats[a][:, None, :], len(lags), axis=1).reshape(-1, len(years))
+                             for a, _ in pairs])
+    b_rows = np.concatenate([lagged(mats[b], lags).transpose(1, 0, 2).reshape(-1, len(years))
+                             for _, b in pairs])
+    r, lo, hi, p, n = significance(a_rows, b_rows, **kwargs)
+    per_pair = len(index) * len(lags)
+    out = pd.DataFrame({
+        "disease_id": np.tile(np.repeat(index.get_level_values(0), len(lags)), len(pairs)),
+        "gender": np.tile(np.repeat(index.get_level_values(1), len(lags)), len(pairs)),
+        "pair": np.repeat([f"{a}-{b}" for a, b in pairs], per_pair),
+        "lag": np.tile(lags, len(index) * len(pairs)),
+        "pearson_r": r, "ci_low": lo, "ci_high": hi, "p_perm": p, "n": n,
+    })
+    return out.sort_values(KEYS, kind="stable").reset_index(drop=True)
+
+
+def main(argv=None, ctx=None):
+    ap = argparse.ArgumentParser(description="Bootstrap CIs and permutation p-values for lagged correlations")
+    ap.add_argument("--resamples", type=int, default=10_000)
+    ap.add_argument("--block", type=int, default=3, help="block length in years")
+    ap.add_argument("--max-lag", type=int, default=5)
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--jobs", type=int, default=None, help="worker processes (default: CPU count)")
+    ap.add_argument("--out", type=Path, default=OUT_PATH)
+    args = ap.parse_args(argv)
+    signals = sorted({s for pair in PAIRS for s in pair})
+    cols = ["year", *KEYS, *signals]
+    df = (ctx.signals(cols) if ctx else read_signals(columns=cols)).astype({s: "float64" for s in signals})
+    out = significance_table(df, max_lag=args.max_lag, resamples=args.resamples, block=args.block,
+                             seed=args.seed, jobs=args.jobs)
+    write_csv(out, args.out)
+    logger.info(f"Wrote {len(out)} rows to {args.out} ({args.resamples} resamples, block {args.block}); "
+                f"{(out['p_perm'] < 0.05).sum()} with p < 0.05")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,17 @@
+import os
+import sys
+import csv
+import argparse
 import requests
 import pandas as pd
 import xml.etree.ElementTree as ET
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from requests.adapters import HTTPAdapter
+from utils.io import RAW
+from utils.logging import get_logger
+from utils.http_cache import ResponseCache, CacheMiss, offline_from_env
+
+logger = get_logger("cdc_wonder")
 
 # Map your diseases to ICD-10 codes for CDC WONDER
 ICD10_MAP = {
@@ -11,26 +22,38 @@ ICD10_MAP = {
     "sjogren": "M35.0"  # Sjögren Syndrome
 }
 
-WONDER_URL = "https://wonder.cdc.gov/controller/datarequest/D76"
+# CDC_WONDER_URL can point the client at a local stand-in (see fetch/wonder_stub.py)
+WONDER_URL = os.getenv("CDC_WONDER_URL", "https://wonder.cdc.gov/controller/datarequest/D76")
+
+# Grouping dimensions usable as B_1..B_5: column name -> (label, D76 variable)
+GROUP_DIMS = {
+    "year": ("Year", "D76.V1-level1"),
+    "month": ("Month", "D76.V1-level2"),
+    "sex": ("Sex", "D76.V7"),
+    "state": ("State", "D76.V9-level1"),
+    "county": ("County", "D76.V9-level2"),
+    "age_group": ("Age Group", "D76.V5"),
+    "race": ("Race", "D76.V8"),
+}
+DEFAULT_GROUP_BY = ("year", "sex")
+# WONDER shows suppressed/not applicable values as text in numeric cells
+NON_NUMERIC = {"Suppressed", "Not Applicable", "Missing", "Unreliable"}
 
-def build_request_xml(icd_codes: str) -> str:
+def build_request_xml(icd_codes: str, group_by=DEFAULT_GROUP_BY) -> str:
     """
     Build XML request for WONDER D76 mortality database
-    Group by Sex and Year, filter by ICD-10 codes
+    Group by Year and Sex (plus optional extra dimensions as B_3, B_4, ...), filter by ICD-10 codes
     """
+    groups = "".join(f"""
+  <parameter>
+    <name>B_{i}</name>
+    <value>{GROUP_DIMS[dim][1]}</value> <!-- {GROUP_DIMS[dim][0]} -->
+  </parameter>""" for i, dim in enumerate(group_by, start=1))
     xml = f"""<request-parameters>
   <parameter>
     <name>accept_datause_restrictions</name>
     <value>true</value>
-  </parameter>
-  <parameter>
-    <name>B_1</name>
-    <value>D76.V1-level1</value> <!-- Year -->
-  </parameter>
-  <parameter>
-    <name>B_2</name>
-    <value>D76.V7</value> <!-- Sex -->
-  </parameter>
+  </parameter>{groups}
   <parameter>
     <name>F_D76.V2</name>
     <value>{icd_codes}</value> <!-- ICD-10 filter -->
@@ -53,43 +76,164 @@ def build_request_xml(icd_codes: str) -> str:
   </parameter>
   <parameter>
     <name>O_show_totals</name>
-    <value>true</value>
+    <value>false</value>
   </parameter>
 </request-parameters>"""
     return xml
 
-def query_wonder(icd_codes: str) -> pd.DataFrame:
+def make_session(pool_size: int) -> requests.Session:
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+def cell_value(c: ET.Element):
+    # WONDER puts values in the v (value) or l (label) attribute; older responses use text
+    return c.get("v", c.get("l", c.text))
+
+def fill_spans(cells, carry: list):
+    """Full row of labels and values from a row's (value, rowspan) cells, or None if it is still short.
+
+    WONDER sends a label shared by several rows once, with an r (rowspan)
+    attribute; the following rows leave that column out. `carry` holds
+    (label, rows left) per dimension column and is updated in place.
     """
-    Query CDC WONDER API for ICD-10 codes.
-    Returns Pandas DataFrame with columns: Year, Sex, Deaths
+    cells = iter(cells)
+    row = []
+    for i, span in enumerate(carry):
+        if span is not None and span[1] > 0:
+            row.append(span[0])
+            carry[i] = (span[0], span[1] - 1)
+            continue
+        cell = next(cells, None)
+        if cell is None:
+            return None
+        value, rowspan = cell
+        row.append(value)
+        carry[i] = (value, rowspan - 1) if rowspan > 1 else None
+    measures = [value for value, _ in cells]
+    return row + measures if len(measures) == 1 else None
+
+def iter_rows(source, n_cols: int):
+    """Yield the cell values of each data-table row, parsing `source` incrementally.
+
+    Rows are dropped from the tree as soon as they are read, so memory stays
+    flat regardless of how many groups the request produced. Labels spanning
+    several rows are carried forward (see fill_spans); rows still short after
+    that (footnotes) and totals rows (a dimension cell labelled "Total") are
+    skipped.
     """
-    xml_request = build_request_xml(icd_codes)
-    response = requests.post(
-        WONDER_URL,
-        data={"request_xml": xml_request, "accept_datause_restrictions": "true"}
-    )
+    table = None
+    carry = [None] * (n_cols - 1)
+    for event, elem in ET.iterparse(source, events=("start", "end")):
+        if event == "start":
+            if elem.tag == "data-table":
+                table = elem
+                carry = [None] * (n_cols - 1)
+            continue
+        if elem.tag == "r" and table is not None:
+            cells = [(cell_value(c), int(c.get("r", 1))) for c in elem.findall("c")]
+            table.clear()
+            row = fill_spans(cells, carry)
+            if row is not None and "Total" not in row[:-1]:
+                yield row
+        elif elem.tag == "data-table":
+            table = None
+
+def to_int(val):
+    if val is None or val.strip() in NON_NUMERIC:
+        return None
+    try:
+        return int(val.replace(",", ""))
+    except ValueError:
+        return None
+
+def typed_row(cells, group_by) -> list:
+    row = [to_int(v) if dim == "year" else v for dim, v in zip(group_by, cells)]
+    return row + [to_int(cells[-1])]
+
+def open_wonder(session, icd_codes: str, group_by, cache: ResponseCache = None):
+    """Return a binary stream of the WONDER response (cached responses come from disk)."""
+    data = {"request_xml": build_request_xml(icd_codes, group_by), "accept_datause_restrictions": "true"}
+    if cache:
+        body, _ = cache.fetch_to_file(session, "cdc_wonder", "POST", WONDER_URL, data=data, timeout=300)
+        return open(body, "rb")
+    response = session.post(WONDER_URL, data=data, stream=True, timeout=300)
     response.raise_for_status()
+    response.raw.decode_content = True
+    return response.raw
 
-    root = ET.fromstring(response.text)
+def query_wonder(icd_codes: str, cache: ResponseCache = None, group_by=DEFAULT_GROUP_BY,
+                 session=None) -> pd.DataFrame:
+    """
+    Query CDC WONDER API for ICD-10 codes.
+    Returns Pandas DataFrame with columns: Year, Sex, Deaths (plus any extra group_by labels)
+    """
+    columns = [GROUP_DIMS[dim][0] for dim in group_by] + ["Deaths"]
+    with open_wonder(session or requests, icd_codes, group_by, cache) as stream:
+        rows = list(iter_rows(stream, len(columns)))
+    return pd.DataFrame(rows, columns=columns)
 
-    # Navigate to data-table rows
-    data_table = root.find(".//data-table")
-    rows = []
-    for row in data_table.findall("r"):
-        cells = [c.text for c in row.findall("c")]
-        rows.append(cells)
+def fetch_to_raw(session, disease: str, icd_codes: str, group_by=DEFAULT_GROUP_BY,
+                 cache: ResponseCache = None) -> int:
+    """Stream one disease's response straight into data/raw/{disease}_wonder_api.csv as typed rows."""
+    out = RAW / f"{disease}_wonder_api.csv"
+    tmp = out.with_suffix(".csv.tmp")
+    n = 0
+    with open_wonder(session, icd_codes, group_by, cache) as stream, \
+            open(tmp, "w", newline="", encoding="utf-8") as fh:
+        w = csv.writer(fh)
+        w.writerow(list(group_by) + ["deaths"])
+        for cells in iter_rows(stream, len(group_by) + 1):
+            w.writerow(typed_row(cells, group_by))
+            n += 1
+    os.replace(tmp, out)
+    return n
+
+def fetch_all(diseases: dict, group_by=DEFAULT_GROUP_BY, workers: int = 4,
+              cache: ResponseCache = None) -> dict:
+    """Submit every disease's request concurrently on one pooled session.
+
+    Returns ({disease: rows written}, {disease: error}) for the diseases that succeeded and failed.
+    """
+    written, failed = {}, {}
+    with make_session(workers) as session, ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(fetch_to_raw, session, disease, codes, group_by, cache): disease
+                   for disease, codes in diseases.items()}
+        for fut in as_completed(futures):
+            disease = futures[fut]
+            try:
+                written[disease] = fut.result()
+                logger.info(f"{disease}: wrote {written[disease]} rows to data/raw/{disease}_wonder_api.csv")
+            except CacheMiss as e:
+                failed[disease] = e
+                logger.error(f"Not in cache for {disease}: {e}")
+            except Exception as e:
+                failed[disease] = e
+                logger.error(f"Failed for {disease}: {e}")
+    return written, failed
 
-    # Convert to DataFrame
-    df = pd.DataFrame(rows, columns=["Year", "Sex", "Deaths"])
-    return df
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Query CDC WONDER D76 deaths by year and sex")
+    ap.add_argument("--group-by", default=",".join(DEFAULT_GROUP_BY),
+                    help=f"comma-separated grouping dimensions, from: {', '.join(GROUP_DIMS)}")
+    ap.add_argument("--workers", type=int, default=4, help="concurrent requests")
+    ap.add_argument("--offline", action="store_true", default=offline_from_env(),
+                    help="serve responses only from the local cache (also FETCH_OFFLINE=1)")
+    ap.add_argument("--no-cache", action="store_true", help="bypass the response cache")
+    args = ap.parse_args(argv)
+    group_by = tuple(g.strip() for g in args.group_by.split(",") if g.strip())
+    unknown = [g for g in group_by if g not in GROUP_DIMS]
+    if unknown or not 1 <= len(group_by) <= 5:
+        ap.error(f"--group-by takes 1-5 of {', '.join(GROUP_DIMS)}; got {args.group_by}")
+    cache = None if args.no_cache else ResponseCache(offline=args.offline)
+    _, failed = fetch_all(ICD10_MAP, group_by, args.workers, cache)
+    if cache:
+        logger.info(cache.summary())
+    if failed:
+        # non-zero so src/pipeline.py does not record the stage as up to date
+        sys.exit(f"CDC WONDER fetch failed for {len(failed)} of {len(ICD10_MAP)} diseases: {', '.join(sorted(failed))}")
 
 if __name__ == "__main__":
-    results = {}
-    for disease, codes in ICD10_MAP.items():
-        try:
-            df = query_wonder(codes)
-            results[disease] = df
-            print(f"\n=== {disease.upper()} ===")
-            print(df.head())
-        except Exception as e:
-            print(f"Failed for {disease}: {e}")
+    main()
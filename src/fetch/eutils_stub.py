@@ -0,0 +1,101 @@
+"""Local stand-in for the NCBI E-utilities endpoints used by pubmed_counts_by_gender.
+
+Serves esearch (plain counts and usehistory=y) and esummary (paged from the
+history server) over a deterministic synthetic corpus, so the fetch modes
+can be exercised and compared offline:
+
+    PYTHONPATH=src python src/fetch/eutils_stub.py --port 8765 &
+    NCBI_EUTILS_BASE=http://127.0.0.1:8765 PYTHONPATH=src \
+        python src/fetch/pubmed_counts_by_gender.py --mode bulk --check
+"""
+import argparse
+import hashlib
+import json
+import re
+import threading
+import urllib.parse as up
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DATE_RANGE = re.compile(r'\s*AND \("(\d{4})"\[Date - Publication\] : "(\d{4})"\[Date - Publication\]\)$')
+MONTHS = ["Jan", "Feb", "Mar", "Apr", "May", "Jun", "Jul", "Aug", "Sep", "Oct", "Nov", "Dec"]
+
+
+def synthetic_count(query: str, year: int) -> int:
+    # stable pseudo-random yearly volume per base query
+    h = hashlib.sha256(f"{query}|{year}".encode()).digest()
+    return int.from_bytes(h[:2], "big") % 400
+
+
+def synthetic_records(query: str, y1: int, y2: int) -> list:
+    records = []
+    for year in range(y1, y2 + 1):
+        for i in range(synthetic_count(query, year)):
+            uid = int.from_bytes(hashlib.sha256(f"{query}|{year}|{i}".encode()).digest()[:4], "big")
+            records.append((str(uid), f"{year} {MONTHS[i % 12]}"))
+    return records
+
+
+class EutilsStub(BaseHTTPRequestHandler):
+    histories = {}
+    lock = threading.Lock()
+
+    def _send(self, payload: dict, status: int = 200) -> None:
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        url = up.urlparse(self.path)
+        params = {k: v[0] for k, v in up.parse_qs(url.query).items()}
+        if url.path.endswith("/esearch.fcgi"):
+            self.esearch(params)
+        elif url.path.endswith("/esummary.fcgi"):
+            self.esummary(params)
+        else:
+            self._send({"error": f"unknown endpoint {url.path}"}, status=404)
+
+    def esearch(self, params: dict) -> None:
+        term = params.get("term", "")
+        m = DATE_RANGE.search(term)
+        if not m:
+            self._send({"error": "stub only understands [Date - Publication] ranges"}, status=400)
+            return
+        query, y1, y2 = term[:m.start()], int(m.group(1)), int(m.group(2))
+        records = synthetic_records(query, y1, y2)
+        result = {"count": str(len(records)), "retmax": "0", "retstart": "0"}
+        if params.get("usehistory") == "y":
+            with self.lock:
+                webenv = f"STUB_{len(self.histories)}"
+                self.histories[webenv] = records
+            result.update({"querykey": "1", "webenv": webenv})
+        self._send({"esearchresult": result})
+
+    def esummary(self, params: dict) -> None:
+        records = self.histories.get(params.get("WebEnv", ""))
+        if records is None:
+            self._send({"error": "unknown WebEnv"}, status=400)
+            return
+        start = int(params.get("retstart", 0))
+        page = records[start:start + int(params.get("retmax", 20))]
+        result = {"uids": [uid for uid, _ in page]}
+        for uid, pubdate in page:
+            result[uid] = {"uid": uid, "pubdate": pubdate}
+        self._send({"result": result})
+
+    def log_message(self, fmt, *args):
+        pass
+
+
+def serve(port: int = 8765) -> ThreadingHTTPServer:
+    return ThreadingHTTPServer(("127.0.0.1", port), EutilsStub)
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--port", type=int, default=8765)
+    args = ap.parse_args()
+    print(f"E-utilities stub on http://127.0.0.1:{args.port}")
+    serve(args.port).serve_forever()
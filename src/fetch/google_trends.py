@@ -1,70 +1,213 @@
+import io
 import os
-import random
+import argparse
 from pathlib import Path
 from datetime import datetime
 import pandas as pd
 from dotenv import load_dotenv
 from pytrends.request import TrendReq
 import yaml
-from utils.io import RAW, write_csv
+from utils.io import RAW, INTERIM, write_csv
 from utils.logging import get_logger
-import time
+from utils.http_cache import ResponseCache, CacheMiss, payload_key, offline_from_env
+from fetch.trends_scheduler import ProxyPool, RateLimited, run_jobs
 from pytrends.exceptions import TooManyRequestsError
 load_dotenv()
 logger = get_logger("trends")
 
-def main():
+OUT_PATH = RAW / "google_trends_interest.csv"
+CHECKPOINT_PATH = INTERIM / "google_trends_interest.partial.csv"
+COLUMNS = ["date", "interest", "disease_id", "disease_name"]
+# seconds each proxy (or the direct connection) waits between its own requests
+MIN_INTERVAL = float(os.getenv("GOOGLE_TRENDS_MIN_INTERVAL", 60))
+# a Trends payload takes at most 5 keywords
+MAX_KEYWORDS = 5
+
+def trends_key(kw_list, timeframe: str, geo: str) -> list:
+    return ["interest_over_time", kw_list, timeframe, geo]
+
+def frame_from_csv(payload: bytes) -> pd.DataFrame:
+    df = pd.read_csv(io.BytesIO(payload))
+    if df.empty:
+        return df
+    df["date"] = pd.to_datetime(df["date"])
+    return df.set_index("date")
+
+def cached_frame(cache: ResponseCache, kw_list, timeframe: str, geo: str):
+    """interest_over_time frame recorded for this payload, or None.
+
+    pytrends owns its HTTP session, so the cache stores the resulting frame
+    keyed by the payload (keywords, timeframe, geo) instead of raw responses.
+    """
+    hit = cache.lookup("google_trends", payload_key(trends_key(kw_list, timeframe, geo)))
+    return frame_from_csv(hit[0].read_bytes()) if hit else None
+
+def fetch_frame(proxy, kw_list, timeframe: str, geo: str, cache: ResponseCache = None) -> pd.DataFrame:
+    pytrends = TrendReq(hl="en-US", tz=0, proxies=[proxy] if proxy else [])
+    try:
+        pytrends.build_payload(kw_list, timeframe=timeframe, geo=geo)
+        df = pytrends.interest_over_time()
+    except TooManyRequestsError as e:
+        raise RateLimited(str(e)) from e
+    if cache:
+        payload = df.reset_index().to_csv(index=False).encode()
+        cache.store("google_trends", payload_key(trends_key(kw_list, timeframe, geo)), payload,
+                    {"key_parts": trends_key(kw_list, timeframe, geo)})
+    return df
+
+def disease_frame(d: dict, df: pd.DataFrame) -> pd.DataFrame:
+    kw_list = d["trends_terms"]
+    df = df.reset_index().rename(columns={"date": "date"})
+    df["disease_id"] = d["id"]
+    df["disease_name"] = d["name"]
+    # Use the first keyword as primary signal (or average across terms)
+    df["interest"] = df[kw_list].mean(axis=1)
+    return df[COLUMNS]
+
+def pack_terms(diseases, anchor: str, size: int = MAX_KEYWORDS) -> list:
+    """Split the unique terms of all diseases into payloads of `size - 1` terms plus the anchor."""
+    terms = []
+    for d in diseases:
+        terms += [t for t in d["trends_terms"] if t not in terms and t != anchor]
+    return [tuple(terms[i:i + size - 1]) + (anchor,) for i in range(0, len(terms), size - 1)]
+
+def rescale_batches(frames: list, anchor: str) -> pd.DataFrame:
+    """Put every batch on the scale of the first one via the shared anchor term.
+
+    Trends normalises each payload to its own maximum (100), so a term's
+    values are only comparable within a payload. Multiplying each batch by
+    sum(anchor in batch 0) / sum(anchor in batch) undoes that per-batch
+    normalisation; the result is one wide frame of all terms on one scale.
+    """
+    ref = frames[0][anchor].sum()
+    scaled = []
+    for i, df in enumerate(frames):
+        total = df[anchor].sum()
+        if total == 0:
+            raise ValueError(f"anchor term {anchor!r} is all zero in batch {i}; pick a more popular anchor")
+        if df[anchor].max() < 10:
+            logger.warning(f"anchor {anchor!r} peaks at {df[anchor].max()} in batch {i}; rescaled values will be coarse")
+        scaled.append(df.drop(columns=[anchor, "isPartial"], errors="ignore") * (ref / total))
+    return pd.concat(scaled, axis=1)
+
+def packed_disease_frames(diseases, wide: pd.DataFrame) -> pd.DataFrame:
+    return pd.concat([disease_frame(d, wide) for d in diseases], ignore_index=True)
+
+def main_packed(cfg, cache, proxies, timeframe: str, geo: str) -> None:
+    anchor = cfg["trends_anchor"]
+    batches = pack_terms(cfg["diseases"], anchor)
+    logger.info(f"Packing {sum(len(d['trends_terms']) for d in cfg['diseases'])} terms into "
+                f"{len(batches)} payloads with anchor {anchor!r}")
+    results = {}
+    pending = []
+    for batch in batches:
+        df = cached_frame(cache, list(batch), timeframe, geo) if cache else None
+        if df is None:
+            pending.append(batch)
+        else:
+            results[batch] = df
+
+    def fetch(batch, proxy):
+        logger.info(f"Fetching trends for {list(batch)} via {proxy or 'direct'}")
+        return fetch_frame(proxy, list(batch), timeframe, geo, cache)
+
+    def on_result(batch, df):
+        results[batch] = df
+
+    if pending:
+        pool = ProxyPool(proxies, min_interval=MIN_INTERVAL)
+        failed = run_jobs(pool, pending, fetch, on_result)
+        logger.info(f"Proxy health: {pool.report()}")
+        if failed:
+            # a missing batch would leave its terms off the shared scale
+            logger.error(f"Failed to fetch {len(failed)} payloads; rerun to retry (fetched ones are cached).")
+            return
+    if any(results[b].empty for b in batches):
+        logger.error("Trends returned no data for at least one payload.")
+        return
+    wide = rescale_batches([results[b] for b in batches], anchor)
+    out = packed_disease_frames(cfg["diseases"], wide)
+    write_csv(out, OUT_PATH)
+    logger.info(f"Wrote {len(out)} rows to data/raw/google_trends_interest.csv (anchor-normalised)")
+
+def append_checkpoint(df: pd.DataFrame) -> None:
+    df.to_csv(CHECKPOINT_PATH, mode="a", header=not CHECKPOINT_PATH.exists(), index=False)
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Fetch Google Trends interest for configured terms")
+    ap.add_argument("--offline", action="store_true", default=offline_from_env(),
+                    help="serve responses only from the local cache (also FETCH_OFFLINE=1)")
+    ap.add_argument("--no-cache", action="store_true", help="bypass the response cache")
+    ap.add_argument("--pack", action="store_true",
+                    help="pack terms of several diseases into each payload with a shared anchor term; "
+                         "interest values become comparable across diseases")
+    args = ap.parse_args(argv)
+    cache = None if args.no_cache else ResponseCache(offline=args.offline)
+
     cfg = yaml.safe_load(Path("src/config/diseases.yaml").read_text())
     y1, y2 = cfg["years"]["start"], cfg["years"]["end"]
+    timeframe = f"{y1}-01-01 {y2}-12-31"
+    geo = ""  # worldwide
 
     # Support rotating proxies from a comma-separated list in the environment variable
     proxy_list = os.getenv("GOOGLE_TRENDS_PROXIES")
     proxies = [p.strip() for p in proxy_list.split(",") if p.strip()] if proxy_list else []
 
-    def get_pytrends():
-        if proxies:
-            proxy = random.choice(proxies)
-            return TrendReq(hl="en-US", tz=0, proxies=[proxy])
-        else:
-            return TrendReq(hl="en-US", tz=0, proxies=[])
+    if args.pack:
+        try:
+            main_packed(cfg, cache, proxies, timeframe, geo)
+        except CacheMiss as e:
+            logger.error(str(e))
+        if cache:
+            logger.info(cache.summary())
+        return
+
+    # diseases already written by an interrupted run are not fetched again
+    done = set()
+    if CHECKPOINT_PATH.exists():
+        done = set(pd.read_csv(CHECKPOINT_PATH, usecols=["disease_id"])["disease_id"])
+        logger.info(f"Resuming; already have {sorted(done)}")
 
-    frames = []
+    pending = []
     for d in cfg["diseases"]:
-        kw_list = d["trends_terms"]
-        logger.info(f"Fetching trends for {d['name']}: {kw_list}")
-
-        # Retry logic for both build_payload and interest_over_time, rotate proxy on each attempt
-        for attempt in range(5):
-            pytrends = get_pytrends()
-            try:
-                pytrends.build_payload(kw_list, timeframe=f"{y1}-01-01 {y2}-12-31", geo="")  # worldwide
-                df = pytrends.interest_over_time()
-                break
-            except TooManyRequestsError:
-                wait = 60 * (attempt + 1)
-                logger.warning(f"429 error. Waiting {wait} seconds before retrying... Rotating proxy.")
-                time.sleep(wait)
-            except Exception as e:
-                logger.warning(f"Error during pytrends request: {e}. Waiting {60 * (attempt + 1)} seconds before retrying... Rotating proxy.")
-                time.sleep(60 * (attempt + 1))
-        else:
-            logger.error(f"Failed to fetch trends for {d['name']} after multiple attempts.")
+        if d["id"] in done:
             continue
-
-        if df.empty:
+        try:
+            df = cached_frame(cache, d["trends_terms"], timeframe, geo) if cache else None
+        except CacheMiss as e:
+            logger.error(f"{e}; skipping {d['name']}")
             continue
-        df = df.reset_index().rename(columns={"date": "date"})
-        df["disease_id"] = d["id"]
-        df["disease_name"] = d["name"]
-        # Use the first keyword as primary signal (or average across terms)
-        df["interest"] = df[kw_list].mean(axis=1)
-        frames.append(df[["date", "interest", "disease_id", "disease_name"]])
+        if df is None:
+            pending.append(d)
+        elif not df.empty:
+            append_checkpoint(disease_frame(d, df))
 
-        time.sleep(60)  # be polite
+    def fetch(d, proxy):
+        logger.info(f"Fetching trends for {d['name']}: {d['trends_terms']} via {proxy or 'direct'}")
+        return fetch_frame(proxy, d["trends_terms"], timeframe, geo, cache)
+
+    def on_result(d, df):
+        if not df.empty:
+            append_checkpoint(disease_frame(d, df))
+
+    if pending:
+        pool = ProxyPool(proxies, min_interval=MIN_INTERVAL)
+        failed = run_jobs(pool, pending, fetch, on_result)
+        for d in failed:
+            logger.error(f"Failed to fetch trends for {d['name']} after multiple attempts.")
+        logger.info(f"Proxy health: {pool.report()}")
 
-    out = pd.concat(frames, ignore_index=True)
-    write_csv(out, RAW / "google_trends_interest.csv")
+    if not CHECKPOINT_PATH.exists():
+        logger.error("No trends data fetched.")
+        return
+    out = pd.read_csv(CHECKPOINT_PATH)
+    order = {d["id"]: i for i, d in enumerate(cfg["diseases"])}
+    out = out.sort_values("disease_id", key=lambda s: s.map(order), kind="stable").reset_index(drop=True)
+    write_csv(out, OUT_PATH)
+    CHECKPOINT_PATH.unlink()
     logger.info(f"Wrote {len(out)} rows to data/raw/google_trends_interest.csv")
+    if cache:
+        logger.info(cache.summary())
 
 if __name__ == "__main__":
     main()
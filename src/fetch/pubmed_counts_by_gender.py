@@ -1,10 +1,15 @@
 # Script to fetch PubMed publication counts by gendered queries for autoimmune diseases
 import os
 import time
+import argparse
+import asyncio
 import yaml
 import pandas as pd
-from utils.io import RAW, write_csv
+import csv
+from utils.io import RAW, INTERIM, write_csv
 from utils.logging import get_logger
+from utils.ratelimit import TokenBucket
+from utils.http_cache import ResponseCache, CacheMiss, payload_key, offline_from_env
 
 logger = get_logger("pubmed_gender")
 
@@ -13,51 +18,338 @@ def build_gender_query(base_query, gender):
 
 import requests
 import urllib.parse as up
+from requests.adapters import HTTPAdapter
 from dotenv import load_dotenv
 load_dotenv()
-BASE = "https://eutils.ncbi.nlm.nih.gov/entrez/eutils/esearch.fcgi"
+# NCBI_EUTILS_BASE can point the fetcher at a local stand-in (see fetch/eutils_stub.py)
+EUTILS = os.getenv("NCBI_EUTILS_BASE", "https://eutils.ncbi.nlm.nih.gov/entrez/eutils").rstrip("/")
+BASE = f"{EUTILS}/esearch.fcgi"
+ESUMMARY = f"{EUTILS}/esummary.fcgi"
 API_KEY = os.getenv("NCBI_API_KEY", "")
+# NCBI allows 3 requests/s without an API key and 10 requests/s with one
+RATE_LIMIT = 10 if API_KEY else 3
+MAX_RETRIES = 3
+# esummary accepts up to 10,000 UIDs per call; smaller pages keep the JSON manageable
+SUMMARY_BATCH = 5000
+GENDERS = ["women", "men"]
+COLUMNS = ["year", "count", "disease_id", "disease_name", "gender"]
+KEYS = ["disease_id", "gender", "year"]
+OUT_PATH = RAW / "pubmed_counts_by_gender.csv"
+CHECKPOINT_PATH = INTERIM / "pubmed_counts_by_gender.partial.csv"
 
 def build_query(term: str, y1: int, y2: int) -> str:
     date_range = f'("{y1}"[Date - Publication] : "{y2}"[Date - Publication])'
     return f"{term} AND {date_range}"
 
-def yearly_counts(pubmed_query: str, y1: int, y2: int) -> pd.DataFrame:
+def esearch_params(term: str) -> dict:
+    params = {
+        "db": "pubmed",
+        "term": term,
+        "retmode": "json"
+    }
+    if API_KEY:
+        params["api_key"] = API_KEY
+    return params
+
+def yearly_counts(pubmed_query: str, y1: int, y2: int, cache: ResponseCache = None,
+                  years=None, on_count=None, on_miss=None) -> pd.DataFrame:
+    """One esearch per year; offline cache misses go to on_miss(year) and are skipped when it is given."""
     rows = []
-    for year in range(y1, y2 + 1):
-        params = {
-            "db": "pubmed",
-            "term": build_query(pubmed_query, year, year),
-            "retmode": "json"
-        }
-        if API_KEY:
-            params["api_key"] = API_KEY
+    for year in (years if years is not None else range(y1, y2 + 1)):
+        params = esearch_params(build_query(pubmed_query, year, year))
         url = f"{BASE}?{up.urlencode(params)}"
-        r = requests.get(url, timeout=30)
-        r.raise_for_status()
+        try:
+            r = cache.cached_response("pubmed", "GET", url) if cache else None
+        except CacheMiss:
+            if on_miss is None:
+                raise
+            on_miss(year)
+            continue
+        if r is None:
+            r = requests.get(url, timeout=30)
+            r.raise_for_status()
+            if cache:
+                cache.record("pubmed", "GET", url, r)
+            time.sleep(0.34 if API_KEY else 0.4)
         data = r.json()
         count = int(data["esearchresult"]["count"])
         rows.append({"year": year, "count": count})
-        time.sleep(0.34 if API_KEY else 0.4)
-    return pd.DataFrame(rows)
+        if on_count:
+            on_count(year, count)
+    return pd.DataFrame(rows, columns=["year", "count"])
+
+def make_session(pool_size: int = 16) -> requests.Session:
+    # one keep-alive pool shared by every request of a run
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+async def get_json_async(session: requests.Session, bucket: TokenBucket, url: str, params: dict,
+                         cache: ResponseCache = None) -> dict:
+    # cache hits skip the rate limiter entirely
+    r = cache.cached_response("pubmed", "GET", url, params) if cache else None
+    if r is not None:
+        return r.json()
+    for attempt in range(MAX_RETRIES + 1):
+        await bucket.acquire()
+        r = await asyncio.to_thread(session.get, url, params=params, timeout=30)
+        if r.status_code == 429 and attempt < MAX_RETRIES:
+            logger.warning(f"429 from {url}, retrying ({attempt + 1}/{MAX_RETRIES})")
+            continue
+        r.raise_for_status()
+        if cache:
+            cache.record("pubmed", "GET", url, r, params)
+        return r.json()
+
+async def count_async(session: requests.Session, bucket: TokenBucket, term: str, cache: ResponseCache = None) -> int:
+    data = await get_json_async(session, bucket, BASE, esearch_params(term), cache)
+    return int(data["esearchresult"]["count"])
+
+def pubdate_year(summary: dict):
+    # pubdate looks like "2005 Mar 3" or "2005 Spring"; sortpubdate is "2005/03/03 00:00"
+    for field in ("pubdate", "sortpubdate", "epubdate"):
+        val = summary.get(field) or ""
+        if val[:4].isdigit():
+            return int(val[:4])
+    return None
+
+async def bulk_counts_async(session, bucket, pubmed_query: str, y1: int, y2: int,
+                            cache: ResponseCache = None) -> pd.DataFrame:
+    """Count publications per year with one history-server search over the whole range.
+
+    The PMIDs matched by the range query are paged through esummary and
+    binned by publication year locally, so the request count grows with
+    the number of matching articles / SUMMARY_BATCH instead of with years.
+    esummary pages hang off a per-session WebEnv, so the cache stores the
+    binned histogram rather than the individual responses.
+    """
+    key = payload_key(["bulk", pubmed_query, y1, y2])
+    hit = cache.lookup("pubmed", key) if cache else None
+    if hit:
+        return pd.read_json(hit[0], orient="records")
+    params = esearch_params(build_query(pubmed_query, y1, y2))
+    params.update({"usehistory": "y", "retmax": 0})
+    search = (await get_json_async(session, bucket, BASE, params))["esearchresult"]
+    total = int(search["count"])
+    pages = []
+    for start in range(0, total, SUMMARY_BATCH):
+        page = {"db": "pubmed", "query_key": search["querykey"], "WebEnv": search["webenv"],
+                "retstart": start, "retmax": SUMMARY_BATCH, "retmode": "json"}
+        if API_KEY:
+            page["api_key"] = API_KEY
+        pages.append(get_json_async(session, bucket, ESUMMARY, page))
+    hist = dict.fromkeys(range(y1, y2 + 1), 0)
+    unbinned = 0
+    for result in await asyncio.gather(*pages):
+        result = result["result"]
+        for uid in result.get("uids", []):
+            year = pubdate_year(result.get(uid, {}))
+            if year in hist:
+                hist[year] += 1
+            else:
+                unbinned += 1
+    if unbinned:
+        logger.warning(f"{unbinned} of {total} records had a publication year outside {y1}-{y2}")
+    df = pd.DataFrame({"year": list(hist), "count": list(hist.values())})
+    if cache:
+        cache.store("pubmed", key, df.to_json(orient="records").encode(), {"key_parts": ["bulk", pubmed_query, y1, y2]})
+    return df
+
+async def yearly_counts_async(session, bucket, pubmed_query: str, years, cache: ResponseCache = None,
+                              on_count=None) -> pd.DataFrame:
+    async def one(year):
+        count = await count_async(session, bucket, build_query(pubmed_query, year, year), cache)
+        if on_count:
+            on_count(year, count)
+        return count
+    years = list(years)
+    counts = await asyncio.gather(*[one(year) for year in years])
+    return pd.DataFrame({"year": years, "count": counts})
+
+async def bulk_years_async(session, bucket, pubmed_query: str, years, cache: ResponseCache = None,
+                           on_count=None) -> pd.DataFrame:
+    years = sorted(years)
+    df = await bulk_counts_async(session, bucket, pubmed_query, years[0], years[-1], cache)
+    df = df[df["year"].isin(years)].reset_index(drop=True)
+    if on_count:
+        for year, count in zip(df["year"], df["count"]):
+            on_count(year, count)
+    return df
+
+async def fetch_all_async(units, bulk: bool = False, cache: ResponseCache = None, on_count=None) -> list:
+    """Fetch every (disease, gender, years) unit concurrently under one global rate limit.
+
+    With `bulk`, each unit is one history-server search binned locally (see
+    `bulk_counts_async`) instead of one esearch per year. `on_count(d, gender,
+    year, count)` is called as each cell arrives.
+    """
+    bucket = TokenBucket(RATE_LIMIT)
+    fetch = bulk_years_async if bulk else yearly_counts_async
+    with make_session() as session:
+        jobs = []
+        for d, gender, years in units:
+            query = build_gender_query(d["pubmed_query"], gender)
+            cb = (lambda year, count, d=d, gender=gender: on_count(d, gender, year, count)) if on_count else None
+            jobs.append(fetch(session, bucket, query, years, cache, cb))
+        logger.info(f"Fetching PubMed counts for {len(jobs)} disease/gender queries at {RATE_LIMIT} req/s")
+        frames = await asyncio.gather(*jobs)
+    return frames
+
+class Checkpoint:
+    """Append-only record of the cells fetched by a run that has not finished yet."""
+
+    def __init__(self, path=CHECKPOINT_PATH):
+        self.path = path
+
+    def load(self) -> pd.DataFrame:
+        if not self.path.exists():
+            return pd.DataFrame(columns=COLUMNS)
+        return pd.read_csv(self.path)
+
+    def append(self, d: dict, gender: str, year: int, count: int) -> None:
+        new = not self.path.exists()
+        with open(self.path, "a", newline="", encoding="utf-8") as fh:
+            w = csv.writer(fh)
+            if new:
+                w.writerow(COLUMNS)
+            w.writerow([int(year), int(count), d["id"], d["name"], gender])
+
+    def clear(self) -> None:
+        self.path.unlink(missing_ok=True)
+
+def missing_cells(diseases, genders, y1: int, y2: int, have: pd.DataFrame) -> list:
+    """(disease, gender, years) units for every configured cell not present in `have`."""
+    done = set(zip(have["disease_id"], have["gender"], have["year"].astype(int)))
+    units = []
+    for d in diseases:
+        for gender in genders:
+            years = [y for y in range(y1, y2 + 1) if (d["id"], gender, y) not in done]
+            if years:
+                units.append((d, gender, years))
+    return units
+
+def merge_counts(frames, diseases, genders) -> pd.DataFrame:
+    """Combine old and new rows (newest wins) in config order: disease, gender, year."""
+    out = pd.concat([f for f in frames if not f.empty], ignore_index=True)
+    out = out.drop_duplicates(KEYS, keep="last")
+    names = {d["id"]: d["name"] for d in diseases}
+    out["disease_name"] = out["disease_id"].map(names).fillna(out["disease_name"])
+    d_rank = out["disease_id"].map({d["id"]: i for i, d in enumerate(diseases)}).fillna(len(diseases))
+    g_rank = out["gender"].map({g: i for i, g in enumerate(genders)}).fillna(len(genders))
+    out = out.assign(_d=d_rank, _g=g_rank).sort_values(["_d", "_g", "year"], kind="stable")
+    out[["year", "count"]] = out[["year", "count"]].astype(int)
+    return out[COLUMNS].reset_index(drop=True)
+
+def year_ranges(years) -> str:
+    """Years as compact runs, e.g. 2000-2003, 2007."""
+    runs = []
+    for year in sorted(years):
+        if runs and year == runs[-1][1] + 1:
+            runs[-1][1] = year
+        else:
+            runs.append([year, year])
+    return ", ".join(str(a) if a == b else f"{a}-{b}" for a, b in runs)
+
+def check_consistency(bulk: pd.DataFrame, per_year: pd.DataFrame, tolerance: float) -> pd.DataFrame:
+    """Compare bulk (binned) counts with per-year esearch counts.
+
+    Returns the rows whose relative difference exceeds `tolerance`. Some
+    drift is expected on live PubMed: [Date - Publication] also matches
+    electronic publication dates, while binning uses the print date.
+    """
+    keys = ["disease_id", "gender", "year"]
+    cmp = bulk.merge(per_year, on=keys, suffixes=("_bulk", "_year"))
+    cmp["rel_diff"] = (cmp["count_bulk"] - cmp["count_year"]).abs() / cmp["count_year"].clip(lower=1)
+    return cmp[cmp["rel_diff"] > tolerance][keys + ["count_bulk", "count_year", "rel_diff"]]
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Fetch yearly PubMed counts by disease and gender")
+    ap.add_argument("--mode", choices=["serial", "async", "bulk"], default="serial",
+                    help="serial: one request at a time; async: concurrent requests under NCBI's rate limit; "
+                         "bulk: one history-server query per disease/gender, binned by year locally")
+    ap.add_argument("--check", action="store_true",
+                    help="with --mode bulk, also fetch per-year counts and compare")
+    ap.add_argument("--check-tolerance", type=float, default=0.0,
+                    help="largest relative difference accepted by --check")
+    ap.add_argument("--offline", action="store_true", default=offline_from_env(),
+                    help="serve responses only from the local cache (also FETCH_OFFLINE=1)")
+    ap.add_argument("--no-cache", action="store_true", help="bypass the response cache")
+    ap.add_argument("--full", action="store_true",
+                    help="refetch every cell instead of only those missing from the existing CSV")
+    args = ap.parse_args(argv)
+    cache = None if args.no_cache else ResponseCache(offline=args.offline)
 
-def main():
     cfg = yaml.safe_load(open("src/config/diseases.yaml", "r", encoding="utf-8").read())
     y1, y2 = cfg["years"]["start"], cfg["years"]["end"]
-    genders = ["women", "men"]
-    out_frames = []
-    for d in cfg["diseases"]:
-        for gender in genders:
+    diseases = cfg["diseases"]
+    genders = GENDERS
+
+    # cells already on disk (final CSV plus any checkpoint left by an interrupted run)
+    checkpoint = Checkpoint()
+    if args.full:
+        checkpoint.clear()
+    existing = pd.read_csv(OUT_PATH) if OUT_PATH.exists() and not args.full else pd.DataFrame(columns=COLUMNS)
+    resumed = checkpoint.load()
+    if not resumed.empty:
+        logger.info(f"Resuming from checkpoint with {len(resumed)} cells")
+    units = missing_cells(diseases, genders, y1, y2, pd.concat([existing, resumed], ignore_index=True))
+    if not units:
+        logger.info(f"{OUT_PATH.name} is up to date for {y1}-{y2}")
+        checkpoint.clear()
+        return
+    logger.info(f"Fetching {sum(len(years) for _, _, years in units)} missing cells")
+
+    if args.mode in ("async", "bulk"):
+        try:
+            frames = asyncio.run(fetch_all_async(units, bulk=args.mode == "bulk", cache=cache,
+                                                 on_count=checkpoint.append))
+        except CacheMiss as e:
+            # cells that did arrive stay in the checkpoint for the next run
+            logger.error(f"Not in cache, nothing written: {e}")
+            if cache:
+                logger.info(cache.summary())
+            return
+    else:
+        frames, uncached = [], {}
+        for d, gender, years in units:
             query = build_gender_query(d["pubmed_query"], gender)
             logger.info(f"Fetching PubMed counts for {d['name']} + {gender}")
-            df = yearly_counts(query, y1, y2)
-            df["disease_id"] = d["id"]
-            df["disease_name"] = d["name"]
-            df["gender"] = gender
-            out_frames.append(df)
-    out = pd.concat(out_frames, ignore_index=True)
-    write_csv(out, RAW / "pubmed_counts_by_gender.csv")
-    logger.info(f"Wrote {len(out)} rows to data/raw/pubmed_counts_by_gender.csv")
+            frames.append(yearly_counts(query, y1, y2, cache, years=years,
+                                        on_count=lambda year, count, d=d, gender=gender:
+                                        checkpoint.append(d, gender, year, count),
+                                        on_miss=lambda year, d=d, gender=gender:
+                                        uncached.setdefault(f"{d['id']}/{gender}", []).append(year)))
+        if uncached:
+            cells = "; ".join(f"{key} {year_ranges(years)}" for key, years in uncached.items())
+            logger.error(f"Not in cache for {sum(map(len, uncached.values()))} cells, left missing "
+                         f"(a later online run fetches them): {cells}")
+    fetched = pd.concat([df.assign(disease_id=d["id"], disease_name=d["name"], gender=gender)
+                         for (d, gender, _), df in zip(units, frames)], ignore_index=True)
+    if fetched.empty and existing.empty and resumed.empty:
+        logger.error("Nothing fetched; not writing " + OUT_PATH.name)
+        if cache:
+            logger.info(cache.summary())
+        return
+
+    if args.check and args.mode == "bulk":
+        per_year = asyncio.run(fetch_all_async(units, cache=cache))
+        per_year = pd.concat([df.assign(disease_id=d["id"], gender=gender)
+                              for (d, gender, _), df in zip(units, per_year)])
+        bad = check_consistency(fetched, per_year, args.check_tolerance)
+        if not bad.empty:
+            logger.error(f"Bulk counts differ from per-year counts in {len(bad)} cells:\n{bad.to_string(index=False)}")
+            checkpoint.clear()
+            raise SystemExit(1)
+        logger.info("Bulk counts match per-year counts")
+
+    out = merge_counts([existing, resumed, fetched], diseases, genders)
+    write_csv(out, OUT_PATH)
+    checkpoint.clear()
+    logger.info(f"Wrote {len(out)} rows to data/raw/pubmed_counts_by_gender.csv ({len(fetched)} fetched)")
+    if cache:
+        logger.info(cache.summary())
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,128 @@
+"""Health-scored proxy pool and parallel job runner for rate-limited fetchers.
+
+Each proxy tracks an EWMA of its request latency and its recent 429 rate.
+Work goes to the healthiest proxy that is idle and out of cooldown; a
+proxy that fails is parked for a jittered exponential cooldown, and every
+proxy waits `min_interval` seconds between its own requests. With N
+proxies, N jobs run at once, so throughput grows with the pool size.
+"""
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from utils.logging import get_logger
+
+logger = get_logger("trends_scheduler")
+
+
+class RateLimited(Exception):
+    """Raised by a fetch function when the upstream answered 429."""
+
+
+class ProxyHealth:
+    def __init__(self, proxy):
+        self.proxy = proxy  # None means a direct connection
+        self.latency = None  # EWMA, seconds
+        self.rate_limit_rate = 0.0  # EWMA of 429 outcomes
+        self.failures = 0  # consecutive
+        self.available_at = 0.0
+        self.busy = False
+
+    @property
+    def name(self) -> str:
+        return self.proxy or "direct"
+
+    def score(self) -> float:
+        # lower is better; untried proxies go first
+        if self.latency is None:
+            return 0.0
+        return self.latency * (1 + 4 * self.rate_limit_rate)
+
+
+class ProxyPool:
+    def __init__(self, proxies, min_interval: float = 60.0, base_cooldown: float = 60.0,
+                 max_cooldown: float = 900.0, alpha: float = 0.3, rng: random.Random = None):
+        self.members = [ProxyHealth(p) for p in proxies] or [ProxyHealth(None)]
+        self.min_interval = min_interval
+        self.base_cooldown = base_cooldown
+        self.max_cooldown = max_cooldown
+        self.alpha = alpha
+        self.rng = rng or random.Random()
+        self._cond = threading.Condition()
+
+    def __len__(self) -> int:
+        return len(self.members)
+
+    def acquire(self) -> ProxyHealth:
+        """Block until a proxy is idle and past its cooldown, then hand out the healthiest one."""
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                ready = [m for m in self.members if not m.busy and m.available_at <= now]
+                if ready:
+                    best = min(ready, key=ProxyHealth.score)
+                    best.busy = True
+                    return best
+                idle = [m.available_at for m in self.members if not m.busy]
+                self._cond.wait(timeout=max(0.0, min(idle) - now) if idle else None)
+
+    def release(self, member: ProxyHealth, latency: float = None, rate_limited: bool = False,
+                failed: bool = False) -> None:
+        with self._cond:
+            now = time.monotonic()
+            member.busy = False
+            member.rate_limit_rate += self.alpha * (float(rate_limited) - member.rate_limit_rate)
+            if latency is not None:
+                member.latency = latency if member.latency is None else \
+                    member.latency + self.alpha * (latency - member.latency)
+            if rate_limited or failed:
+                member.failures += 1
+                cooldown = min(self.max_cooldown, self.base_cooldown * 2 ** (member.failures - 1))
+                cooldown *= self.rng.uniform(0.5, 1.5)
+                member.available_at = now + cooldown
+                logger.warning(f"{member.name}: {'429' if rate_limited else 'error'}, cooling down {cooldown:.0f}s")
+            else:
+                member.failures = 0
+                member.available_at = now + self.min_interval
+            self._cond.notify_all()
+
+    def report(self) -> str:
+        return "; ".join(
+            f"{m.name}: latency={m.latency if m.latency is None else round(m.latency, 2)}s "
+            f"429_rate={m.rate_limit_rate:.2f}" for m in self.members)
+
+
+def run_jobs(pool: ProxyPool, jobs, fetch, on_result, max_attempts: int = 5) -> list:
+    """Run `fetch(job, proxy)` for every job on the pool; returns the jobs that failed for good.
+
+    `on_result(job, result)` is called (serialised) as soon as each job succeeds.
+    `fetch` should raise `RateLimited` on 429 and any other exception on error.
+    """
+    lock = threading.Lock()
+
+    def attempt(job):
+        for n in range(1, max_attempts + 1):
+            member = pool.acquire()
+            start = time.monotonic()
+            try:
+                result = fetch(job, member.proxy)
+            except RateLimited:
+                pool.release(member, rate_limited=True)
+            except Exception as e:
+                logger.warning(f"{member.name}: attempt {n}/{max_attempts} failed: {e}")
+                pool.release(member, failed=True)
+            else:
+                pool.release(member, latency=time.monotonic() - start)
+                with lock:
+                    on_result(job, result)
+                return True
+        return False
+
+    failed = []
+    with ThreadPoolExecutor(max_workers=len(pool)) as ex:
+        futures = {ex.submit(attempt, job): job for job in jobs}
+        for fut in as_completed(futures):
+            if not fut.result():
+                failed.append(futures[fut])
+    return failed
@@ -0,0 +1,81 @@
+"""Local stand-in for the CDC WONDER D76 endpoint used by cdc_wonder_by_gender.
+
+Answers POSTed request_xml with a deterministic synthetic data-table grouped
+by the requested B_1..B_5 dimensions, streamed row by row, so the client can
+be exercised offline (including large state/county groupings):
+
+    PYTHONPATH=src python src/fetch/wonder_stub.py --port 8767 &
+    CDC_WONDER_URL=http://127.0.0.1:8767/D76 PYTHONPATH=src \
+        python src/fetch/cdc_wonder_by_gender.py --no-cache --group-by year,sex,state
+"""
+import argparse
+import hashlib
+import itertools
+import urllib.parse as up
+import xml.etree.ElementTree as ET
+from xml.sax.saxutils import quoteattr
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+LEVELS = {
+    "D76.V1-level1": [str(y) for y in range(1999, 2021)],
+    "D76.V1-level2": [f"{y}/{m:02d}" for y in range(1999, 2021) for m in range(1, 13)],
+    "D76.V7": ["Female", "Male"],
+    "D76.V9-level1": [f"State {i:02d}" for i in range(1, 52)],
+    "D76.V9-level2": [f"County {i:05d}" for i in range(1, 3144)],
+    "D76.V5": ["< 1 year", "1-4 years", "5-14 years", "15-24 years", "25-34 years", "35-44 years",
+               "45-54 years", "55-64 years", "65-74 years", "75-84 years", "85+ years"],
+    "D76.V8": ["American Indian or Alaska Native", "Asian or Pacific Islander",
+               "Black or African American", "White"],
+}
+
+
+def synthetic_deaths(icd: str, labels) -> str:
+    n = int.from_bytes(hashlib.sha256("|".join([icd, *labels]).encode()).digest()[:2], "big") % 3000
+    # mimic WONDER: small counts are suppressed, large ones carry thousands separators
+    return "Suppressed" if n < 10 else f"{n:,}"
+
+
+class WonderStub(BaseHTTPRequestHandler):
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0))).decode()
+        form = {k: v[0] for k, v in up.parse_qs(body).items()}
+        params = {}
+        for p in ET.fromstring(form["request_xml"]).iter("parameter"):
+            params[p.findtext("name")] = p.findtext("value")
+        dims = [params[f"B_{i}"] for i in range(1, 6) if f"B_{i}" in params]
+        icd = params.get("F_D76.V2", "")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/xml")
+        self.end_headers()
+        self.wfile.write(b"<page><response><data-table>")
+        levels = [LEVELS.get(d, ["Unknown"]) for d in dims]
+        for index in itertools.product(*(range(len(lv)) for lv in levels)):
+            labels = [lv[i] for lv, i in zip(levels, index)]
+            # like WONDER, a label shared by the rows below it is sent once with r="rows spanned"
+            cells = ""
+            for k, label in enumerate(labels):
+                if any(index[k + 1:]):
+                    continue  # still inside this label's span
+                span = 1
+                for lv in levels[k + 1:]:
+                    span *= len(lv)
+                cells += f'<c l={quoteattr(label)} r="{span}"/>' if span > 1 else f'<c l={quoteattr(label)}/>'
+            self.wfile.write(f'<r>{cells}<c v="{synthetic_deaths(icd, labels)}"/></r>'.encode())
+        # totals row, which clients must skip
+        self.wfile.write(b'<r><c l="Total" c="1"/><c v="0"/></r>')
+        self.wfile.write(b"</data-table></response></page>")
+
+    def log_message(self, fmt, *args):
+        pass
+
+
+def serve(port: int = 8767) -> ThreadingHTTPServer:
+    return ThreadingHTTPServer(("127.0.0.1", port), WonderStub)
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--port", type=int, default=8767)
+    args = ap.parse_args()
+    print(f"CDC WONDER stub on http://127.0.0.1:{args.port}/D76")
+    serve(args.port).serve_forever()
@@ -0,0 +1,246 @@
+"""Incremental pipeline runner: fetch -> transform -> analyze -> visualization.
+
+Each stage declares its script, input files, output files and extra code
+files. A stage's fingerprint is the SHA-256 of its input contents plus its
+code, and it only re-runs when that fingerprint differs from the last
+successful run (kept in data/interim/pipeline_state.json) or an output is
+missing. Stages whose inputs are produced by other stages wait for them;
+independent stages run in parallel.
+
+    PYTHONPATH=src python src/pipeline.py --dry-run
+    PYTHONPATH=src python src/pipeline.py --jobs 3
+    PYTHONPATH=src python src/pipeline.py --fetch        # include the network fetch stages
+"""
+import argparse
+import fnmatch
+import hashlib
+import json
+import os
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+from utils.io import ROOT, INTERIM
+from utils.logging import get_logger
+
+logger = get_logger("pipeline")
+
+STATE_PATH = INTERIM / "pipeline_state.json"
+SHARED_CODE = ["src/utils/io.py", "src/utils/logging.py"]
+
+
+class Stage:
+    def __init__(self, name, script, inputs=(), outputs=(), code=(), args=(), fetch=False):
+        self.name = name
+        self.script = script
+        self.inputs = list(inputs)  # paths or globs relative to the repo root
+        self.outputs = list(outputs)
+        self.code = [script, *code, *SHARED_CODE]
+        self.args = list(args)
+        self.fetch = fetch  # needs the network; only run with --fetch
+
+    def __repr__(self):
+        return f"Stage({self.name})"
+
+
+STAGES = [
+    Stage("fetch_pubmed", "src/fetch/pubmed_counts_by_gender.py",
+          inputs=["src/config/diseases.yaml"], outputs=["data/raw/pubmed_counts_by_gender.csv"],
+          code=["src/utils/http_cache.py", "src/utils/ratelimit.py"], fetch=True),
+    Stage("fetch_trends", "src/fetch/google_trends.py",
+          inputs=["src/config/diseases.yaml"], outputs=["data/raw/google_trends_interest.csv"],
+          code=["src/utils/http_cache.py", "src/fetch/trends_scheduler.py"], fetch=True),
+    Stage("fetch_cdc", "src/fetch/cdc_wonder_by_gender.py",
+          outputs=["data/raw/*_wonder_api.csv"], code=["src/utils/http_cache.py"], fetch=True),
+    Stage("transform", "src/transform/clean_merge_gendered.py",
+          inputs=["data/raw/pubmed_counts_by_gender.csv", "data/raw/*_trends_women*.csv",
+                  "data/raw/*_trends_men*.csv",
+                  "data/raw/*_wonder_by_sex.csv"],
+          outputs=["data/processed/merged_gendered_signals.csv", "data/processed/signal_cube.csv"],
+          code=["src/transform/wonder_reader.py", "src/transform/signal_cube.py"]),
+    Stage("correlations", "src/analyze/correlations.py",
+          inputs=["data/processed/merged_gendered_signals.csv"],
+          outputs=["reports/correlation_summary.csv"]),
+    Stage("significance", "src/analyze/significance.py",
+          inputs=["data/processed/merged_gendered_signals.csv"],
+          outputs=["reports/correlation_significance.csv"], code=["src/analyze/correlations.py"]),
+    Stage("granger", "src/analyze/granger.py",
+          inputs=["data/processed/merged_gendered_signals.csv"],
+          outputs=["reports/granger_results.csv"]),
+    Stage("gender_ratios", "src/analyze/gender_ratios.py",
+          inputs=["data/processed/merged_gendered_signals.csv"],
+          outputs=["data/processed/gender_ratios.csv"]),
+    Stage("analyze_ratios", "src/analyze/ratios_time_series.py",
+          inputs=["data/processed/merged_attention_signals.csv"],
+          outputs=["data/processed/attention_scores.csv"]),
+    Stage("plot_attention", "src/visualization/plots.py",
+          inputs=["data/processed/attention_scores.csv"], outputs=["reports/attention_gap.png"],
+          code=["src/visualization/render.py"]),
+    Stage("plot_correlations", "src/visualization/plot_correlations.py",
+          inputs=["reports/correlation_summary.csv", "reports/correlation_significance.csv"],
+          outputs=["reports/corr_heatmap_*.png"], code=["src/visualization/render.py"]),
+    Stage("corr_followups", "src/visualization/corr_followups.py",
+          inputs=["reports/correlation_summary.csv", "data/processed/merged_gendered_signals.csv"],
+          outputs=["reports/corr_followups_summary.md"],
+          code=["src/analyze/ccf.py", "src/analyze/granger.py", "src/visualization/render.py"]),
+    Stage("gender_disparity_plots", "src/visualization/gender_disparity_plots.py",
+          inputs=["data/processed/merged_gendered_signals.csv"],
+          outputs=["reports/correlation_heatmap.png"], code=["src/visualization/render.py"]),
+]
+
+
+def expand(patterns) -> list:
+    files = []
+    for pat in patterns:
+        files += sorted(ROOT.glob(pat)) if any(ch in pat for ch in "*?[") else [ROOT / pat]
+    return files
+
+
+def file_digest(path) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as fh:
+        for chunk in iter(lambda: fh.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def fingerprint(stage: Stage) -> str:
+    h = hashlib.sha256(json.dumps([stage.script, stage.args]).encode())
+    for path in expand(stage.inputs) + expand(stage.code):
+        h.update(str(path.relative_to(ROOT)).encode())
+        h.update(file_digest(path).encode() if path.exists() else b"<missing>")
+    return h.hexdigest()
+
+
+def producers(stages) -> dict:
+    """Map each stage name to the names of the stages whose outputs it reads."""
+    def overlaps(a, b):
+        return a == b or fnmatch.fnmatch(a, b) or fnmatch.fnmatch(b, a)
+    return {s.name: {o.name for o in stages if o is not s
+                     and any(overlaps(i, out) for i in s.inputs for out in o.outputs)}
+            for s in stages}
+
+
+def missing_inputs(stage: Stage) -> list:
+    return [pat for pat in stage.inputs if not any(p.exists() for p in expand([pat]))]
+
+
+def missing_outputs(stage: Stage) -> list:
+    return [pat for pat in stage.outputs if not any(p.exists() for p in expand([pat]))]
+
+
+def load_state() -> dict:
+    return json.loads(STATE_PATH.read_text()) if STATE_PATH.exists() else {}
+
+
+def save_state(state: dict) -> None:
+    STATE_PATH.write_text(json.dumps(state, indent=2, sort_keys=True))
+
+
+def run_stage(stage: Stage) -> subprocess.CompletedProcess:
+    env = {**os.environ, "PYTHONPATH": str(ROOT / "src"), "MPLBACKEND": "Agg"}
+    return subprocess.run([sys.executable, stage.script, *stage.args], cwd=ROOT, env=env,
+                          capture_output=True, text=True)
+
+
+def stale_reason(stage: Stage, state: dict, upstream_ran: bool, force: bool):
+    """Why `stage` must run, or None when it is up to date.
+
+    `upstream_ran` is only set by dry runs, where an upstream stage that
+    would run leaves this stage's future inputs unknown. In a real run the
+    upstream outputs already exist and are simply fingerprinted, so an
+    upstream re-run that produced identical files does not cascade.
+    """
+    if force:
+        return "forced"
+    if upstream_ran:
+        return "upstream would run"
+    if stage.name not in state:
+        return "never run"
+    if missing_outputs(stage):
+        return f"missing outputs {missing_outputs(stage)}"
+    if state[stage.name] != fingerprint(stage):
+        return "inputs or code changed"
+    return None
+
+
+def run(stages, jobs: int = 4, dry_run: bool = False, force: bool = False) -> int:
+    deps = producers(stages)
+    state = load_state()
+    pending = {s.name: s for s in stages}
+    done, failed, ran = set(), set(), set()
+    running = {}
+
+    def ready(s):
+        return deps[s.name] <= done
+
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        while pending or running:
+            for name, s in list(pending.items()):
+                if deps[name] & failed:
+                    logger.warning(f"{name}: skipped, upstream failed")
+                    failed.add(name)
+                    del pending[name]
+                elif ready(s):
+                    del pending[name]
+                    upstream_ran = dry_run and bool(deps[name] & ran)
+                    if not upstream_ran and missing_inputs(s):
+                        logger.warning(f"{name}: skipped, missing inputs {missing_inputs(s)}")
+                        done.add(name)
+                        continue
+                    reason = stale_reason(s, state, upstream_ran, force)
+                    if reason is None:
+                        logger.info(f"{name}: up to date")
+                        done.add(name)
+                    elif dry_run:
+                        logger.info(f"{name}: would run ({reason})")
+                        ran.add(name)
+                        done.add(name)
+                    else:
+                        logger.info(f"{name}: running ({reason})")
+                        running[pool.submit(run_stage, s)] = (s, time.monotonic())
+            if not running:
+                if pending and not any(ready(s) or deps[n] & failed for n, s in pending.items()):
+                    logger.error(f"unresolvable dependencies: {sorted(pending)}")
+                    return 1
+                continue
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for fut in finished:
+                s, start = running.pop(fut)
+                proc = fut.result()
+                secs = time.monotonic() - start
+                if proc.returncode == 0:
+                    logger.info(f"{s.name}: done in {secs:.1f}s")
+                    state[s.name] = fingerprint(s)
+                    save_state(state)
+                    ran.add(s.name)
+                    done.add(s.name)
+                else:
+                    logger.error(f"{s.name}: failed after {secs:.1f}s\n{proc.stdout[-2000:]}{proc.stderr[-2000:]}")
+                    state.pop(s.name, None)
+                    save_state(state)
+                    failed.add(s.name)
+    return 1 if failed else 0
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Run stale pipeline stages")
+    ap.add_argument("--dry-run", action="store_true", help="show what would run without running it")
+    ap.add_argument("--fetch", action="store_true", help="include the network fetch stages")
+    ap.add_argument("--force", action="store_true", help="run every selected stage regardless of state")
+    ap.add_argument("--only", help="comma-separated stage names to consider")
+    ap.add_argument("--jobs", type=int, default=4, help="stages to run in parallel")
+    args = ap.parse_args(argv)
+    stages = [s for s in STAGES if args.fetch or not s.fetch]
+    if args.only:
+        names = set(args.only.split(","))
+        unknown = names - {s.name for s in STAGES}
+        if unknown:
+            ap.error(f"unknown stages: {sorted(unknown)}")
+        stages = [s for s in stages if s.name in names]
+    sys.exit(run(stages, jobs=args.jobs, dry_run=args.dry_run, force=args.force))
+
+
+if __name__ == "__main__":
+    main()
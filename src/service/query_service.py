@@ -0,0 +1,404 @@
+"""Local HTTP/JSON query service over the processed signals.
+
+Keeps merged_gendered_signals in memory (through a utils.context.DataContext,
+grouped by disease x gender once) and answers slice, CCF, correlation and
+ratio queries with the analysis functions the batch steps use. Encoded
+responses go into an in-memory LRU keyed by the normalized query; the cache
+is dropped when the signals file changes on disk. Every request's latency
+is recorded per endpoint and reported (count, p50, p99) by /metrics.
+
+    PYTHONPATH=src python src/service/query_service.py --port 8780
+    curl 'http://127.0.0.1:8780/slice?disease=ms&gender=women&start=2010&end=2020&signals=count,interest&z=1'
+    curl 'http://127.0.0.1:8780/ccf?disease=ms&gender=women&a=interest&b=deaths&max_lag=5'
+    curl 'http://127.0.0.1:8780/correlations?disease=ms&gender=women&pair=interest-count'
+    curl 'http://127.0.0.1:8780/ratios?disease=ms&start=2010&end=2020&signals=count'
+    curl 'http://127.0.0.1:8780/metrics'
+
+    # load test: server on a free port in this process, N requests from C threads
+    PYTHONPATH=src python src/service/query_service.py --bench 5000 --concurrency 8
+
+Nothing outside this machine is contacted; all endpoints are GET and read-only.
+"""
+import argparse
+import json
+import random
+import threading
+import time
+import urllib.error
+import urllib.parse as up
+import urllib.request
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+import pandas as pd
+
+from analyze.ccf import fft_ccf, lags_for
+from analyze.correlations import PAIRS, correlation_summary
+from analyze.gender_ratios import SIGNALS as RATIO_SIGNALS, RatioTable, ratio_table
+from utils.context import DataContext
+from utils.logging import get_logger
+from visualization.corr_followups import zscore
+
+logger = get_logger("query_service")
+
+SIGNALS = ["count", "interest", "deaths", "population", "crude_rate"]
+MAX_LAG = 10
+LATENCY_SAMPLES = 10000  # per endpoint; percentiles are over the most recent requests
+
+
+class BadRequest(ValueError):
+    """A query parameter is missing or invalid (HTTP 400)."""
+
+
+class LRUCache:
+    """Thread-safe least-recently-used map of at most `maxsize` entries."""
+
+    def __init__(self, maxsize: int = 1024):
+        self.maxsize = maxsize
+        self.hits = self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            value = self._data.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value) -> None:
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {"size": len(self._data), "maxsize": self.maxsize, "hits": self.hits, "misses": self.misses,
+                    "hit_rate": round(self.hits / total, 4) if total else None}
+
+
+class Latencies:
+    """Per-endpoint request count and a bounded window of latencies for p50/p99."""
+
+    def __init__(self, samples: int = LATENCY_SAMPLES):
+        self.samples = samples
+        self._seen = {}
+        self._lock = threading.Lock()
+
+    def record(self, endpoint: str, seconds: float, status: int) -> None:
+        with self._lock:
+            seen = self._seen.setdefault(endpoint, {"count": 0, "errors": 0, "window": deque(maxlen=self.samples)})
+            seen["count"] += 1
+            seen["errors"] += status >= 400
+            seen["window"].append(seconds)
+
+    def summary(self) -> dict:
+        with self._lock:
+            seen = {name: (s["count"], s["errors"], np.array(s["window"])) for name, s in self._seen.items()}
+        out = {}
+        for name, (count, errors, window) in sorted(seen.items()):
+            p50, p99 = np.percentile(window, [50, 99]) * 1000
+            out[name] = {"count": count, "errors": errors, "p50_ms": round(p50, 3), "p99_ms": round(p99, 3),
+                         "max_ms": round(window.max() * 1000, 3)}
+        return out
+
+
+def _records(df: pd.DataFrame) -> list:
+    # NaN -> null; numpy scalars -> Python numbers
+    return json.loads(df.to_json(orient="records", double_precision=15))
+
+
+class QueryService:
+    """The queries behind the HTTP endpoints; each returns a JSON-able dict or raises BadRequest."""
+
+    def __init__(self, ctx: DataContext = None, cache_size: int = 1024):
+        self.ctx = ctx or DataContext()
+        self.cache = LRUCache(cache_size)
+        self.latencies = Latencies()
+        self._lock = threading.Lock()
+        self._frame = None
+        self._derived = {}
+        self.refresh()
+
+    def refresh(self) -> pd.DataFrame:
+        """The resident signals; reloads them (and drops cached results) if the file changed on disk."""
+        with self._lock:
+            df = self.ctx.signals()
+            if df is not self._frame:
+                groups = self.ctx.groups()
+                self._frame, self._groups = df, groups
+                self._derived = {}
+                self.cache.clear()
+                logger.info(f"Loaded {len(df)} signal rows, {len(groups)} disease x gender series")
+            return df
+
+    def derived(self, name: str, build):
+        """A whole-table result (correlation summary, ratio table) built once per data version."""
+        with self._lock:
+            if name not in self._derived:
+                self._derived[name] = build(self._frame)
+            return self._derived[name]
+
+    # parameter parsing
+    def _series(self, params: dict) -> pd.DataFrame:
+        disease, gender = params.get("disease"), params.get("gender")
+        if not disease or not gender:
+            raise BadRequest("disease and gender are required")
+        sub = self._groups.get((disease, gender))
+        if sub is None:
+            raise BadRequest(f"no series for disease={disease!r} gender={gender!r}")
+        return sub
+
+    @staticmethod
+    def _signals(params: dict, default) -> list:
+        # repeated names are dropped (keeping order) so the reply never has duplicate columns
+        signals = list(dict.fromkeys(params["signals"].split(","))) if params.get("signals") else list(default)
+        unknown = [s for s in signals if s not in SIGNALS]
+        if unknown:
+            raise BadRequest(f"unknown signals {unknown}; choose from {SIGNALS}")
+        return signals
+
+    @staticmethod
+    def _int(params: dict, name: str, default=None):
+        value = params.get(name)
+        if value is None:
+            return default
+        try:
+            return int(value)
+        except ValueError:
+            raise BadRequest(f"{name} must be an integer, got {value!r}") from None
+
+    def _years(self, df: pd.DataFrame, params: dict) -> pd.DataFrame:
+        start, end = self._int(params, "start"), self._int(params, "end")
+        if start is not None:
+            df = df[df["year"] >= start]
+        if end is not None:
+            df = df[df["year"] <= end]
+        return df
+
+    # endpoints
+    def health(self, params: dict) -> dict:
+        df = self._frame
+        return {"status": "ok", "rows": len(df), "series": len(self._groups),
+                "years": [int(df["year"].min()), int(df["year"].max())] if len(df) else None}
+
+    def series(self, params: dict) -> dict:
+        return {"series": [{"disease": d, "gender": g, "rows": len(sub)} for (d, g), sub in self._groups.items()],
+                "signals": SIGNALS}
+
+    def slice(self, params: dict) -> dict:
+        """Rows of one disease x gender within [start, end]; z=1 z-scores each signal over the whole series."""
+        sub = self._series(params)
+        signals = self._signals(params, SIGNALS)
+        out = sub[["year", *signals]].astype({s: "float64" for s in signals})
+        if params.get("z") in ("1", "true", "yes"):
+            out = out.assign(**{s: zscore(out[s]) for s in signals})
+        out = self._years(out, params).sort_values("year")
+        return {"disease": params["disease"], "gender": params["gender"], "rows": _records(out)}
+
+    def ccf(self, params: dict) -> dict:
+        """Cross-correlation of a (year t) with b (year t + lag) on the series' calendar years; lag > 0: a leads b."""
+        sub = self._years(self._series(params), params)
+        a, b = self._signals({"signals": params.get("a", "")}, []), self._signals({"signals": params.get("b", "")}, [])
+        if len(a) != 1 or len(b) != 1:
+            raise BadRequest("a and b must each name one signal")
+        max_lag = self._int(params, "max_lag", 5)
+        if not 0 <= max_lag <= MAX_LAG:
+            raise BadRequest(f"max_lag must be within 0..{MAX_LAG}")
+        if sub["year"].nunique() < 2:
+            raise BadRequest("a cross-correlation needs at least 2 years of data in the requested range")
+        # missing years stay NaN, so fft_ccf masks them instead of shifting the series
+        years = pd.RangeIndex(sub["year"].min(), sub["year"].max() + 1)
+        wide = sub.groupby("year")[[a[0], b[0]]].mean().reindex(years).astype("float64")
+        r, n = fft_ccf(wide[a[0]].to_numpy(), wide[b[0]].to_numpy(), max_lag)
+        lags = lags_for(max_lag, len(years))
+        return {"disease": params["disease"], "gender": params["gender"], "a": a[0], "b": b[0],
+                "lags": lags.tolist(), "r": [None if np.isnan(x) else round(float(x), 6) for x in r],
+                "n": n.tolist()}
+
+    def correlations(self, params: dict) -> dict:
+        """Rows of the lagged correlation summary (analyze.correlations) for the resident data."""
+        def build(df):
+            signals = sorted({s for pair in PAIRS for s in pair})
+            return correlation_summary(df[["year", "disease_id", "gender", *signals]]
+                                       .astype({s: "float64" for s in signals}))
+        out = self.derived("correlations", build)
+        for col, name in [("disease_id", "disease"), ("gender", "gender"), ("pair", "pair")]:
+            if params.get(name):
+                out = out[out[col] == params[name]]
+        lag = self._int(params, "lag")
+        if lag is not None:
+            out = out[out["lag"] == lag]
+        return {"rows": _records(out)}
+
+    def ratios(self, params: dict) -> dict:
+        """Female:male ratios (analyze.gender_ratios) for one disease within [start, end]."""
+        table = self.derived("ratios", lambda df: RatioTable(ratio_table(df)))
+        disease = params.get("disease")
+        if not disease:
+            raise BadRequest("disease is required")
+        if disease not in table.diseases:
+            raise BadRequest(f"no ratios for disease={disease!r}")
+        signals = self._signals(params, RATIO_SIGNALS)
+        cols = [c for c in table.df.columns if any(c.startswith(f"{s}_") for s in signals)]
+        if not cols:
+            raise BadRequest(f"ratios are only kept for {RATIO_SIGNALS}")
+        out = table.lookup(disease, (self._int(params, "start"), self._int(params, "end")), cols)
+        return {"disease": disease, "rows": _records(out.reset_index(level="year").reset_index(drop=True))}
+
+    def metrics(self, params: dict) -> dict:
+        return {"latency": self.latencies.summary(), "cache": self.cache.stats(), "data_parses": dict(self.ctx.parses)}
+
+    ENDPOINTS = {"/health": "health", "/series": "series", "/slice": "slice", "/ccf": "ccf",
+                 "/correlations": "correlations", "/ratios": "ratios", "/metrics": "metrics"}
+    UNCACHED = {"/health", "/metrics"}
+
+    def handle(self, path: str, params: dict):
+        """(status, JSON body bytes) for one request; cacheable results come from / go into the LRU."""
+        start = time.perf_counter()
+        status, body = self._handle(path, params)
+        self.latencies.record(path if path in self.ENDPOINTS else "(unknown)", time.perf_counter() - start, status)
+        return status, body
+
+    def _handle(self, path: str, params: dict):
+        if path not in self.ENDPOINTS:
+            return 404, json.dumps({"error": f"unknown endpoint {path}", "endpoints": list(self.ENDPOINTS)}).encode()
+        self.refresh()
+        cacheable = path not in self.UNCACHED
+        key = (path, tuple(sorted(params.items())))
+        if cacheable:
+            body = self.cache.get(key)
+            if body is not None:
+                return 200, body
+        try:
+            body = json.dumps(getattr(self, self.ENDPOINTS[path])(params)).encode()
+        except BadRequest as e:
+            return 400, json.dumps({"error": str(e)}).encode()
+        if cacheable:
+            self.cache.put(key, body)
+        return 200, body
+
+
+class QueryHandler(BaseHTTPRequestHandler):
+    service = None  # set by serve()
+    protocol_version = "HTTP/1.1"  # keep-alive, so load tests measure queries rather than connects
+
+    def _send(self, body: bytes, status: int = 200) -> None:
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        url = up.urlparse(self.path)
+        params = {k: v[0] for k, v in up.parse_qs(url.query).items()}
+        try:
+            status, body = self.service.handle(url.path, params)
+        except Exception as e:  # keep serving; report the failure to the client
+            logger.exception(f"{self.path} failed")
+            status, body = 500, json.dumps({"error": f"{type(e).__name__}: {e}"}).encode()
+        self._send(body, status)
+
+    def log_message(self, fmt, *args):
+        pass
+
+
+def serve(port: int = 8780, service: QueryService = None) -> ThreadingHTTPServer:
+    handler = type("BoundQueryHandler", (QueryHandler,), {"service": service or QueryService()})
+    return ThreadingHTTPServer(("127.0.0.1", port), handler)
+
+
+def bench_queries(service: QueryService, n: int, seed: int = 0) -> list:
+    """n query paths mixing slices, CCFs, correlations and ratios over the resident series."""
+    rng = random.Random(seed)
+    keys = list(service._groups)
+    df = service._frame
+    lo, hi = int(df["year"].min()), int(df["year"].max())
+    queries = []
+    for _ in range(n):
+        disease, gender = rng.choice(keys)
+        start = rng.randint(lo, hi)
+        end = rng.randint(start, hi)
+        kind = rng.random()
+        if kind < 0.5:
+            signals = ",".join(rng.sample(SIGNALS, rng.randint(1, 3)))
+            q = ("/slice", {"disease": disease, "gender": gender, "start": start, "end": end,
+                            "signals": signals, "z": rng.choice([0, 1])})
+        elif kind < 0.8:
+            a, b = rng.sample(["count", "interest", "deaths"], 2)
+            q = ("/ccf", {"disease": disease, "gender": gender, "a": a, "b": b, "max_lag": rng.randint(1, 5)})
+        elif kind < 0.9:
+            q = ("/correlations", {"disease": disease, "gender": gender, "pair": "-".join(rng.choice(PAIRS))})
+        else:
+            q = ("/ratios", {"disease": disease, "start": start, "end": end})
+        queries.append(f"{q[0]}?{up.urlencode(q[1])}")
+    return queries
+
+
+def bench(n: int, concurrency: int, cache_size: int) -> dict:
+    """Start the service on a free local port, send n mixed queries from `concurrency` threads, return /metrics."""
+    service = QueryService(cache_size=cache_size)
+    server = serve(0, service)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = f"http://127.0.0.1:{server.server_address[1]}"
+    queries = bench_queries(service, n)
+
+    def get(path):
+        try:
+            with urllib.request.urlopen(base + path) as resp:
+                resp.read()
+        except urllib.error.HTTPError as e:
+            return e.code
+        return 200
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as pool:
+        statuses = list(pool.map(get, queries))
+    elapsed = time.perf_counter() - start
+    with urllib.request.urlopen(base + "/metrics") as resp:
+        metrics = json.loads(resp.read())
+    server.shutdown()
+    failed = sum(s != 200 for s in statuses)
+    print(f"{n} requests from {concurrency} threads in {elapsed:.2f}s ({n / elapsed:.0f} req/s), {failed} non-200")
+    for name, m in metrics["latency"].items():
+        print(f"  {name:<14} n={m['count']:<6} p50 {m['p50_ms']:8.3f}ms  p99 {m['p99_ms']:8.3f}ms")
+    c = metrics["cache"]
+    print(f"  cache: {c['hits']} hits, {c['misses']} misses, {c['size']}/{c['maxsize']} entries")
+    return metrics
+
+
+def main(argv=None, ctx=None):
+    ap = argparse.ArgumentParser(description="Local JSON query service over the processed signals")
+    ap.add_argument("--port", type=int, default=8780)
+    ap.add_argument("--cache-size", type=int, default=1024, help="LRU entries of encoded responses")
+    ap.add_argument("--bench", type=int, metavar="N", help="load-test N requests against a local instance and exit")
+    ap.add_argument("--concurrency", type=int, default=8, help="client threads for --bench")
+    args = ap.parse_args(argv)
+    if args.bench:
+        bench(args.bench, args.concurrency, args.cache_size)
+        return
+    server = serve(args.port, QueryService(ctx, cache_size=args.cache_size))
+    logger.info(f"Query service on http://127.0.0.1:{server.server_address[1]} (Ctrl-C to stop)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
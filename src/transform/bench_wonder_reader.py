@@ -0,0 +1,105 @@
+"""Benchmark the vectorized WONDER reader against the previous per-cell parser.
+
+Writes a synthetic state x county x year x sex x age export to data/interim/
+and times both paths on it:
+
+    PYTHONPATH=src python src/transform/bench_wonder_reader.py --rows 1000000
+"""
+import argparse
+import re
+import time
+
+import numpy as np
+import pandas as pd
+
+from utils.io import INTERIM
+from transform.wonder_reader import read_wonder
+
+
+def legacy_load(fpath, disease):
+    # the per-cell implementation load_cdc used before wonder_reader
+    df = pd.read_csv(fpath, dtype=str)
+    df = df.rename(columns=lambda x: x.strip().lower().replace(' ', '_'))
+    df = df[df['year'].apply(lambda x: str(x).isdigit() if pd.notnull(x) else False)]
+    df = df[df['sex'].isin(['Male', 'Female'])]
+    df['year'] = df['year'].astype(int)
+    df['disease_id'] = disease
+    df['gender'] = df['sex'].map({'Male': 'men', 'Female': 'women'})
+
+    def clean_num(val):
+        if pd.isnull(val):
+            return pd.NA
+        if isinstance(val, str):
+            if 'Suppressed' in val or 'Unreliable' in val:
+                return pd.NA
+            val = re.sub(r'[^0-9\.]+', '', val)
+        try:
+            return float(val)
+        except:
+            return pd.NA
+    df['deaths'] = df['deaths'].apply(clean_num)
+    df['population'] = pd.to_numeric(df['population'], errors='coerce')
+    df['crude_rate'] = df['crude_rate'].apply(clean_num)
+    return df[['year', 'disease_id', 'gender', 'deaths', 'population', 'crude_rate']]
+
+
+def synthetic_export(path, rows: int, seed: int = 0) -> None:
+    rng = np.random.default_rng(seed)
+    deaths = rng.integers(0, 5000, rows)
+    pop = rng.integers(1_000, 5_000_000, rows)
+    rate = deaths / pop * 100_000
+    deaths_s = np.where(deaths < 10, 'Suppressed', np.char.mod('%d', deaths))
+    deaths_s = np.where(deaths >= 1000, [f'{d:,}' for d in deaths], deaths_s)
+    rate_s = np.char.mod('%.1f', rate)
+    rate_s = np.where(deaths < 20, np.char.add(rate_s, ' (Unreliable)'), rate_s)
+    rate_s = np.where(deaths < 10, 'Suppressed', rate_s)
+    years = rng.integers(1999, 2021, rows).astype(str)
+    df = pd.DataFrame({
+        'Notes': '',
+        'State': rng.choice([f'State {i:02d}' for i in range(51)], rows),
+        'County': rng.choice([f'County {i:05d}' for i in range(3143)], rows),
+        'Year': years,
+        'Year Code': years,
+        'Sex': rng.choice(['Female', 'Male'], rows),
+        'Age Group': rng.choice(['25-34 years', '35-44 years', '45-54 years', '55-64 years'], rows),
+        'Deaths': deaths_s,
+        'Population': pop.astype(str),
+        'Crude Rate': rate_s,
+    })
+    # totals and footnote rows, as in real exports
+    df.loc[::1000, ['Notes', 'Year', 'Sex']] = ['Total', '', '']
+    df.to_csv(path, index=False)
+    with open(path, 'a') as fh:
+        fh.write('"---"\n"Dataset: Underlying Cause of Death, 1999-2020"\n')
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument('--rows', type=int, default=1_000_000)
+    ap.add_argument('--chunksize', type=int, default=250_000)
+    args = ap.parse_args()
+    path = INTERIM / f'bench_wonder_{args.rows}.csv'
+    if not path.exists():
+        synthetic_export(path, args.rows)
+
+    t = time.perf_counter()
+    old = legacy_load(path, 'bench')
+    t_old = time.perf_counter() - t
+    t = time.perf_counter()
+    new = read_wonder(path, 'bench')
+    t_new = time.perf_counter() - t
+    t = time.perf_counter()
+    chunked = pd.concat(read_wonder(path, 'bench', chunksize=args.chunksize), ignore_index=True)
+    t_chunked = time.perf_counter() - t
+
+    same = all(np.allclose(pd.to_numeric(old[c], errors='coerce').astype(float), new[c], equal_nan=True)
+               for c in ['deaths', 'population', 'crude_rate'])
+    same = same and len(chunked) == len(new) and old['year'].tolist() == new['year'].tolist()
+    print(f'rows: {args.rows:,} ({len(new):,} data rows), identical values: {same}')
+    print(f'legacy per-cell : {t_old:7.2f}s')
+    print(f'vectorized      : {t_new:7.2f}s  ({t_old / t_new:.1f}x)')
+    print(f'vectorized chunk: {t_chunked:7.2f}s  (chunksize {args.chunksize:,})')
+
+
+if __name__ == '__main__':
+    main()
@@ -1,43 +1,95 @@
+import argparse
+import os
+import re
+import shutil
+import sys
+from concurrent.futures import ProcessPoolExecutor
 import pandas as pd
 from pathlib import Path
-from utils.io import RAW, PROCESSED, write_csv
+from utils.io import RAW, INTERIM, PROCESSED, write_table, TableAppender, apply_schema, memory_report
 from utils.logging import get_logger
-import re
+from transform.wonder_reader import read_wonder
+from transform.signal_cube import build_cube, TABLE as CUBE_TABLE
+
+# Trends exports are named {disease}_trends_{gender}.csv (national) or
+# {disease}_trends_{gender}_{geo}.csv (e.g. ms_trends_women_US-CA.csv).
+# A RAW/trends_manifest.csv with file,disease_id,gender[,geo] columns overrides discovery.
+TRENDS_FILE = re.compile(r'^(?P<disease>.+?)_trends_(?P<gender>women|men)(?:_(?P<geo>[A-Za-z0-9-]+))?\.csv$')
+TRENDS_MANIFEST = RAW / 'trends_manifest.csv'
+# below this many files a process pool costs more than it saves
+POOL_MIN_FILES = 16
 
-disease_files = {
-    'hashimoto': {'women': 'hashimoto_trends_women.csv', 'men': 'hashimoto_trends_men.csv'},
-    'lupus': {'women': 'lupus_trends_women.csv', 'men': 'lupus_trends_men.csv'},
-    'ms': {'women': 'ms_trends_women.csv', 'men': 'ms_trends_men.csv'},
-    'ra': {'women': 'ra_trends_women.csv', 'men': 'ra_trends_men.csv'},
-    # sjogren omitted (no gendered trends)
-}
+def discover_trends(raw_dir=RAW) -> pd.DataFrame:
+    """One row per Trends export: path, disease_id, gender, geo ('' for national)."""
+    manifest = raw_dir / TRENDS_MANIFEST.name
+    if manifest.exists():
+        files = pd.read_csv(manifest, dtype=str).fillna('')
+        if 'geo' not in files.columns:
+            files['geo'] = ''
+        files['path'] = [str(raw_dir / f) for f in files['file']]
+        return files[['path', 'disease_id', 'gender', 'geo']]
+    rows = []
+    for fpath in sorted(raw_dir.glob('*_trends_*.csv')):
+        m = TRENDS_FILE.match(fpath.name)
+        if m:
+            rows.append((str(fpath), m['disease'], m['gender'], m['geo'] or ''))
+    return pd.DataFrame(rows, columns=['path', 'disease_id', 'gender', 'geo'])
 
-def clean_trends_csv(path, disease, gender):
+# date format per first-column header; Trends exports shorter timeframes by week or day
+TRENDS_DATE_FORMATS = {'Month': '%Y-%m', 'Week': '%Y-%m-%d', 'Day': '%Y-%m-%d'}
+
+def clean_trends_csv(path, disease, gender, geo=''):
     # Skip first two lines, extract month and value, standardize columns
     df = pd.read_csv(path, skiprows=2)
+    period = df.columns[0]
+    if period not in TRENDS_DATE_FORMATS:
+        raise ValueError(f'{path}: unknown Trends date column {period!r}, expected one of {list(TRENDS_DATE_FORMATS)}')
+    # weekly/daily dates keep the 'month' name; the cube and yearly means bin them by calendar period
     df.columns = ['month', 'interest']
     df['disease_id'] = disease
     df['gender'] = gender
+    df['geo'] = geo
     # Remove trailing text from interest col if present
     df['interest'] = pd.to_numeric(df['interest'], errors='coerce')
     # Drop rows with missing/NaN
     df = df.dropna(subset=['interest'])
+    # one fixed format per file (from its header) skips per-row format inference
+    fmt = TRENDS_DATE_FORMATS[period]
+    df['month'] = pd.to_datetime(df['month'], format=fmt, errors='coerce')
+    if len(df) and df['month'].isna().all():
+        raise ValueError(f'{path}: no {period} dates in {fmt} format')
+    df = df.dropna(subset=['month'])
+    df['year'] = df['month'].dt.year
     return df
 
-def combine_trends():
-    frames = []
-    for disease, genders in disease_files.items():
-        for gender, fname in genders.items():
-            fpath = RAW / fname
-            if fpath.exists():
-                frames.append(clean_trends_csv(fpath, disease, gender))
-    all_trends = pd.concat(frames, ignore_index=True)
-    # Convert month to datetime, extract year
-    all_trends['month'] = pd.to_datetime(all_trends['month'], errors='coerce')
-    all_trends = all_trends.dropna(subset=['month'])
-    all_trends['year'] = all_trends['month'].dt.year
+def _clean_row(row):
+    return clean_trends_csv(*row)
+
+def monthly_trends(files=None, by_geo=False, workers=None):
+    """Monthly Trends rows (month, interest, disease_id, gender, geo, year) of every export.
+
+    `files` defaults to discover_trends(); without `by_geo` only the national
+    exports are used. Files are parsed in a process pool once there are
+    enough of them to pay for it.
+    """
+    files = discover_trends() if files is None else files
+    if not by_geo:
+        files = files[files['geo'] == '']
+    rows = list(files[['path', 'disease_id', 'gender', 'geo']].itertuples(index=False, name=None))
+    workers = workers or os.cpu_count() or 1
+    if workers > 1 and len(rows) >= POOL_MIN_FILES:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            frames = list(pool.map(_clean_row, rows, chunksize=max(1, len(rows) // (workers * 4))))
+    else:
+        frames = [_clean_row(r) for r in rows]
+    return pd.concat(frames, ignore_index=True)
+
+def combine_trends(files=None, by_geo=False, workers=None, monthly=None):
+    """Yearly mean interest per disease x gender (x geo with `by_geo`), from `monthly` if given."""
+    all_trends = monthly_trends(files, by_geo, workers) if monthly is None else monthly
+    keys = ['year', 'disease_id', 'gender'] + (['geo'] if by_geo else [])
     # Aggregate to yearly mean
-    yearly = (all_trends.groupby(['year','disease_id','gender'], as_index=False)
+    yearly = (all_trends.groupby(keys, as_index=False)
                         .agg(interest=('interest','mean')))
     return yearly
 
@@ -45,66 +97,169 @@ def load_pubmed():
     p = RAW / 'pubmed_counts_by_gender.csv'
     return pd.read_csv(p) if p.exists() else pd.DataFrame()
 
-def load_cdc(disease):
+def load_cdc(disease, chunksize=None):
     # CDC WONDER files are named like lupus_wonder_by_sex.csv
     fpath = RAW / f'{disease}_wonder_by_sex.csv'
     if not fpath.exists():
         return pd.DataFrame()
-    # Read CSV, skip any trailing non-data rows
-    df = pd.read_csv(fpath, dtype=str)
-    df = df.rename(columns=lambda x: x.strip().lower().replace(' ', '_'))
-    # Remove rows where year is not a digit (skips totals, notes, etc.)
-    df = df[df['year'].apply(lambda x: str(x).isdigit() if pd.notnull(x) else False)]
-    df = df[df['sex'].isin(['Male','Female'])]
-    df['year'] = df['year'].astype(int)
-    df['disease_id'] = disease
-    df['gender'] = df['sex'].map({'Male':'men','Female':'women'})
-    # Clean deaths and crude_rate columns: set to NaN if 'Suppressed' or contains 'Unreliable'
-    def clean_num(val):
-        if pd.isnull(val):
-            return pd.NA
-        if isinstance(val, str):
-            if 'Suppressed' in val or 'Unreliable' in val:
-                return pd.NA
-            val = re.sub(r'[^0-9\.]+', '', val)
-        try:
-            return float(val)
-        except:
-            return pd.NA
-    df['deaths'] = df['deaths'].apply(clean_num)
-    df['population'] = pd.to_numeric(df['population'], errors='coerce')
-    df['crude_rate'] = df['crude_rate'].apply(clean_num)
-    keep = ['year','disease_id','gender','deaths','population','crude_rate']
-    for col in keep:
-        if col not in df.columns:
-            df[col] = pd.NA
-    return df[keep]
-
-def main():
-    logger = get_logger('clean_merge_gendered')
-    trends = combine_trends()
+    # Vectorized parse: drops totals/notes rows, NaN for 'Suppressed'/'Unreliable' cells
+    if chunksize:
+        return pd.concat(read_wonder(fpath, disease, chunksize=chunksize), ignore_index=True)
+    return read_wonder(fpath, disease)
+
+KEYS = ['year', 'disease_id', 'gender']
+CDC_COLS = ['deaths', 'population', 'crude_rate']
+SPILL_DIR = INTERIM / 'merge_parts'
+
+def peak_rss_mb():
+    """Peak resident memory of this process in MB, or None where `resource` is unavailable (Windows)."""
+    try:
+        import resource
+    except ImportError:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS, KiB on Linux
+    return rss / (1024 * 1024) if sys.platform == 'darwin' else rss / 1024
+
+def rss_note() -> str:
+    """', peak RSS N MB' for log lines, empty when the peak is unknown."""
+    mb = peak_rss_mb()
+    return '' if mb is None else f', peak RSS {mb:.0f} MB'
+
+def yearly_sources(pubmed, cdc) -> dict:
+    """Yearly cube inputs keyed by signal name."""
+    return {'count': pubmed, **{col: cdc for col in CDC_COLS}}
+
+def merge_in_memory(trend_files, logger, monthly=None):
+    monthly = monthly_trends(trend_files) if monthly is None else monthly
+    trends = combine_trends(monthly=monthly)
     pubmed = load_pubmed()
-    cdc_frames = [load_cdc(d) for d in disease_files.keys()]
+    cdc_frames = [load_cdc(d) for d in trend_files['disease_id'].unique()]
     cdc_frames_nonempty = [df for df in cdc_frames if not df.empty]
     logger.info(f'PubMed shape: {pubmed.shape}')
     logger.info(f'Trends shape: {trends.shape}')
     logger.info(f'CDC frames: {[df.shape for df in cdc_frames]}')
     # Merge all three on year, disease_id, gender
-    merged = pubmed.merge(trends, on=['year','disease_id','gender'], how='inner')
+    merged = pubmed.merge(trends, on=KEYS, how='inner')
     logger.info(f'After PubMed+Trends merge: {merged.shape}')
     if cdc_frames_nonempty:
         cdc = pd.concat(cdc_frames_nonempty, ignore_index=True)
         logger.info(f'CDC concat shape: {cdc.shape}')
-        merged = merged.merge(cdc, on=['year','disease_id','gender'], how='left')
+        merged = merged.merge(cdc, on=KEYS, how='left')
         logger.info(f'After CDC merge: {merged.shape}')
     else:
         # Add CDC columns as NaN if not present
-        for col in ['deaths','population','crude_rate']:
+        for col in CDC_COLS:
             if col not in merged.columns:
                 merged[col] = pd.NA
         logger.warning('No CDC data found. Proceeding with PubMed and Trends only.')
-    write_csv(merged, PROCESSED / 'merged_gendered_signals.csv')
-    logger.info(f'Merged rows: {len(merged)}')
+    cdc = pd.concat(cdc_frames_nonempty, ignore_index=True) if cdc_frames_nonempty else None
+    cube = build_cube(monthly, yearly_sources(pubmed, cdc))
+    return merged, cube
+
+def spill(chunks, source):
+    """Split `chunks` into per-(disease_id, gender) pickles under SPILL_DIR/source.
+
+    Returns the partitions in order of first appearance and the number of
+    runs of consecutive rows with the same key (equal to the number of
+    partitions when the source is grouped). Pickles keep dtypes and floats
+    exactly, so a partition reads back as it was parsed.
+    """
+    order, pieces, runs, last = [], {}, 0, None
+    for chunk in chunks:
+        keys = chunk['disease_id'] + '__' + chunk['gender']
+        runs += int((keys != keys.shift(fill_value=last)).sum())
+        last = keys.iloc[-1] if len(keys) else last
+        for key, part in chunk.groupby(['disease_id', 'gender'], sort=False):
+            if key not in pieces:
+                order.append(key)
+                pieces[key] = 0
+            d = SPILL_DIR / source / f'{key[0]}__{key[1]}'
+            d.mkdir(parents=True, exist_ok=True)
+            part.to_pickle(d / f'{pieces[key]:05d}.pkl')
+            pieces[key] += 1
+    return order, runs
+
+def read_spill(source, key):
+    d = SPILL_DIR / source / f'{key[0]}__{key[1]}'
+    files = sorted(d.glob('*.pkl')) if d.exists() else []
+    return pd.concat([pd.read_pickle(f) for f in files]) if files else None
+
+def merge_chunked(trend_files, logger, chunksize=100_000, name='merged_gendered_signals') -> int:
+    """Join PubMed, Trends and CDC one (disease_id, gender) partition at a time.
+
+    Sources are first split into per-partition spill files, so memory is
+    bounded by the largest partition rather than the whole join. Partitions
+    are joined in PubMed order with the same inner/left merges as the
+    in-memory path; output matches it row for row as long as PubMed rows are
+    grouped by disease x gender (the fetcher writes them that way).
+    """
+    shutil.rmtree(SPILL_DIR, ignore_errors=True)
+    pubmed_path = RAW / 'pubmed_counts_by_gender.csv'
+    order, runs = spill(pd.read_csv(pubmed_path, chunksize=chunksize), 'pubmed') if pubmed_path.exists() else ([], 0)
+    cdc_paths = {d: RAW / f'{d}_wonder_by_sex.csv' for d in trend_files['disease_id'].unique()}
+    for disease, fpath in cdc_paths.items():
+        if fpath.exists():
+            spill(read_wonder(fpath, disease, chunksize=chunksize), 'cdc')
+    national = trend_files[trend_files['geo'] == '']
+    trend_keys = list(national[['disease_id', 'gender']].drop_duplicates().itertuples(index=False, name=None))
+    cdc_keys = sorted({tuple(p.name.split('__', 1)) for p in (SPILL_DIR / 'cdc').glob('*__*')})
+    empty_cdc = pd.DataFrame({'year': pd.Series(dtype='int64'), 'disease_id': pd.Series(dtype=object),
+                              'gender': pd.Series(dtype=object),
+                              **{c: pd.Series(dtype='float64') for c in CDC_COLS}})
+    cubes = {}
+    with TableAppender(name) as out, TableAppender(CUBE_TABLE) as cube_out:
+        for key in dict.fromkeys(order + trend_keys + cdc_keys):
+            files = national[(national['disease_id'] == key[0]) & (national['gender'] == key[1])]
+            monthly = monthly_trends(files) if len(files) else pd.DataFrame()
+            pubmed, cdc = read_spill('pubmed', key), read_spill('cdc', key)
+            # aggregated cells are small; held back so they are written in the cube's sorted order
+            cubes[key] = build_cube(monthly, yearly_sources(pubmed, cdc))
+            if pubmed is None or monthly.empty:
+                continue  # the inner join with Trends drops the partition
+            part = pubmed.merge(combine_trends(monthly=monthly), on=KEYS, how='inner')
+            part = part.merge(empty_cdc if cdc is None else cdc, on=KEYS, how='left')
+            out.append(part)
+            logger.info(f'{key[0]}/{key[1]}: {len(part)} rows{rss_note()}')
+        for key in sorted(cubes):
+            cube_out.append(cubes[key])
+    shutil.rmtree(SPILL_DIR, ignore_errors=True)
+    if runs > len(order):
+        logger.warning('PubMed rows are not grouped by disease x gender; output rows follow partition order')
+    return out.rows
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description='Clean and merge PubMed, Trends and CDC signals')
+    ap.add_argument('--chunked', action='store_true',
+                    help='join one disease x gender partition at a time with bounded memory')
+    ap.add_argument('--chunksize', type=int, default=100_000, help='rows per source read in --chunked mode')
+    ap.add_argument('--verify', action='store_true',
+                    help='with --chunked, also run the in-memory merge and check the outputs are identical')
+    args = ap.parse_args(argv)
+    logger = get_logger('clean_merge_gendered')
+    trend_files = discover_trends()
+    logger.info(f'Trends files: {len(trend_files)} ({(trend_files["geo"] != "").sum()} sub-national)')
+    if args.chunked:
+        rows = merge_chunked(trend_files, logger, chunksize=args.chunksize)
+        logger.info(f'Merged rows: {rows} (chunked){rss_note()}')
+        if args.verify:
+            merged, cube = merge_in_memory(trend_files, logger)
+            same = (PROCESSED / 'merged_gendered_signals.csv').read_text() == merged.to_csv(index=False)
+            logger.info(f'Chunked output identical to in-memory merge: {same}')
+            same_cube = (PROCESSED / f'{CUBE_TABLE}.csv').read_text() == cube.to_csv(index=False)
+            logger.info(f'Chunked signal cube identical to in-memory cube: {same_cube}')
+            same = same and same_cube
+            if not same:
+                sys.exit(1)
+        return
+    merged, cube = merge_in_memory(trend_files, logger)
+    # CSV for people, partitioned Parquet (when pyarrow is installed) for the analysis scripts
+    write_table(merged, 'merged_gendered_signals')
+    write_table(cube, CUBE_TABLE)
+    memory_report(merged, logger, 'merged (as parsed)')
+    memory_report(apply_schema(merged, 'merged_gendered_signals'), logger, 'merged (typed, as loaded downstream)')
+    logger.info(f'Signal cube: {len(cube)} cells')
+    logger.info(f'Merged rows: {len(merged)}{rss_note()}')
 
 if __name__ == '__main__':
     main()
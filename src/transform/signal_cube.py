@@ -0,0 +1,123 @@
+"""Pre-aggregated signal cube: signal x disease x gender x {month, quarter, year}.
+
+Every cell keeps sum, count and mean of the observations that fall in it,
+so coarser grains are exact roll-ups of finer ones and any grain can be
+served without going back to the raw files. Monthly Trends interest fills
+all three grains; yearly sources (PubMed counts, CDC deaths/population/rate)
+only the year grain.
+
+The transform stage writes it to data/processed/signal_cube.{csv,parquet}:
+
+    from transform.signal_cube import SignalCube
+    cube = SignalCube.load()
+    cube.series('interest', 'ms', 'women', grain='month')
+    cube.wide(['interest', 'count', 'deaths'], grain='year')
+"""
+import pandas as pd
+
+from utils.io import PROCESSED, read_table
+
+GRAINS = ['month', 'quarter', 'year']
+FREQ = {'month': 'M', 'quarter': 'Q', 'year': 'Y'}
+STATS = ['sum', 'mean', 'count']
+CELL_KEYS = ['disease_id', 'gender', 'period']
+COLUMNS = ['signal', 'grain'] + CELL_KEYS + STATS
+# row order of the written cube, so the in-memory and chunked transforms write the same file
+SORT_KEYS = ['disease_id', 'gender', 'signal', 'grain', 'period']
+TABLE = 'signal_cube'
+
+
+def period_start(ts: pd.Series, grain: str) -> pd.Series:
+    return ts.dt.to_period(FREQ[grain]).dt.start_time
+
+
+def signal_cells(obs: pd.DataFrame, signal: str, grains=GRAINS) -> pd.DataFrame:
+    """Cells of one signal from observations with disease_id, gender, period and `signal` columns.
+
+    The first grain is aggregated from the observations; the others are rolled
+    up from its sums and counts.
+    """
+    obs = obs.dropna(subset=[signal])
+    base = (obs.assign(period=period_start(obs['period'], grains[0]))
+               .groupby(CELL_KEYS, as_index=False)
+               .agg(sum=(signal, 'sum'), count=(signal, 'count')))
+    out = []
+    for grain in grains:
+        cells = base
+        if grain != grains[0]:
+            cells = (base.assign(period=period_start(base['period'], grain))
+                         .groupby(CELL_KEYS, as_index=False)
+                         .agg(sum=('sum', 'sum'), count=('count', 'sum')))
+        # float sums whatever the signal, so a cube chunk prints the same alone or concatenated with others
+        cells = cells.assign(signal=signal, grain=grain, sum=cells['sum'].astype('float64'),
+                             mean=cells['sum'] / cells['count'])
+        out.append(cells[COLUMNS])
+    return pd.concat(out, ignore_index=True)
+
+
+def build_cube(monthly: pd.DataFrame, yearly: dict) -> pd.DataFrame:
+    """Cube from monthly Trends rows (month, interest, ...) and yearly frames keyed by signal name.
+
+    Each yearly frame has year, disease_id, gender and a column named like its key.
+    """
+    parts = []
+    if len(monthly):
+        parts.append(signal_cells(monthly.rename(columns={'month': 'period'}), 'interest'))
+    for signal, df in yearly.items():
+        if df is None or df.empty or signal not in df.columns:
+            continue
+        obs = df.assign(period=pd.to_datetime(df['year'].astype(str), format='%Y'))
+        parts.append(signal_cells(obs[CELL_KEYS + [signal]], signal, grains=['year']))
+    if not parts:
+        return pd.DataFrame(columns=COLUMNS)
+    return pd.concat(parts, ignore_index=True).sort_values(SORT_KEYS, ignore_index=True)
+
+
+class SignalCube:
+    """Query interface over the materialized cube; lookups are dictionary hits plus a mask."""
+
+    def __init__(self, cells: pd.DataFrame):
+        cells = cells.assign(period=pd.to_datetime(cells['period']))
+        self.cells = {key: df.drop(columns=['signal', 'grain']).reset_index(drop=True)
+                      for key, df in cells.groupby(['signal', 'grain'], sort=False, observed=True)}
+
+    @classmethod
+    def load(cls, signals=None, grains=None, base=PROCESSED):
+        filters = []
+        if signals is not None:
+            filters.append(('signal', 'in', list(signals)))
+        if grains is not None:
+            filters.append(('grain', 'in', list(grains)))
+        return cls(read_table(TABLE, filters=filters or None, base=base))
+
+    @property
+    def signals(self) -> list:
+        return sorted({s for s, _ in self.cells})
+
+    def query(self, signal: str, grain: str = 'year', stat: str = 'mean',
+              disease_id=None, gender=None) -> pd.DataFrame:
+        """disease_id, gender, period and `stat` for one signal at one grain."""
+        if grain not in GRAINS or stat not in STATS:
+            raise ValueError(f'grain must be one of {GRAINS} and stat one of {STATS}')
+        df = self.cells.get((signal, grain))
+        if df is None:
+            return pd.DataFrame(columns=CELL_KEYS + [stat])
+        mask = pd.Series(True, index=df.index)
+        if disease_id is not None:
+            mask &= df['disease_id'] == disease_id
+        if gender is not None:
+            mask &= df['gender'] == gender
+        return df.loc[mask, CELL_KEYS + [stat]].reset_index(drop=True)
+
+    def series(self, signal: str, disease_id: str, gender: str, grain: str = 'year',
+               stat: str = 'mean') -> pd.Series:
+        """One disease x gender series indexed by period start."""
+        df = self.query(signal, grain, stat, disease_id, gender)
+        return df.set_index('period')[stat].sort_index().rename(signal)
+
+    def wide(self, signals, grain: str = 'year', stat: str = 'mean',
+             disease_id=None, gender=None) -> pd.DataFrame:
+        """Signals side by side, one row per disease x gender x period (outer-joined)."""
+        frames = [self.query(s, grain, stat, disease_id, gender).set_index(CELL_KEYS)[stat].rename(s)
+                  for s in signals]
+        return pd.concat(frames, axis=1).sort_index().reset_index()
@@ -0,0 +1,66 @@
+"""Vectorized reader for CDC WONDER tab/CSV exports.
+
+Handles the quirks of WONDER exports in the C parser and with column-wise
+operations instead of per-cell Python calls:
+- "Total" and footnote rows (no numeric year) are dropped
+- "Suppressed" / "Unreliable" / "Not Applicable" cells become NaN
+- thousands separators and other non-numeric characters are stripped
+
+Only the columns used downstream are read. Numeric columns are parsed by
+read_csv directly (thousands separators and flag values handled there);
+only cells it cannot parse, such as "1.2 (Unreliable)", take the slower
+string-cleaning path. Numeric columns come out as float64.
+`read_wonder(..., chunksize=n)` yields cleaned chunks so multi-million-row
+state x county x age exports never need to be held in memory as raw text.
+"""
+import pandas as pd
+
+KEEP = ['year', 'disease_id', 'gender', 'deaths', 'population', 'crude_rate']
+WANTED = {'year', 'sex', 'deaths', 'population', 'crude_rate'}
+NUMERIC = ['deaths', 'population', 'crude_rate']
+SEX_TO_GENDER = {'Male': 'men', 'Female': 'women'}
+NOT_A_VALUE = r'Suppressed|Unreliable'
+FLAG_VALUES = ['Suppressed', 'Not Applicable', 'Missing', 'Unreliable']
+
+
+def normalize_column(name: str) -> str:
+    return name.strip().lower().replace(' ', '_')
+
+
+def clean_numeric(s: pd.Series) -> pd.Series:
+    """Numeric view of a WONDER column; flagged cells are NaN, stray characters stripped."""
+    if pd.api.types.is_numeric_dtype(s):
+        return s.astype('float64')
+    num = pd.to_numeric(s, errors='coerce')
+    rest = s.notna() & num.isna()
+    if rest.any():
+        r = s[rest]
+        flagged = r.str.contains(NOT_A_VALUE, regex=True)
+        digits = r.str.replace(r'[^0-9.]+', '', regex=True)
+        num[rest] = pd.to_numeric(digits.mask(flagged), errors='coerce')
+    return num.astype('float64')
+
+
+def clean_wonder_frame(df: pd.DataFrame, disease: str) -> pd.DataFrame:
+    df = df.rename(columns=normalize_column)
+    rows = df['year'].str.isdigit().eq(True) & df['sex'].isin(SEX_TO_GENDER.keys())
+    df = df[rows]
+    out = pd.DataFrame({
+        'year': df['year'].astype('int64'),
+        'disease_id': disease,
+        'gender': df['sex'].map(SEX_TO_GENDER),
+    }, index=df.index)
+    for col in NUMERIC:
+        out[col] = clean_numeric(df[col]) if col in df.columns else pd.Series(float('nan'), index=df.index)
+    return out[KEEP]
+
+
+def read_wonder(path, disease: str, chunksize: int = None):
+    """Read one WONDER export; returns a frame, or an iterator of frames with `chunksize`."""
+    header = pd.read_csv(path, nrows=0).columns
+    text_cols = {c: str for c in header if normalize_column(c) in ('year', 'sex')}
+    reader = pd.read_csv(path, usecols=lambda c: normalize_column(c) in WANTED, dtype=text_cols,
+                         thousands=',', na_values=FLAG_VALUES, chunksize=chunksize)
+    if chunksize is None:
+        return clean_wonder_frame(reader, disease)
+    return (clean_wonder_frame(chunk, disease) for chunk in reader)
@@ -0,0 +1,90 @@
+"""Shared, load-once view of the processed datasets for stages running in one process.
+
+`python -m autoimmune all` creates one DataContext and hands it to every
+analyze and plot step (their main(argv, ctx=None)). Each dataset is parsed
+on first use and then served from memory, and the merged signals are
+grouped by disease x gender once. A dataset is re-read only when its file
+changed on disk since it was parsed, e.g. correlation_summary.csv after
+the correlations step rewrote it. Run standalone, a step gets ctx=None and
+reads from disk as before.
+
+Frames handed out are shared between steps: treat them as read-only and
+copy before modifying.
+
+    ctx = DataContext()
+    ctx.signals(['year', 'count'])            # merged_gendered_signals, typed
+    ctx.group('ms', 'women', ['year', 'interest'])
+    ctx.correlation_summary()
+    ctx.parses                                # Counter of parses per dataset
+"""
+from collections import Counter
+from pathlib import Path
+
+import pandas as pd
+
+from utils.io import PROCESSED, REPORTS, read_table
+
+SIGNALS = "merged_gendered_signals"
+GROUP_KEYS = ["disease_id", "gender"]
+
+
+def _stamp(*paths):
+    return tuple((p.stat().st_mtime_ns, p.stat().st_size) if p.exists() else None for p in paths)
+
+
+class DataContext:
+    def __init__(self, base: Path = PROCESSED, reports: Path = REPORTS):
+        self.base = base
+        self.reports = reports
+        self.parses = Counter()
+        self._cache = {}  # key -> (stamp, value)
+
+    def _get(self, key, stamp, load, parse: bool = True):
+        """Cached value for key, (re)built by load() when missing or when the file stamp changed."""
+        hit = self._cache.get(key)
+        if hit is None or hit[0] != stamp:
+            hit = self._cache[key] = (stamp, load())
+            if parse:
+                self.parses[key] += 1
+        return hit[1]
+
+    def table(self, name: str, base: Path = None) -> pd.DataFrame:
+        """A whole processed table through read_table (typed), parsed once."""
+        base = base or self.base
+        stamp = _stamp(base / f"{name}.csv", base / f"{name}.parquet")
+        return self._get(name, stamp, lambda: read_table(name, base=base))
+
+    def csv(self, path: Path) -> pd.DataFrame:
+        """A plain CSV (no schema), parsed once."""
+        path = Path(path)
+        return self._get(path.stem, _stamp(path), lambda: pd.read_csv(path))
+
+    def signals(self, columns=None) -> pd.DataFrame:
+        df = self.table(SIGNALS)
+        return df if columns is None else df[list(columns)]
+
+    def groups(self) -> dict:
+        """{(disease_id, gender): rows} of the merged signals, each re-indexed from 0 like a filtered read."""
+        df = self.signals()
+        stamp = self._cache[SIGNALS][0]
+        return self._get(f"{SIGNALS} groups", stamp, lambda: {
+            (str(d), str(g)): sub.reset_index(drop=True)
+            for (d, g), sub in df.groupby(GROUP_KEYS, observed=True, sort=True)}, parse=False)
+
+    def group(self, disease_id: str, gender: str, columns=None) -> pd.DataFrame:
+        sub = self.groups().get((disease_id, gender))
+        if sub is None:
+            sub = self.signals().iloc[:0].reset_index(drop=True)
+        return sub if columns is None else sub[list(columns)]
+
+    def correlation_summary(self) -> pd.DataFrame:
+        """reports/correlation_summary.csv with the statistics coerced to numbers."""
+        def load():
+            df = read_table("correlation_summary", base=self.reports)
+            for col in ["pearson_r", "spearman_r", "n"]:
+                df[col] = pd.to_numeric(df[col], errors="coerce")
+            return df
+        return self._get("correlation_summary", _stamp(self.reports / "correlation_summary.csv"), load)
+
+    def summary(self) -> str:
+        return ", ".join(f"{name} x{n}" for name, n in sorted(self.parses.items())) or "nothing parsed"
@@ -0,0 +1,186 @@
+"""On-disk, content-addressed cache for upstream HTTP responses.
+
+Entries are keyed by a hash of (method, endpoint, normalized params/body),
+stored per source with a freshness TTL, and evicted least-recently-used
+once the cache grows past `max_bytes`. In offline mode only cached
+responses are served (stale or not) and a miss raises `CacheMiss`, so a
+fetch stage can be replayed without network access.
+"""
+import hashlib
+import json
+import os
+import time
+import urllib.parse as up
+from pathlib import Path
+
+import requests
+from requests.structures import CaseInsensitiveDict
+
+from utils.io import CACHE
+
+HTTP_CACHE = CACHE / "http"
+# seconds an entry stays fresh, per source
+DEFAULT_TTLS = {
+    "pubmed": 7 * 86400,
+    "cdc_wonder": 30 * 86400,
+    "google_trends": 86400,
+}
+DEFAULT_MAX_BYTES = int(os.getenv("HTTP_CACHE_MAX_BYTES", 512 * 1024 * 1024))
+# never part of a key: credentials must not change (or leak into) cache identity
+IGNORED_PARAMS = {"api_key"}
+
+
+class CacheMiss(LookupError):
+    """Raised in offline mode when a response was never recorded."""
+
+
+def offline_from_env() -> bool:
+    return os.getenv("FETCH_OFFLINE", "").lower() in ("1", "true", "yes")
+
+
+def _normalize(items) -> list:
+    if items is None:
+        return []
+    if isinstance(items, (str, bytes)):
+        return [["", items.decode() if isinstance(items, bytes) else items]]
+    if isinstance(items, dict):
+        items = items.items()
+    return sorted([str(k), str(v)] for k, v in items if k not in IGNORED_PARAMS)
+
+
+def request_key(method: str, url: str, params=None, data=None) -> str:
+    """Hash of the request identity; query-string and `params` are merged and sorted."""
+    parts = up.urlsplit(url)
+    query = up.parse_qsl(parts.query, keep_blank_values=True) + _normalize(params)
+    ident = {
+        "method": method.upper(),
+        "endpoint": f"{parts.scheme}://{parts.netloc}{parts.path}",
+        "params": _normalize(query),
+        "body": _normalize(data),
+    }
+    return hashlib.sha256(json.dumps(ident, sort_keys=True).encode()).hexdigest()
+
+
+def payload_key(key_parts) -> str:
+    """Hash for payloads that are not a single HTTP response (e.g. a client library result)."""
+    return hashlib.sha256(json.dumps(key_parts, sort_keys=True, default=str).encode()).hexdigest()
+
+
+class ResponseCache:
+    def __init__(self, root: Path = HTTP_CACHE, ttls: dict = None, max_bytes: int = DEFAULT_MAX_BYTES,
+                 offline: bool = False):
+        self.root = Path(root)
+        self.ttls = {**DEFAULT_TTLS, **(ttls or {})}
+        self.max_bytes = max_bytes
+        self.offline = offline
+        self.hits = 0
+        self.misses = 0
+        self._total_bytes = None
+
+    def _paths(self, source: str, key: str):
+        d = self.root / source / key[:2]
+        return d / f"{key}.body", d / f"{key}.json"
+
+    def lookup(self, source: str, key: str):
+        """Return (body_path, meta) for a usable entry, or None.
+
+        Offline mode ignores TTLs and raises `CacheMiss` instead of returning None.
+        """
+        body, meta_path = self._paths(source, key)
+        if body.exists() and meta_path.exists():
+            meta = json.loads(meta_path.read_text())
+            if self.offline or time.time() - meta["stored_at"] <= self.ttls.get(source, 0):
+                os.utime(body)  # LRU bookkeeping
+                self.hits += 1
+                return body, meta
+        self.misses += 1  # counted before raising, so the summary shows what an offline run left unfetched
+        if self.offline:
+            raise CacheMiss(f"{source}: no recorded response for key {key}")
+        return None
+
+    def store(self, source: str, key: str, chunks, meta: dict) -> Path:
+        """Write `chunks` (bytes or an iterable of bytes) as the entry body, atomically."""
+        body, meta_path = self._paths(source, key)
+        body.parent.mkdir(parents=True, exist_ok=True)
+        tmp = body.with_suffix(f".tmp{os.getpid()}")
+        with open(tmp, "wb") as fh:
+            for chunk in ([chunks] if isinstance(chunks, bytes) else chunks):
+                fh.write(chunk)
+        os.replace(tmp, body)
+        meta_path.write_text(json.dumps({**meta, "stored_at": time.time()}))
+        if self._total_bytes is not None:
+            self._total_bytes += body.stat().st_size
+        if self._total_bytes is None or self._total_bytes > self.max_bytes:
+            self.evict()
+        return body
+
+    def get_or_compute(self, source: str, key_parts, compute) -> bytes:
+        """Cache an arbitrary payload (e.g. a client library result) under a hash of `key_parts`."""
+        key = payload_key(key_parts)
+        hit = self.lookup(source, key)
+        if hit:
+            return hit[0].read_bytes()
+        payload = compute()
+        self.store(source, key, payload, {"key_parts": key_parts})
+        return payload
+
+    def fetch_to_file(self, session, source: str, method: str, url: str, params=None, data=None,
+                      **kwargs):
+        """Return (body_path, meta) for the request, streaming the body to disk on a miss."""
+        key = request_key(method, url, params, data)
+        hit = self.lookup(source, key)
+        if hit:
+            return hit
+        r = session.request(method, url, params=params, data=data, stream=True, **kwargs)
+        r.raise_for_status()
+        meta = {"url": url, "status": r.status_code, "headers": dict(r.headers), "encoding": r.encoding}
+        return self.store(source, key, r.iter_content(chunk_size=1 << 16), meta), meta
+
+    def cached_response(self, source: str, method: str, url: str, params=None, data=None):
+        """Return the recorded response for a request, or None on a miss."""
+        hit = self.lookup(source, request_key(method, url, params, data))
+        if hit is None:
+            return None
+        body, meta = hit
+        r = requests.Response()
+        r.status_code = meta["status"]
+        r.headers = CaseInsensitiveDict(meta["headers"])
+        r.url = meta["url"]
+        r.encoding = meta.get("encoding")
+        r._content = body.read_bytes()
+        return r
+
+    def record(self, source: str, method: str, url: str, response: requests.Response, params=None,
+               data=None) -> None:
+        """Store a live response; failures are never recorded."""
+        if response.ok:
+            meta = {"url": url, "status": response.status_code, "headers": dict(response.headers),
+                    "encoding": response.encoding}
+            self.store(source, request_key(method, url, params, data), response.content, meta)
+
+    def request(self, session, source: str, method: str, url: str, params=None, data=None,
+                **kwargs) -> requests.Response:
+        """Drop-in for `session.request` that serves and records cached responses.
+
+        Failed responses are returned as-is so callers keep their own retry
+        and `raise_for_status` handling.
+        """
+        r = self.cached_response(source, method, url, params, data)
+        if r is None:
+            r = session.request(method, url, params=params, data=data, **kwargs)
+            self.record(source, method, url, r, params, data)
+        return r
+
+    def evict(self) -> None:
+        entries = [(p.stat().st_mtime, p.stat().st_size, p) for p in self.root.glob("*/*/*.body")]
+        total = sum(size for _, size, _ in entries)
+        for _, size, body in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            body.unlink(missing_ok=True)
+            body.with_suffix(".json").unlink(missing_ok=True)
+            total -= size
+        self._total_bytes = total
+
+    def summary(self) -> str:
+        return f"cache hits: {self.hits}, misses: {self.misses}"
@@ -1,19 +1,194 @@
 from pathlib import Path
+from importlib.util import find_spec
+import os
+import shutil
 import pandas as pd
 
+# Parquet is optional; everything falls back to CSV. pyarrow itself is only
+# imported when a Parquet file is actually read or written.
+HAVE_PARQUET = find_spec("pyarrow") is not None
+
 ROOT = Path(__file__).resolve().parents[2]
 DATA = ROOT / "data"
 RAW = DATA / "raw"
 INTERIM = DATA / "interim"
 PROCESSED = DATA / "processed"
 REPORTS = ROOT / "reports"
+CACHE = DATA / "cache"
 
-for p in (RAW, INTERIM, PROCESSED, REPORTS):
+for p in (RAW, INTERIM, PROCESSED, REPORTS, CACHE):
     p.mkdir(parents=True, exist_ok=True)
 
+# processed tables are partitioned on these so one disease x gender is one directory
+PARTITION_COLS = ["disease_id", "gender"]
+
+# In-memory types for the processed tables, applied by read_table. Keys are
+# categoricals (grouping and merging on them hashes small integer codes, not
+# strings), counts are nullable integers so missing CDC cells stay missing
+# without forcing float64, and measured values stay float64.
+SCHEMAS = {
+    "merged_gendered_signals": {
+        "year": "int16",
+        "count": "Int32",
+        "disease_id": "category",
+        "disease_name": "category",
+        "gender": "category",
+        "interest": "float64",
+        "deaths": "Int32",
+        "population": "Int64",
+        "crude_rate": "float64",
+    },
+    "signal_cube": {
+        "signal": "category",
+        "grain": "category",
+        "disease_id": "category",
+        "gender": "category",
+        "count": "int32",
+    },
+    "gender_ratios": {
+        "disease_id": "category",
+        "year": "int16",
+    },
+}
+
+def apply_schema(df: pd.DataFrame, name: str) -> pd.DataFrame:
+    """Cast the columns of `df` that SCHEMAS[name] knows about; other columns are left alone."""
+    schema = SCHEMAS.get(name, {})
+    casts = {col: dtype for col, dtype in schema.items() if col in df.columns}
+    return df.astype(casts) if casts else df
+
+def memory_report(df: pd.DataFrame, logger, label: str) -> int:
+    """Log the deep memory use of `df` per column; returns the total in bytes."""
+    usage = df.memory_usage(deep=True, index=False)
+    total = int(usage.sum())
+    cols = ", ".join(f"{col} {df[col].dtype} {b / 1024:.1f}" for col, b in usage.items())
+    logger.info(f"{label}: {len(df)} rows, {total / 1024:.1f} KiB ({cols} KiB)")
+    return total
+
 def write_csv(df: pd.DataFrame, path: Path) -> None:
     path.parent.mkdir(parents=True, exist_ok=True)
     df.to_csv(path, index=False)
 
 def read_csv(path: Path) -> pd.DataFrame:
     return pd.read_csv(path)
+
+def write_parquet(df: pd.DataFrame, path: Path, partition_cols=None) -> None:
+    """Write a Parquet file, or a hive-partitioned dataset directory with `partition_cols`."""
+    if path.is_dir():
+        shutil.rmtree(path)  # drop partitions that no longer exist
+    elif path.exists():
+        path.unlink()
+    path.parent.mkdir(parents=True, exist_ok=True)
+    df.to_parquet(path, partition_cols=list(partition_cols) if partition_cols else None, index=False)
+
+def read_parquet(path: Path, columns=None, filters=None) -> pd.DataFrame:
+    """Read a Parquet file/dataset, loading only `columns` and the partitions/row groups matching `filters`.
+
+    Filters use the pyarrow form, e.g. [("disease_id", "==", "ms"), ("gender", "==", "women")].
+    Partition columns come back as plain strings in their original position.
+    """
+    df = pd.read_parquet(path, columns=columns, filters=filters)
+    for col in PARTITION_COLS:
+        if col in df.columns and isinstance(df[col].dtype, pd.CategoricalDtype):
+            df[col] = df[col].astype(str)
+    if columns is None:
+        import pyarrow.dataset as pa_ds
+
+        meta = pa_ds.dataset(path, partitioning="hive").schema.pandas_metadata or {}
+        order = [c["name"] for c in meta.get("columns", []) if c["name"] in df.columns]
+        df = df[order + [c for c in df.columns if c not in order]]
+    return df
+
+OPS = {
+    "==": lambda s, v: s == v,
+    "!=": lambda s, v: s != v,
+    "<": lambda s, v: s < v,
+    "<=": lambda s, v: s <= v,
+    ">": lambda s, v: s > v,
+    ">=": lambda s, v: s >= v,
+    "in": lambda s, v: s.isin(v),
+    "not in": lambda s, v: ~s.isin(v),
+}
+
+def apply_filters(df: pd.DataFrame, filters) -> pd.DataFrame:
+    """In-memory equivalent of pyarrow's conjunctive filter list (for the CSV fallback)."""
+    for col, op, val in filters or []:
+        df = df[OPS[op](df[col], val)]
+    return df.reset_index(drop=True)
+
+def write_table(df: pd.DataFrame, name: str, base: Path = PROCESSED, partition_cols=PARTITION_COLS) -> None:
+    """Write `name` as CSV (for people) and, when pyarrow is installed, as partitioned Parquet (for code)."""
+    write_csv(df, base / f"{name}.csv")
+    if HAVE_PARQUET:
+        parts = [c for c in partition_cols or [] if c in df.columns]
+        write_parquet(df, base / f"{name}.parquet", parts)
+
+def read_table(name: str, columns=None, filters=None, base: Path = PROCESSED, typed: bool = True) -> pd.DataFrame:
+    """Read `name` from Parquet when available (with column/predicate pushdown), else from CSV.
+
+    With `typed` the columns listed in SCHEMAS[name] are cast to their compact types.
+    """
+    pq_path = base / f"{name}.parquet"
+    csv_path = base / f"{name}.csv"
+    # a CSV newer than the Parquet copy was edited or regenerated by hand; trust it
+    if HAVE_PARQUET and pq_path.exists() and not (csv_path.exists() and csv_path.stat().st_mtime > pq_path.stat().st_mtime):
+        df = read_parquet(pq_path, columns=columns, filters=filters)
+    else:
+        usecols = None
+        if columns is not None:
+            usecols = list(dict.fromkeys(list(columns) + [col for col, _, _ in filters or []]))
+        df = apply_filters(pd.read_csv(csv_path, usecols=usecols), filters)
+        df = df[list(columns)] if columns is not None else df
+    return apply_schema(df, name) if typed else df
+
+def read_signals(columns=None, filters=None, typed: bool = True) -> pd.DataFrame:
+    """The merged PubMed/Trends/CDC signals (data/processed/merged_gendered_signals)."""
+    return read_table("merged_gendered_signals", columns=columns, filters=filters, typed=typed)
+
+class TableAppender:
+    """Write `name` chunk by chunk with the same layout as write_table.
+
+    Chunks go to `name.csv.partial` / `name.parquet.partial` and replace the
+    previous copies on close(), so readers never see half a table. The Parquet
+    copy gets one file per chunk under its partition directories.
+    """
+    def __init__(self, name: str, base: Path = PROCESSED, partition_cols=PARTITION_COLS):
+        self.csv_path = base / f"{name}.csv"
+        self.pq_path = base / f"{name}.parquet"
+        self.csv_tmp = base / f"{name}.csv.partial"
+        self.pq_tmp = base / f"{name}.parquet.partial"
+        self.partition_cols = list(partition_cols or [])
+        self.rows = 0
+        base.mkdir(parents=True, exist_ok=True)
+        for tmp in (self.csv_tmp, self.pq_tmp):
+            if tmp.is_dir():
+                shutil.rmtree(tmp)
+            elif tmp.exists():
+                tmp.unlink()
+
+    def append(self, df: pd.DataFrame) -> None:
+        df.to_csv(self.csv_tmp, mode="a", header=not self.csv_tmp.exists(), index=False)
+        if HAVE_PARQUET and len(df):
+            parts = [c for c in self.partition_cols if c in df.columns]
+            if not parts:
+                raise ValueError("appending Parquet chunks needs at least one partition column")
+            df.to_parquet(self.pq_tmp, partition_cols=parts, index=False)
+        self.rows += len(df)
+
+    def close(self) -> None:
+        self.csv_tmp.replace(self.csv_path)
+        if self.pq_tmp.exists():
+            if self.pq_path.is_dir():
+                shutil.rmtree(self.pq_path)
+            elif self.pq_path.exists():
+                self.pq_path.unlink()
+            self.pq_tmp.rename(self.pq_path)
+            # read_table prefers the CSV when it is newer; both copies are from this run
+            os.utime(self.pq_path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
@@ -5,14 +5,22 @@ Outputs (in reports/):
 - ccf_{disease}_{gender}.png
 - granger_{disease}_{gender}.txt
 - corr_followups_summary.md
+
+Figures go through visualization.render, which skips those whose inputs are
+unchanged since the last run (--no-cache to force).
 """
 import warnings
 warnings.filterwarnings('ignore')
 import pandas as pd
 import numpy as np
 from pathlib import Path
-import matplotlib.pyplot as plt
-from scipy import stats
+import argparse
+from utils.io import read_signals, memory_report
+from analyze.ccf import fft_ccf, lags_for
+from utils.logging import get_logger
+from visualization.render import FigureJob, figure, render
+
+logger = get_logger('corr_followups')
 
 
 def zscore(s):
@@ -29,6 +37,8 @@ def zscore(s):
 
 def ccf(a, b, maxlag=5):
     # compute pearson r for lags -maxlag..maxlag where positive lag means a leads b by lag
+    from scipy import stats
+
     res = {}
     for lag in range(-maxlag, maxlag+1):
         if lag < 0:
@@ -59,11 +69,54 @@ def ccf(a, b, maxlag=5):
     return res
 
 
-def main():
+def ccf_by_lag(a, b, maxlag=5):
+    # same convention as ccf, on year-aligned series: NaN years are masked instead of dropped
+    r, _ = fft_ccf(a.to_numpy(dtype=float), b.to_numpy(dtype=float), maxlag)
+    return dict(zip(lags_for(maxlag, len(a)).tolist(), r))
+
+
+def draw_zscores(years, A, B, C, best_lag, best_count_lag, title):
+    # Time series overlay (z-score). Also show shifted series by best lag.
+    fig, ax = figure(figsize=(10,4))
+    if A is not None:
+        ax.plot(years, A, label='interest (z)')
+    if B is not None:
+        ax.plot(years, B, label='count (z)')
+    if C is not None:
+        ax.plot(years, C, label='deaths (z)')
+    # shifted versions
+    if C is not None and A is not None and best_lag>0:
+        ax.plot(years, pd.concat([pd.Series([np.nan]*best_lag), A[:-best_lag].reset_index(drop=True)]), '--', label=f'interest shifted +{best_lag}')
+    if C is not None and B is not None and best_count_lag>0:
+        ax.plot(years, pd.concat([pd.Series([np.nan]*best_count_lag), B[:-best_count_lag].reset_index(drop=True)]), '--', label=f'count shifted +{best_count_lag}')
+    ax.set_title(title)
+    ax.set_xlabel('Year')
+    ax.legend()
+    fig.tight_layout()
+    return fig
+
+
+def draw_ccf(res, title, xlabel):
+    fig, ax = figure()
+    lags = sorted(res.keys())
+    vals = [res[l] for l in lags]
+    # matplotlib versions differ; avoid use_line_collection kwarg
+    ax.stem(lags, vals)
+    ax.axhline(0, color='k', linewidth=0.5)
+    ax.set_title(title)
+    ax.set_xlabel(xlabel)
+    ax.set_ylabel('Pearson r')
+    fig.tight_layout()
+    return fig
+
+
+def main(argv=None, ctx=None):
+    ap = argparse.ArgumentParser(description='Follow-up plots and Granger tests for the top correlated series')
+    ap.add_argument('--no-cache', action='store_true', help='re-render figures even if their inputs are unchanged')
+    args = ap.parse_args(argv)
     rpt = Path('reports')
     rpt.mkdir(exist_ok=True)
-    cs = pd.read_csv(rpt / 'correlation_summary.csv')
-    merged = pd.read_csv(Path('data/processed/merged_gendered_signals.csv'))
+    cs = ctx.correlation_summary() if ctx else pd.read_csv(rpt / 'correlation_summary.csv')
     cand = cs[(cs['disease_id']!='ALL') & (cs['n']>=5)].copy()
     cand['absr'] = cand['pearson_r'].abs()
     top = cand.sort_values('absr', ascending=False).drop_duplicates(subset=['disease_id','gender','pair']).head(6)
@@ -77,23 +130,31 @@ def main():
             break
 
     md_lines = ['# Correlation follow-up summary', '']
+    jobs = []
     for disease, gender in combos:
-        sub = merged[(merged['disease_id']==disease)&(merged['gender']==gender)].sort_values('year')
+        cols = ['year', 'interest', 'count', 'deaths']
+        if ctx is not None:
+            sub = ctx.group(disease, gender, cols).sort_values('year')
+        else:
+            # only this disease/gender partition is read
+            sub = read_signals(columns=cols,
+                               filters=[('disease_id', '==', disease), ('gender', '==', gender)]).sort_values('year')
         if sub.empty:
             continue
+        memory_report(sub, logger, f'{disease}/{gender} signals')
         years = sub['year'].astype(int)
         if 'interest' in sub.columns:
-            A = zscore(pd.to_numeric(sub['interest'], errors='coerce'))
+            A = zscore(sub['interest'].astype('float64'))
         else:
             A = None
 
         if 'count' in sub.columns:
-            B = zscore(pd.to_numeric(sub['count'], errors='coerce'))
+            B = zscore(sub['count'].astype('float64'))
         else:
             B = None
 
         if 'deaths' in sub.columns:
-            C = zscore(pd.to_numeric(sub['deaths'], errors='coerce'))
+            C = zscore(sub['deaths'].astype('float64'))
         else:
             C = None
 
@@ -111,92 +172,52 @@ def main():
         else:
             best_count_lag = 0
 
-        # Time series overlay (z-score). Also show shifted series by best lag.
-        plt.figure(figsize=(10,4))
-        if A is not None:
-            plt.plot(years, A, label='interest (z)')
-        if B is not None:
-            plt.plot(years, B, label='count (z)')
-        if C is not None:
-            plt.plot(years, C, label='deaths (z)')
-        # shifted versions
-        if C is not None and A is not None and best_lag>0:
-            plt.plot(years, pd.concat([pd.Series([np.nan]*best_lag), A[:-best_lag].reset_index(drop=True)]), '--', label=f'interest shifted +{best_lag}')
-        if C is not None and B is not None and best_count_lag>0:
-            plt.plot(years, pd.concat([pd.Series([np.nan]*best_count_lag), B[:-best_count_lag].reset_index(drop=True)]), '--', label=f'count shifted +{best_count_lag}')
-        plt.title(f'Z-scored time series: {disease} - {gender}')
-        plt.xlabel('Year')
-        plt.legend()
-        plt.tight_layout()
         fn = rpt / f'z_timeseries_{disease}_{gender}.png'
-        plt.savefig(fn)
-        plt.close()
+        jobs.append(FigureJob(draw_zscores, fn, {'years': years.reset_index(drop=True),
+                                                 'A': A.reset_index(drop=True) if A is not None else None,
+                                                 'B': B.reset_index(drop=True) if B is not None else None,
+                                                 'C': C.reset_index(drop=True) if C is not None else None,
+                                                 'best_lag': best_lag, 'best_count_lag': best_count_lag,
+                                                 'title': f'Z-scored time series: {disease} - {gender}'}))
 
         md_lines.append(f'## {disease} {gender}')
         md_lines.append(f'Z-scored overlay: `{fn.name}`')
 
         # CCF between interest/count and deaths
         if C is not None and A is not None:
-            res = ccf(A.dropna().reset_index(drop=True), C.dropna().reset_index(drop=True), maxlag=5)
-            plt.figure()
-            lags = sorted(res.keys())
-            vals = [res[l] for l in lags]
-            # matplotlib versions differ; avoid use_line_collection kwarg
-            plt.stem(lags, vals)
-            plt.axhline(0, color='k', linewidth=0.5)
-            plt.title(f'CCF interest -> deaths: {disease} {gender}')
-            plt.xlabel('lag (years, positive = interest leads)')
-            plt.ylabel('Pearson r')
-            plt.tight_layout()
+            res = ccf_by_lag(A, C, maxlag=5)
             fn2 = rpt / f'ccf_interest_deaths_{disease}_{gender}.png'
-            plt.savefig(fn2)
-            plt.close()
+            jobs.append(FigureJob(draw_ccf, fn2, {'res': res, 'title': f'CCF interest -> deaths: {disease} {gender}',
+                                                  'xlabel': 'lag (years, positive = interest leads)'}))
             md_lines.append(f'CCF plot: `{fn2.name}`')
 
         if C is not None and B is not None:
-            res = ccf(B.dropna().reset_index(drop=True), C.dropna().reset_index(drop=True), maxlag=5)
-            plt.figure()
-            lags = sorted(res.keys())
-            vals = [res[l] for l in lags]
-            plt.stem(lags, vals)
-            plt.axhline(0, color='k', linewidth=0.5)
-            plt.title(f'CCF count -> deaths: {disease} {gender}')
-            plt.xlabel('lag (years, positive = count leads)')
-            plt.ylabel('Pearson r')
-            plt.tight_layout()
+            res = ccf_by_lag(B, C, maxlag=5)
             fn3 = rpt / f'ccf_count_deaths_{disease}_{gender}.png'
-            plt.savefig(fn3)
-            plt.close()
+            jobs.append(FigureJob(draw_ccf, fn3, {'res': res, 'title': f'CCF count -> deaths: {disease} {gender}',
+                                                  'xlabel': 'lag (years, positive = count leads)'}))
             md_lines.append(f'CCF plot: `{fn3.name}`')
 
-        # Granger causality tests (if statsmodels available)
+        # Granger causality tests (cached; the full grid is in analyze/granger.py)
         try:
-            from statsmodels.tsa.stattools import grangercausalitytests
+            from analyze.granger import run_granger
+            tests = run_granger(sub.assign(disease_id=disease, gender=gender),
+                                directions=[('interest', 'deaths'), ('count', 'deaths')], jobs=1)
             granger_txt = rpt / f'granger_{disease}_{gender}.txt'
             with open(granger_txt, 'w') as fh:
-                if C is not None and A is not None:
-                    # test if interest Granger-causes deaths: format (deaths, interest)
-                    data = pd.concat([C.fillna(method='ffill').dropna().reset_index(drop=True), A.fillna(method='ffill').dropna().reset_index(drop=True)], axis=1)
-                    if len(data) >= 6:
-                        fh.write('Granger test: interest -> deaths\n')
-                        try:
-                            grangercausalitytests(data.iloc[:, [0,1]], maxlag=3, verbose=False)
-                            fh.write('Completed Granger tests (see console for detailed output)\n')
-                        except Exception as e:
-                            fh.write('Granger test failed: '+str(e)+"\n")
-                if C is not None and B is not None:
-                    data = pd.concat([C.fillna(method='ffill').dropna().reset_index(drop=True), B.fillna(method='ffill').dropna().reset_index(drop=True)], axis=1)
-                    if len(data) >= 6:
-                        fh.write('Granger test: count -> deaths\n')
-                        try:
-                            grangercausalitytests(data.iloc[:, [0,1]], maxlag=3, verbose=False)
-                            fh.write('Completed Granger tests (see console for detailed output)\n')
-                        except Exception as e:
-                            fh.write('Granger test failed: '+str(e)+"\n")
+                for (cause, effect), res in tests.groupby(['cause', 'effect'], sort=False):
+                    fh.write(f'Granger test: {cause} -> {effect}\n')
+                    for row in res.itertuples():
+                        if row.error:
+                            fh.write(f'  not computed (n={row.n}): {row.error}\n')
+                        else:
+                            fh.write(f'  lag {row.lag}: F={row.f_stat:.3f} p={row.f_pvalue:.4f}, '
+                                     f'chi2={row.chi2_stat:.3f} p={row.chi2_pvalue:.4f} (n={row.n})\n')
             md_lines.append(f'Granger results: `{granger_txt.name}`')
         except Exception as e:
             md_lines.append(f'Granger test skipped (statsmodels missing or failed): {e}')
 
+    render(jobs, workers=1, cache=not args.no_cache, logger=logger)
     # write markdown summary
     (rpt / 'corr_followups_summary.md').write_text('\n'.join(md_lines))
     print('Generated follow-up plots and summary in reports/')
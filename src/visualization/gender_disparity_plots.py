@@ -1,85 +1,111 @@
 # Script to visualize gender disparity across CDC, PubMed, and Google Trends data
 # Placeholder: implement visualization logic
+#
+# Figures are drawn with the object-oriented matplotlib API and rendered by
+# visualization.render, in a process pool with --jobs > 1; figures whose data
+# slice is unchanged since the last run are not re-rendered (--no-cache to force).
+import argparse
 import pandas as pd
-import matplotlib.pyplot as plt
+from utils.io import read_signals, memory_report
+from utils.logging import get_logger
+from visualization.render import FigureJob, figure, render
 
-def plot_gender_disparity():
+logger = get_logger('gender_disparity_plots')
+
+# (file prefix, x, y, title, xlabel, ylabel) for the per disease x gender scatter plots
+SCATTERS = [
+    ('scatter_pubmed_trends', 'count', 'interest', 'PubMed vs Trends', 'PubMed Publication Count', 'Google Trends Interest'),
+    ('scatter_pubmed_cdc', 'count', 'deaths', 'PubMed vs CDC Deaths', 'PubMed Publication Count', 'CDC Deaths'),
+    ('scatter_trends_cdc', 'interest', 'deaths', 'Trends vs CDC Deaths', 'Google Trends Interest', 'CDC Deaths'),
+]
+
+
+def draw_heatmap(corr):
     import seaborn as sns
-    from pathlib import Path
+    fig, ax = figure(figsize=(6,5))
+    sns.heatmap(corr, annot=True, cmap='coolwarm', fmt='.2f', ax=ax)
+    ax.set_title('Correlation Matrix: PubMed, Trends, CDC')
+    fig.tight_layout()
+    return fig
+
+
+def draw_scatter(sub, x, y, title, xlabel, ylabel):
+    import seaborn as sns
+    fig, ax = figure()
+    sns.scatterplot(x=x, y=y, data=sub, ax=ax)
+    ax.set_title(title)
+    ax.set_xlabel(xlabel)
+    ax.set_ylabel(ylabel)
+    fig.tight_layout()
+    return fig
+
 
-    # Load merged data
-    df = pd.read_csv(Path(__file__).parents[2] / 'data' / 'processed' / 'merged_gendered_signals.csv')
+def draw_timeseries(sub, title):
+    fig, ax = figure(figsize=(10,5))
+    ax.plot(sub['year'], sub['count'], label='PubMed')
+    ax.plot(sub['year'], sub['interest'], label='Trends')
+    if 'deaths' in sub.columns:
+        ax.plot(sub['year'], sub['deaths'], label='CDC Deaths')
+    ax.set_title(title)
+    ax.set_xlabel('Year')
+    ax.set_ylabel('Value')
+    ax.legend()
+    fig.tight_layout()
+    return fig
 
-    # Drop rows with all-NaN CDC columns for CDC-specific analyses
-    cdc_cols = ['deaths', 'population', 'crude_rate']
-    df_cdc = df.dropna(subset=cdc_cols, how='all')
 
+def figure_jobs(df, groups=None):
+    """Every figure of this script as a FigureJob; the frame is grouped once (or `groups` is used as given)."""
+    from pathlib import Path
+
+    Path('reports').mkdir(exist_ok=True)
     # Correlation matrix (all numeric columns)
     corr = df[['count', 'interest', 'deaths', 'population', 'crude_rate']].corr()
     print('Correlation matrix:')
     print(corr)
+    jobs = [FigureJob(draw_heatmap, 'reports/correlation_heatmap.png', {'corr': corr})]
 
-    # Save correlation heatmap
-    plt.figure(figsize=(6,5))
-    sns.heatmap(corr, annot=True, cmap='coolwarm', fmt='.2f')
-    plt.title('Correlation Matrix: PubMed, Trends, CDC')
-    plt.tight_layout()
-    Path('reports').mkdir(exist_ok=True)
-    plt.savefig('reports/correlation_heatmap.png')
-    plt.close()
-
+    # slices are re-indexed from 0 so their render-cache fingerprint does not depend on other diseases' rows
+    if groups is None:
+        groups = {key: sub.reset_index(drop=True) for key, sub in df.groupby(['disease_id','gender'], observed=True)}
+    empty = df.iloc[:0]
     # Scatter plots: PubMed vs Trends, PubMed vs CDC, Trends vs CDC
     for disease in df['disease_id'].unique():
         for gender in df['gender'].unique():
-            sub = df[(df['disease_id']==disease) & (df['gender']==gender)]
+            sub = groups.get((disease, gender), empty)
             label = f"{disease.capitalize()} - {gender.capitalize()}"
-            # PubMed vs Trends
-            plt.figure()
-            sns.scatterplot(x='count', y='interest', data=sub)
-            plt.title(f'PubMed vs Trends: {label}')
-            plt.xlabel('PubMed Publication Count')
-            plt.ylabel('Google Trends Interest')
-            plt.tight_layout()
-            plt.savefig(f'reports/scatter_pubmed_trends_{disease}_{gender}.png')
-            plt.close()
-            # PubMed vs CDC (deaths)
-            if 'deaths' in sub.columns:
-                plt.figure()
-                sns.scatterplot(x='count', y='deaths', data=sub)
-                plt.title(f'PubMed vs CDC Deaths: {label}')
-                plt.xlabel('PubMed Publication Count')
-                plt.ylabel('CDC Deaths')
-                plt.tight_layout()
-                plt.savefig(f'reports/scatter_pubmed_cdc_{disease}_{gender}.png')
-                plt.close()
-            # Trends vs CDC (deaths)
-            if 'deaths' in sub.columns:
-                plt.figure()
-                sns.scatterplot(x='interest', y='deaths', data=sub)
-                plt.title(f'Trends vs CDC Deaths: {label}')
-                plt.xlabel('Google Trends Interest')
-                plt.ylabel('CDC Deaths')
-                plt.tight_layout()
-                plt.savefig(f'reports/scatter_trends_cdc_{disease}_{gender}.png')
-                plt.close()
+            for prefix, x, y, title, xlabel, ylabel in SCATTERS:
+                if y == 'deaths' and 'deaths' not in sub.columns:
+                    continue
+                jobs.append(FigureJob(draw_scatter, f'reports/{prefix}_{disease}_{gender}.png',
+                                      {'sub': sub[[x, y]], 'x': x, 'y': y, 'title': f'{title}: {label}',
+                                       'xlabel': xlabel, 'ylabel': ylabel}))
 
     # Time series plots for each signal
-    groups = df.groupby(['disease_id','gender'])
-    for (disease, gender), sub in groups:
-        plt.figure(figsize=(10,5))
-        plt.plot(sub['year'], sub['count'], label='PubMed')
-        plt.plot(sub['year'], sub['interest'], label='Trends')
-        if 'deaths' in sub.columns:
-            plt.plot(sub['year'], sub['deaths'], label='CDC Deaths')
-        plt.title(f'Time Series: {disease.capitalize()} - {gender.capitalize()}')
-        plt.xlabel('Year')
-        plt.ylabel('Value')
-        plt.legend()
-        plt.tight_layout()
-        plt.savefig(f'reports/timeseries_{disease}_{gender}.png')
-        plt.close()
+    for (disease, gender), sub in groups.items():
+        cols = [c for c in ['year', 'count', 'interest', 'deaths'] if c in sub.columns]
+        jobs.append(FigureJob(draw_timeseries, f'reports/timeseries_{disease}_{gender}.png',
+                              {'sub': sub[cols],
+                               'title': f'Time Series: {disease.capitalize()} - {gender.capitalize()}'}))
+    return jobs
+
 
+def plot_gender_disparity(workers=None, cache=True, ctx=None):
+    # Load merged data (only the columns plotted here)
+    cols = ['year', 'disease_id', 'gender', 'count', 'interest', 'deaths', 'population', 'crude_rate']
+    df = ctx.signals(cols) if ctx else read_signals(columns=cols)
+    memory_report(df, logger, 'merged signals')
+
+    jobs = figure_jobs(df, ctx.groups() if ctx else None)
+    render(jobs, workers, cache=cache, logger=logger)
     print('All visualizations and correlation studies saved in the reports/ directory.')
 
+def main(argv=None, ctx=None):
+    ap = argparse.ArgumentParser(description='Gender disparity scatter, time-series and correlation plots')
+    ap.add_argument('--jobs', type=int, default=None, help='rendering processes (default: CPU count)')
+    ap.add_argument('--no-cache', action='store_true', help='re-render figures even if their inputs are unchanged')
+    args = ap.parse_args(argv)
+    plot_gender_disparity(args.jobs, cache=not args.no_cache, ctx=ctx)
+
 if __name__ == "__main__":
-    plot_gender_disparity()
+    main()
@@ -5,15 +5,75 @@ Produces:
 - reports/corr_heatmap_{disease}_{gender}.png (pearson r heatmap: pairs x lag)
 - reports/corr_lags_{disease}_{gender}.png (line plots of pearson r vs lag for each pair)
 - reports/corr_top_associations.png (top abs r barplot across disease/gender)
+
+Figures are drawn with the object-oriented matplotlib API and rendered by
+visualization.render, in a process pool with --jobs > 1; figures whose data
+slice is unchanged since the last run are not re-rendered (--no-cache to force).
 """
+import argparse
 import pandas as pd
 import numpy as np
-import matplotlib.pyplot as plt
-import seaborn as sns
 from pathlib import Path
+from utils.io import read_table
+from utils.logging import get_logger
+from visualization.render import FigureJob, figure, render
+
+logger = get_logger('plot_correlations')
+
+
+def draw_overall(vals):
+    import seaborn as sns
+    fig, ax = figure(figsize=(6,2))
+    sns.heatmap(vals.to_frame().T, annot=True, cmap='coolwarm', center=0, fmt='.2f', ax=ax)
+    ax.set_title('Overall Pearson r (lag=0)')
+    fig.tight_layout()
+    return fig
+
+
+def draw_lag_heatmap(pivot, disease, gender):
+    import seaborn as sns
+    fig, ax = figure(figsize=(8, max(2, 0.6 * pivot.shape[1])))
+    sns.heatmap(pivot.T, annot=True, cmap='coolwarm', center=0, fmt='.2f', ax=ax)
+    ax.set_title(f'Pearson r by lag — {disease} ({gender})')
+    ax.set_ylabel('pair')
+    ax.set_xlabel('lag (years)')
+    fig.tight_layout()
+    return fig
+
+
+def draw_lag_lines(pivot, disease, gender):
+    fig, ax = figure(figsize=(6,3))
+    for col in pivot.columns:
+        ax.plot(pivot.index, pivot[col], marker='o', label=col)
+    ax.axhline(0, color='k', linewidth=0.5)
+    ax.set_title(f'Pearson r vs lag — {disease} ({gender})')
+    ax.set_xlabel('lag (years)')
+    ax.set_ylabel('Pearson r')
+    ax.legend()
+    fig.tight_layout()
+    return fig
+
+
+def draw_top(best_sorted, sig):
+    import seaborn as sns
+    fig, ax = figure(figsize=(8, max(4, 0.2*len(best_sorted))))
+    sns.barplot(x='pearson_r', y='label', data=best_sorted, palette='vlag', ax=ax)
+    if sig is not None:
+        # drawn from the bounds, not as +-error around r: a percentile bootstrap CI need not contain r
+        ax.hlines(np.arange(len(sig)), sig['ci_low'], sig['ci_high'], colors='k', linewidth=1)
+        ax.set_title('Top associations (by abs Pearson r, n>=5)\n95% block-bootstrap CI, * permutation p<0.05')
+    else:
+        ax.set_title('Top associations (by abs Pearson r, n>=5)')
+    ax.set_xlabel('Pearson r')
+    fig.tight_layout()
+    return fig
 
 
-def main():
+def main(argv=None, ctx=None):
+    ap = argparse.ArgumentParser(description='Plot correlation_summary.csv')
+    ap.add_argument('--jobs', type=int, default=None, help='rendering processes (default: CPU count)')
+    ap.add_argument('--no-cache', action='store_true', help='re-render figures even if their inputs are unchanged')
+    args = ap.parse_args(argv)
     rpt = Path('reports')
     rpt.mkdir(exist_ok=True)
     path = rpt / 'correlation_summary.csv'
@@ -21,62 +81,33 @@ def main():
         print('correlation_summary.csv not found at', path)
         return
 
-    df = pd.read_csv(path)
-    # ensure numeric
-    df['pearson_r'] = pd.to_numeric(df['pearson_r'], errors='coerce')
-    df['spearman_r'] = pd.to_numeric(df['spearman_r'], errors='coerce')
-    df['n'] = pd.to_numeric(df['n'], errors='coerce')
+    if ctx is not None:
+        df = ctx.correlation_summary()  # already numeric
+    else:
+        df = read_table('correlation_summary', base=rpt)
+        # ensure numeric
+        df['pearson_r'] = pd.to_numeric(df['pearson_r'], errors='coerce')
+        df['spearman_r'] = pd.to_numeric(df['spearman_r'], errors='coerce')
+        df['n'] = pd.to_numeric(df['n'], errors='coerce')
+    jobs = []
 
     # Overall heatmap at lag 0
     overall0 = df[(df['disease_id']=='ALL') & (df['lag']==0)].set_index('pair')
     if not overall0.empty:
         vals = overall0['pearson_r'].reindex(['interest-count','interest-deaths','count-deaths'])
-        plt.figure(figsize=(6,2))
-        sns.heatmap(vals.to_frame().T, annot=True, cmap='coolwarm', center=0, fmt='.2f')
-        plt.title('Overall Pearson r (lag=0)')
-        plt.tight_layout()
-        plt.savefig(rpt / 'corr_heatmap_overall_lag0.png')
-        plt.close()
+        jobs.append(FigureJob(draw_overall, rpt / 'corr_heatmap_overall_lag0.png', {'vals': vals}))
 
     # Per disease/gender: pivot lag x pair
-    diseases = sorted(df['disease_id'].unique())
-    genders = sorted(df['gender'].unique())
     plots_made = 0
-    for disease in diseases:
-        if disease == 'ALL':
+    for (disease, gender), sub in df[df['disease_id'] != 'ALL'].groupby(['disease_id', 'gender'], sort=True):
+        pivot = sub.pivot(index='lag', columns='pair', values='pearson_r')
+        if pivot.dropna(how='all').empty:
             continue
-        for gender in genders:
-            sub = df[(df['disease_id']==disease) & (df['gender']==gender)]
-            if sub.empty:
-                continue
-            pivot = sub.pivot(index='lag', columns='pair', values='pearson_r')
-            if pivot.dropna(how='all').empty:
-                continue
-            # Heatmap of r across lags
-            plt.figure(figsize=(8, max(2, 0.6 * pivot.shape[1])))
-            sns.heatmap(pivot.T, annot=True, cmap='coolwarm', center=0, fmt='.2f')
-            plt.title(f'Pearson r by lag — {disease} ({gender})')
-            plt.ylabel('pair')
-            plt.xlabel('lag (years)')
-            plt.tight_layout()
-            fn1 = rpt / f'corr_heatmap_{disease}_{gender}.png'
-            plt.savefig(fn1)
-            plt.close()
-
-            # Line plot of r vs lag for each pair
-            plt.figure(figsize=(6,3))
-            for col in pivot.columns:
-                plt.plot(pivot.index, pivot[col], marker='o', label=col)
-            plt.axhline(0, color='k', linewidth=0.5)
-            plt.title(f'Pearson r vs lag — {disease} ({gender})')
-            plt.xlabel('lag (years)')
-            plt.ylabel('Pearson r')
-            plt.legend()
-            plt.tight_layout()
-            fn2 = rpt / f'corr_lags_{disease}_{gender}.png'
-            plt.savefig(fn2)
-            plt.close()
-            plots_made += 1
+        # Heatmap of r across lags, and a line plot of r vs lag for each pair
+        kwargs = {'pivot': pivot, 'disease': disease, 'gender': gender}
+        jobs.append(FigureJob(draw_lag_heatmap, rpt / f'corr_heatmap_{disease}_{gender}.png', kwargs))
+        jobs.append(FigureJob(draw_lag_lines, rpt / f'corr_lags_{disease}_{gender}.png', kwargs))
+        plots_made += 1
 
     # Top associations barplot (absolute r) for lag with max abs r per pair/disease/gender
     pick = df[df['disease_id'] != 'ALL'].copy()
@@ -89,14 +120,19 @@ def main():
     if not best.empty:
         best['label'] = best['disease_id'] + '_' + best['gender'] + '_' + best['pair']
         best_sorted = best.sort_values('absr', ascending=False).head(30)
-        plt.figure(figsize=(8, max(4, 0.2*len(best_sorted))))
-        sns.barplot(x='pearson_r', y='label', data=best_sorted, palette='vlag')
-        plt.title('Top associations (by abs Pearson r, n>=5)')
-        plt.xlabel('Pearson r')
-        plt.tight_layout()
-        plt.savefig(rpt / 'corr_top_associations.png')
-        plt.close()
+        # bootstrap CIs and permutation p-values from analyze/significance.py, when available
+        sig_path = rpt / 'correlation_significance.csv'
+        sig = None
+        if sig_path.exists():
+            sig_table = (ctx.table('correlation_significance', base=rpt) if ctx
+                         else read_table('correlation_significance', base=rpt))
+            sig = best_sorted.merge(sig_table,
+                                    on=['disease_id', 'gender', 'pair', 'lag'], how='left', suffixes=('', '_sig'))
+            best_sorted = best_sorted.assign(label=np.where(sig['p_perm'] < 0.05, best_sorted['label'] + ' *',
+                                                            best_sorted['label']))
+        jobs.append(FigureJob(draw_top, rpt / 'corr_top_associations.png', {'best_sorted': best_sorted, 'sig': sig}))
 
+    render(jobs, args.jobs, cache=not args.no_cache, logger=logger)
     print(f'Plotted {plots_made} disease/gender correlation figures and summary plots in {rpt}/')
 
 
@@ -1,35 +1,44 @@
 from pathlib import Path
+import argparse
 import pandas as pd
-import matplotlib.pyplot as plt
-from src.utils.io import PROCESSED, REPORTS
-from src.utils.logging import get_logger
+from utils.io import PROCESSED, REPORTS
+from utils.logging import get_logger
+from visualization.render import FigureJob, figure, render
 
 logger = get_logger("viz")
 
-def lineplot(df: pd.DataFrame, y: str, title: str, outfile: Path):
-    plt.figure()
+def draw_lines(df: pd.DataFrame, y: str, title: str):
+    fig, ax = figure()
     for name, grp in df.groupby("disease_name"):
         grp = grp.sort_values("year")
-        plt.plot(grp["year"], grp[y], label=name)
-    plt.title(title)
-    plt.xlabel("Year")
-    plt.ylabel(y)
-    plt.legend()
+        ax.plot(grp["year"], grp[y], label=name)
+    ax.set_title(title)
+    ax.set_xlabel("Year")
+    ax.set_ylabel(y)
+    ax.legend()
+    fig.tight_layout()
+    return fig
+
+def lineplot(df: pd.DataFrame, y: str, title: str, outfile: Path) -> FigureJob:
     outfile.parent.mkdir(parents=True, exist_ok=True)
-    plt.tight_layout()
-    plt.savefig(outfile, dpi=200)
-    plt.close()
+    return FigureJob(draw_lines, outfile, {"df": df[["disease_name", "year", y]], "y": y, "title": title},
+                     {"dpi": 200})
 
-def main():
+def main(argv=None, ctx=None):
+    ap = argparse.ArgumentParser(description="Attention score line plots")
+    ap.add_argument("--no-cache", action="store_true", help="re-render figures even if their inputs are unchanged")
+    args = ap.parse_args(argv)
     p = PROCESSED / "attention_scores.csv"
     if not p.exists():
         logger.warning("attention_scores.csv not found. Run `make build`.")
         return
-    df = pd.read_csv(p)
+    df = ctx.csv(p) if ctx else pd.read_csv(p)
 
-    lineplot(df, "pubmed_count", "PubMed article counts by disease", REPORTS / "pubmed_counts.png")
-    lineplot(df, "interest", "Google Trends interest by disease", REPORTS / "trends_interest.png")
-    lineplot(df, "attention_gap", "Attention gap (research - public) by disease", REPORTS / "attention_gap.png")
+    render([
+        lineplot(df, "pubmed_count", "PubMed article counts by disease", REPORTS / "pubmed_counts.png"),
+        lineplot(df, "interest", "Google Trends interest by disease", REPORTS / "trends_interest.png"),
+        lineplot(df, "attention_gap", "Attention gap (research - public) by disease", REPORTS / "attention_gap.png"),
+    ], workers=1, cache=not args.no_cache, logger=logger)
     logger.info("Saved plots to reports/")
 
 if __name__ == "__main__":
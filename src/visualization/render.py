@@ -0,0 +1,166 @@
+"""Figure jobs rendered off pyplot, optionally in a process pool, with a render cache.
+
+A FigureJob names a draw function, the output path, the draw function's
+keyword arguments and any savefig options. draw(**kwargs) builds and returns
+a matplotlib Figure through the object-oriented API (figure() below,
+seaborn's ax= argument), and the runner saves it. Nothing touches pyplot's
+global figure state, so jobs can run in worker processes on the Agg backend;
+draw functions and kwargs must be picklable (module-level functions,
+DataFrame slices, plain values). The PNGs are byte-identical to the ones the
+scripts drew through pyplot before.
+
+Each job is fingerprinted from the draw function's source, this module's
+source (figure() and the runner), its kwargs (data slices are hashed by
+content), the savefig options and the matplotlib and seaborn versions.
+render_manifest.json next to the outputs (reports/) maps each file to its
+fingerprint and the SHA-256 of the PNG written for it; a job whose
+fingerprint matches and whose file is still that PNG is skipped.
+So a new disease only renders that disease's figures (plus any figure that
+pools all diseases). Plot scripts run in parallel by src/pipeline.py share
+the manifest, so its read-merge-replace holds an flock on a sidecar
+render_manifest.json.lock; an unreadable manifest counts as empty (every
+figure is re-rendered) rather than failing the run.
+
+    from visualization.render import FigureJob, render
+    render([FigureJob(draw_heatmap, 'reports/x.png', {'data': df, 'title': 'X'})], workers=4)
+"""
+import hashlib
+import inspect
+import json
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Callable, NamedTuple
+
+try:
+    import fcntl
+except ImportError:  # Windows: no advisory locks, concurrent plot scripts may drop each other's entries
+    fcntl = None
+
+import numpy as np
+import pandas as pd
+
+MANIFEST = 'render_manifest.json'
+
+
+class FigureJob(NamedTuple):
+    draw: Callable
+    path: str
+    kwargs: dict
+    save: dict = None  # savefig options; None for matplotlib's defaults
+
+
+def _use_agg():
+    import matplotlib
+    matplotlib.use('Agg')
+
+
+def figure(figsize=None):
+    """A new Figure with one Axes, outside pyplot."""
+    from matplotlib.figure import Figure
+    fig = Figure(figsize=figsize)
+    return fig, fig.add_subplot()
+
+
+def _feed(h, obj) -> None:
+    """Add a stable content digest of obj to hash h."""
+    if isinstance(obj, (pd.DataFrame, pd.Series)):
+        h.update(repr((type(obj).__name__, getattr(obj, 'name', None), list(obj.index.names),
+                       obj.dtypes.astype(str).to_dict() if isinstance(obj, pd.DataFrame) else str(obj.dtype),
+                       list(obj.columns) if isinstance(obj, pd.DataFrame) else None)).encode())
+        h.update(pd.util.hash_pandas_object(obj, index=True).to_numpy().tobytes())
+    elif isinstance(obj, np.ndarray):
+        h.update(repr((obj.dtype.str, obj.shape)).encode())
+        h.update(np.ascontiguousarray(obj).tobytes())
+    elif isinstance(obj, dict):
+        for key in sorted(obj, key=str):
+            h.update(repr(key).encode())
+            _feed(h, obj[key])
+    elif isinstance(obj, (list, tuple)):
+        h.update(f'{type(obj).__name__}[{len(obj)}]'.encode())
+        for item in obj:
+            _feed(h, item)
+    else:
+        h.update(repr(obj).encode())
+
+
+def fingerprint(job: FigureJob) -> str:
+    import matplotlib
+    import seaborn
+
+    h = hashlib.sha256(json.dumps([matplotlib.__version__, seaborn.__version__]).encode())
+    h.update(inspect.getsource(job.draw).encode())
+    # figure() and other helpers here shape every PNG too
+    h.update(inspect.getsource(inspect.getmodule(fingerprint)).encode())
+    _feed(h, job.kwargs)
+    _feed(h, job.save or {})
+    return h.hexdigest()
+
+
+def file_digest(path) -> str:
+    return hashlib.sha256(Path(path).read_bytes()).hexdigest()
+
+
+def load_manifest(directory: Path) -> dict:
+    path = directory / MANIFEST
+    try:
+        manifest = json.loads(path.read_text())
+    except (OSError, ValueError):
+        return {}  # missing, or unreadable: re-render everything and rewrite it
+    return manifest if isinstance(manifest, dict) else {}
+
+
+def save_manifest(directory: Path, entries: dict) -> None:
+    """Merge entries into the manifest under a lock; other plot scripts may be writing it concurrently."""
+    path = directory / MANIFEST
+    with open(directory / f'{MANIFEST}.lock', 'w') as lock:
+        if fcntl is not None:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+        manifest = {**load_manifest(directory), **entries}
+        with tempfile.NamedTemporaryFile('w', dir=directory, prefix=f'{MANIFEST}.', suffix='.partial',
+                                         delete=False) as tmp:
+            tmp.write(json.dumps(manifest, indent=2, sort_keys=True))
+        os.replace(tmp.name, path)
+
+
+def run_job(job: FigureJob) -> str:
+    fig = job.draw(**job.kwargs)
+    fig.savefig(job.path, **(job.save or {}))
+    return str(job.path)
+
+
+def render(jobs, workers: int = None, cache: bool = True, logger=None) -> dict:
+    """Render every job whose output is stale, in a process pool when there is more than one worker.
+
+    Returns {'hit': n, 'miss': n}; with a logger the counts are also logged.
+    """
+    jobs = list(jobs)
+    keys = [fingerprint(job) for job in jobs]
+    manifests = {}
+    todo = []
+    for job, key in zip(jobs, keys):
+        path = Path(job.path)
+        if path.parent not in manifests:
+            manifests[path.parent] = load_manifest(path.parent)
+        entry = manifests[path.parent].get(path.name)
+        if not (cache and entry and entry['key'] == key and path.exists() and file_digest(path) == entry['sha256']):
+            todo.append((job, key))
+    workers = workers or os.cpu_count() or 1
+    if workers > 1 and len(todo) > 1:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_use_agg) as pool:
+            list(pool.map(run_job, [job for job, _ in todo], chunksize=max(1, len(todo) // (workers * 4))))
+    else:
+        _use_agg()
+        for job, _ in todo:
+            run_job(job)
+    updates = {}
+    for job, key in todo:
+        path = Path(job.path)
+        updates.setdefault(path.parent, {})[path.name] = {'key': key, 'sha256': file_digest(path)}
+    for directory, entries in updates.items():
+        save_manifest(directory, entries)
+    stats = {'hit': len(jobs) - len(todo), 'miss': len(todo)}
+    if logger is not None:
+        logger.info(f"render cache: {stats['hit']} unchanged, {stats['miss']} rendered")
+    return stats